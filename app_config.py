@@ -0,0 +1,145 @@
+# Application settings and lazily built subsystems
+#
+# Config reads the environment once into upper-case attributes,
+# which create_app() in note.py copies into app.config:
+#
+#   create_app()                                   settings from the environment
+#   create_app(Config(DB_BACKEND='sqlite', PRELOAD=True))
+#
+# Lazy wraps a module-level object that is costly to build (mail, CAPTCHA
+# rendering, the DB pool, upload storage): the factory runs on first use,
+# reading app.config at that moment, so a process only pays for what its
+# requests actually touch.
+import os, threading
+from datetime import timedelta
+
+
+def _flag(value):
+    return value not in (None, "", "0", "false", "False", "no")
+
+
+class Config:
+    """Settings for create_app(); keyword arguments override the environment."""
+
+    def __init__(self, **overrides):
+        env = os.getenv
+        self.SECRET_KEY = env("FLASK_SECRET", "dev_secret_please_change")
+        self.PERMANENT_SESSION_LIFETIME = timedelta(days=7)
+        # build mail, CAPTCHAs, storage, DB pool and templates in create_app(), before workers fork
+        self.PRELOAD = _flag(env("APP_PRELOAD"))
+
+        # Mail
+        self.MAIL_SERVER = env("MAIL_SERVER", "smtp.gmail.com")
+        self.MAIL_PORT = int(env("MAIL_PORT", 587))
+        self.MAIL_USE_TLS = _flag(env("MAIL_USE_TLS", "1"))
+        self.MAIL_USERNAME = env("MAIL_USERNAME")
+        self.MAIL_PASSWORD = env("MAIL_PASSWORD")
+        self.MAIL_DEFAULT_SENDER = ("Flash Notes", self.MAIL_USERNAME)
+        self.MAIL_QUEUE_PATH = env("MAIL_QUEUE_PATH", os.path.join(os.getcwd(), 'mail_queue.db'))
+        self.MAIL_WORKERS = int(env("MAIL_WORKERS", 2))
+        self.MAIL_BATCH_SIZE = int(env("MAIL_BATCH_SIZE", 20))
+
+        # Uploads and previews
+        self.UPLOAD_FOLDER = env("UPLOAD_FOLDER", os.path.join(os.getcwd(), 'static/uploads'))
+        self.UPLOAD_MAX_BYTES = int(env("UPLOAD_MAX_BYTES", 512 * 1024 * 1024))
+        self.UPLOAD_MAX_CHUNK_BYTES = int(env("UPLOAD_MAX_CHUNK_BYTES", 8 * 1024 * 1024))
+        self.PREVIEW_CACHE_BYTES = int(env("PREVIEW_CACHE_BYTES", 512 * 1024 * 1024))
+        self.PREVIEW_WORKERS = int(env("PREVIEW_WORKERS", 2))
+
+        # Attachment downloads: '' = sent by the app, 'x-accel' = nginx X-Accel-Redirect
+        # to ATTACHMENT_ACCEL_PREFIX, 'x-sendfile' = Apache/lighttpd X-Sendfile
+        self.ATTACHMENT_OFFLOAD = env("ATTACHMENT_OFFLOAD", "").lower()
+        self.ATTACHMENT_ACCEL_PREFIX = env("ATTACHMENT_ACCEL_PREFIX", "/protected-uploads/")
+        self.RECONCILE_INTERVAL = int(env("RECONCILE_INTERVAL", 6 * 3600))
+        self.RECONCILE_GRACE_HOURS = int(env("RECONCILE_GRACE_HOURS", 48))
+        self.RECONCILE_QUARANTINE_DAYS = int(env("RECONCILE_QUARANTINE_DAYS", 7))
+        self.RECONCILE_RATE = int(env("RECONCILE_RATE", 500))
+        self.IMPORT_MAX_BYTES = int(env("IMPORT_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+        # Auth
+        self.CAPTCHA_POOL_SIZE = int(env("CAPTCHA_POOL_SIZE", 200))
+        self.HASH_METHOD = env("HASH_METHOD", "scrypt:32768:8:1")
+        self.AUTH_WORKERS = int(env("AUTH_WORKERS", 0))
+        self.LOGIN_RATE_ACCOUNT = env("LOGIN_RATE_ACCOUNT", "5/60")
+        self.LOGIN_RATE_IP = env("LOGIN_RATE_IP", "30/60")
+        self.API_TOKEN_TTL = int(env("API_TOKEN_TTL", 30 * 86400))
+        self.API_BATCH_MAX = int(env("API_BATCH_MAX", 100))
+        self.METRICS_TOKEN = env("METRICS_TOKEN")
+
+        # Note cache; NOTE_CACHE_VALIDATE None = check hits only if generations are per-process
+        # (no Redis and NOTE_CACHE_GEN_PATH set to '')
+        self.NOTE_CACHE_SIZE = int(env("NOTE_CACHE_SIZE", 10000))
+        self.NOTE_CACHE_TTL = int(env("NOTE_CACHE_TTL", 300))
+        self.NOTE_CACHE_REDIS_URL = env("NOTE_CACHE_REDIS_URL")
+        self.NOTE_CACHE_GEN_PATH = env("NOTE_CACHE_GEN_PATH", os.path.join(os.getcwd(), 'note_cache.db'))
+        self.NOTE_CACHE_VALIDATE = {'0': False, '1': True}.get(env("NOTE_CACHE_VALIDATE"))
+
+        # Background upkeep of stored notes
+        self.NOTE_COMPRESS_RATE = int(env("NOTE_COMPRESS_RATE", 200))
+        self.HISTORY_KEEP_DAYS = int(env("HISTORY_KEEP_DAYS", 30))
+        self.HISTORY_MAX_DAYS = int(env("HISTORY_MAX_DAYS", 365))
+        self.HISTORY_COMPACT_INTERVAL = int(env("HISTORY_COMPACT_INTERVAL", 6 * 3600))
+        self.TOMBSTONE_TTL_DAYS = int(env("TOMBSTONE_TTL_DAYS", 30))
+        self.TOMBSTONE_COMPACT_INTERVAL = int(env("TOMBSTONE_COMPACT_INTERVAL", 3600))
+
+        # Database
+        self.DB_BACKEND = env("DB_BACKEND", "mysql")
+        self.DB_SQLITE_PATH = env("DB_SQLITE_PATH", os.path.join(os.getcwd(), 'flaskdb.sqlite3'))
+        self.DB_HOST = env("DB_HOST", "localhost")
+        self.DB_USER = env("DB_USER", "root")
+        self.DB_PASS = env("DB_PASS", "")
+        self.DB_NAME = env("DB_NAME", "flaskdb")
+        self.DB_POOL_SIZE = int(env("DB_POOL_SIZE", 5))
+        self.DB_POOL_OVERFLOW = int(env("DB_POOL_OVERFLOW", 10))
+        self.DB_POOL_TIMEOUT = float(env("DB_POOL_TIMEOUT", 10))
+        self.DB_POOL_RECYCLE = int(env("DB_POOL_RECYCLE", 1800))
+        self.DB_REPLICA_HOSTS = env("DB_REPLICA_HOSTS", "")
+        self.DB_REPLICA_USER = env("DB_REPLICA_USER")
+        self.DB_REPLICA_PASS = env("DB_REPLICA_PASS")
+        self.DB_REPLICA_CONNECT_TIMEOUT = int(env("DB_REPLICA_CONNECT_TIMEOUT", 2))
+        self.DB_REPLICA_RETRY = int(env("DB_REPLICA_RETRY", 30))
+        self.DB_PRIMARY_PIN_SECONDS = int(env("DB_PRIMARY_PIN_SECONDS", 5))
+
+        for key, value in overrides.items():
+            if not hasattr(self, key):
+                raise TypeError(f"Unknown setting {key}")
+            setattr(self, key, value)
+
+
+class Lazy:
+    """
+    Proxy for an object built by `factory()` the first time one of its
+    attributes is used (once, under a lock; a factory that raises is retried
+    on the next use). instance() returns the object itself.
+    """
+
+    __slots__ = ('_factory', '_obj', '_lock')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_obj', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def instance(self):
+        obj = self._obj
+        if obj is None:
+            with self._lock:
+                if self._obj is None:
+                    object.__setattr__(self, '_obj', self._factory())
+                obj = self._obj
+        return obj
+
+    @property
+    def initialized(self):
+        return self._obj is not None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):           # copy / pickle probing a half-built proxy
+            raise AttributeError(name)
+        return getattr(self.instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instance(), name, value)
+
+    def __repr__(self):
+        return f"<Lazy {self._obj!r}>" if self._obj is not None else f"<Lazy {self._factory.__name__}, not built>"
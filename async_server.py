@@ -0,0 +1,389 @@
+# Asyncio front server for the WSGI app (slow-client tolerant serving mode)
+#
+# A thread-per-request server ties a worker thread (and often a pooled DB
+# connection) to every client for as long as that client takes to upload its
+# request and download the response, so a few hundred slow phones on mobile
+# links use up every thread. Here the event loop owns the sockets instead:
+#
+#   - request headers and body are read asynchronously; bodies over
+#     SPOOL_MEMORY go to a temp file, written from the I/O thread pool
+#   - only a complete request is handed to the app, on a bounded thread pool
+#   - the response is written back asynchronously with backpressure, reading
+#     file bodies (send_file) chunk by chunk from the I/O pool
+#
+# So a worker thread is busy only while the app itself runs, and one process
+# keeps thousands of idle or slow connections open. Mail is already sent from
+# the mail queue's own threads, never inside a request.
+#
+# The HTTP/1.1 handling is our own, not an existing async server's.
+#   - gevent workers would monkey-patch the MySQL driver and the app's own
+#     threads (mail queue, compactors).
+#   - ASGI servers need the app rewritten or wrapped in another dependency.
+# It covers what the app needs and no more: keep-alive, Content-Length and
+# chunked bodies, and 100-continue. Ambiguous requests are refused:
+#   - both Content-Length and Transfer-Encoding;
+#   - header names containing '_', which would alias a dashed name in the
+#     environ;
+#   - a Content-Length or chunk size that isn't plain digits ('-5', '+5',
+#     '0x5'), or a chunk not followed by CRLF.
+# That is not a hardened edge server. Run it behind a reverse proxy that
+# parses HTTP itself and streams (HAProxy, a cloud load balancer, nginx with
+# proxy_request_buffering / proxy_buffering off). A proxy that buffers whole
+# requests and responses already absorbs slow clients, so plain `python
+# note.py` workers are enough there.
+#
+#   python async_server.py --port 8000 --threads 16
+#   SERVER_MODE=async python note.py
+import argparse, asyncio, io, os, re, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+SPOOL_MEMORY = 1024 * 1024          # request bodies larger than this are spooled to disk
+READ_CHUNK = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+_DECIMAL = re.compile(r"[0-9]+")
+_HEX = re.compile(rb"[0-9A-Fa-f]+")
+REASONS = {100: 'Continue', 400: 'Bad Request', 408: 'Request Timeout', 411: 'Length Required',
+           413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncWSGIServer:
+    """
+    Serve a WSGI app from an asyncio event loop.
+
+      threads         : app calls running at once (size it like the DB pool)
+      max_connections : open client connections before new ones get a 503
+      max_body        : largest request body accepted (bytes)
+      header_timeout  : seconds a client may take to send its request headers
+      body_timeout    : seconds of silence allowed while a body is uploading or downloading
+      keepalive       : seconds an idle keep-alive connection is kept
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=8000, threads=16, max_connections=10_000,
+                 max_body=600 * 1024 * 1024, header_timeout=60, body_timeout=60, keepalive=15):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.max_body = max_body
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.keepalive = keepalive
+        self._app_pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+        self._io_pool = ThreadPoolExecutor(max(4, threads // 2), thread_name_prefix='wsgi-io')
+        self._server = None
+        self.connections = 0
+        self.requests = 0
+        self.rejected = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES, backlog=4096)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"🚀 Async server on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self._app_pool.shutdown(wait=False)
+        self._io_pool.shutdown(wait=False)
+
+    def stats(self):
+        return {'connections': self.connections, 'requests': self.requests, 'rejected': self.rejected}
+
+    # ---------- one connection ----------
+    async def _handle(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            await self._simple(writer, 503, close=True)
+            return
+        self.connections += 1
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            first = True
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  self.header_timeout if first else self.keepalive)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._simple(writer, 431, close=True)
+                    break
+                first = False
+                try:
+                    keep_alive = await self._request(reader, writer, head, peer)
+                except BadRequest as e:
+                    await self._simple(writer, e.status, close=True)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    await self._simple(writer, 400, close=True)     # chunked body cut short or malformed
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _request(self, reader, writer, head, peer):
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise BadRequest(400)
+        headers = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise BadRequest(400)
+            name = name.strip().lower()
+            if '_' in name:
+                continue        # X_Forwarded_For would become the same HTTP_ key as X-Forwarded-For
+            headers.append((name, value.strip()))
+        hmap = {}
+        for name, value in headers:
+            hmap[name] = f"{hmap[name]},{value}" if name in hmap else value
+
+        if 'transfer-encoding' in hmap and 'content-length' in hmap:
+            raise BadRequest(400)       # which one frames the body is exactly what smuggling exploits
+        if 'content-length' in hmap and not _DECIMAL.fullmatch(hmap['content-length']):
+            raise BadRequest(400)       # int() would take '-5' and '+5'; reader.read(-5) reads to EOF
+        connection = hmap.get('connection', '').lower()
+        keep_alive = (version == 'HTTP/1.1' and 'close' not in connection) or \
+                     (version == 'HTTP/1.0' and 'keep-alive' in connection)
+
+        if int(hmap.get('content-length', 0)) > self.max_body:
+            raise BadRequest(413)       # before inviting the body with 100-continue
+        if hmap.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        body, length = await self._read_body(reader, hmap)
+
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, 'latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'CONTENT_LENGTH': str(length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.input_terminated': True,
+        }
+        if 'content-type' in hmap:
+            environ['CONTENT_TYPE'] = hmap['content-type']
+        for name, value in hmap.items():
+            # the body handed on is already de-chunked and its length known
+            if name not in ('content-type', 'content-length', 'transfer-encoding'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        loop = asyncio.get_running_loop()
+        try:
+            status, response_headers, chunks = await loop.run_in_executor(self._app_pool, self._call_app, environ)
+        finally:
+            body.close()
+        self.requests += 1
+        return await self._respond(writer, method, version, keep_alive, status, response_headers, chunks,
+                                   environ['PATH_INFO'])
+
+    async def _read_body(self, reader, hmap):
+        """The request body as a seekable file (memory, or a temp file past SPOOL_MEMORY)."""
+        loop = asyncio.get_running_loop()
+        spool = io.BytesIO()
+        size = 0
+
+        async def add(chunk):
+            nonlocal spool, size
+            size += len(chunk)
+            if size > self.max_body:
+                raise BadRequest(413)
+            if isinstance(spool, io.BytesIO) and size > SPOOL_MEMORY:
+                disk = tempfile.TemporaryFile()
+                await loop.run_in_executor(self._io_pool, disk.write, spool.getvalue())
+                spool = disk
+            if isinstance(spool, io.BytesIO):
+                spool.write(chunk)
+            else:
+                await loop.run_in_executor(self._io_pool, spool.write, chunk)
+
+        async def read(n):
+            data = await asyncio.wait_for(reader.read(n), self.body_timeout)
+            if not data:
+                raise ConnectionError("client went away mid-body")
+            return data
+
+        if 'chunked' in hmap.get('transfer-encoding', '').lower():
+            while True:
+                line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.body_timeout)
+                digits = line.split(b';', 1)[0].strip()
+                if not _HEX.fullmatch(digits):
+                    raise BadRequest(400)
+                remaining = int(digits, 16)
+                if remaining == 0:
+                    # optional trailer fields, then the blank line
+                    while await asyncio.wait_for(reader.readuntil(b'\r\n'), self.body_timeout) != b'\r\n':
+                        pass
+                    break
+                while remaining:
+                    chunk = await read(min(remaining, READ_CHUNK))
+                    remaining -= len(chunk)
+                    await add(chunk)
+                if await asyncio.wait_for(reader.readexactly(2), self.body_timeout) != b'\r\n':
+                    raise BadRequest(400)
+        elif 'content-length' in hmap:
+            remaining = int(hmap['content-length'])         # digits only, checked in _request
+            if remaining > self.max_body:
+                raise BadRequest(413)
+            while remaining:
+                chunk = await read(min(remaining, READ_CHUNK))
+                remaining -= len(chunk)
+                await add(chunk)
+        spool.seek(0)
+        return spool, size
+
+    def _call_app(self, environ):
+        """Runs in the app pool: call the app; small bodies are joined here, iterables come back."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = status, headers
+            return lambda data: started.setdefault('written', []).append(data)
+
+        try:
+            result = self.app(environ, start_response)
+        except Exception as e:
+            print(f"❌ Unhandled error in {environ['PATH_INFO']}: {e}")
+            return '500 Internal Server Error', [('Content-Type', 'text/plain')], [b'Internal Server Error']
+        prefix = started.get('written', [])
+        if isinstance(result, (list, tuple)):
+            return started['status'], started['headers'], prefix + list(result)
+        # streamed (files, generators): pull chunks from the I/O pool as the client takes them
+        return started['status'], started['headers'], _Chained(prefix, result)
+
+    async def _respond(self, writer, method, version, keep_alive, status, headers, chunks, path=''):
+        loop = asyncio.get_running_loop()
+        names = {name.lower() for name, _ in headers}
+        chunked = False
+        if 'content-length' not in names:
+            if isinstance(chunks, list):
+                headers = headers + [('Content-Length', str(sum(len(c) for c in chunks)))]
+            elif version == 'HTTP/1.1':
+                headers = headers + [('Transfer-Encoding', 'chunked')]
+                chunked = True
+            else:
+                keep_alive = False
+        headers = headers + [('Connection', 'keep-alive' if keep_alive else 'close')]
+        head = f"{version} {status}\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n"
+        writer.write(head.encode('latin-1'))
+
+        send_body = method != 'HEAD' and not status.startswith(('204', '304'))
+        try:
+            if isinstance(chunks, list):
+                if send_body:
+                    writer.write(b''.join(chunks))
+                await asyncio.wait_for(writer.drain(), self.body_timeout)
+            else:
+                while True:
+                    try:
+                        chunk = await loop.run_in_executor(self._io_pool, next, chunks, None)
+                    except Exception as e:
+                        # the status line is out: cut the connection so the client sees a truncated body
+                        print(f"❌ Error while streaming {path}: {e}")
+                        writer.transport.abort()
+                        return False
+                    if chunk is None:
+                        break
+                    if not chunk or not send_body:
+                        continue
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await asyncio.wait_for(writer.drain(), self.body_timeout)
+                if chunked and send_body:
+                    writer.write(b'0\r\n\r\n')
+                await asyncio.wait_for(writer.drain(), self.body_timeout)
+        finally:
+            if not isinstance(chunks, list):
+                await loop.run_in_executor(self._io_pool, chunks.close)
+        return keep_alive
+
+    async def _simple(self, writer, status, close=False):
+        reason = REASONS.get(status, '')
+        body = f"{status} {reason}\n".encode()
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        if close:
+            writer.close()
+
+
+class _Chained:
+    """Iterator over bytes already written via write() and then the app's iterable."""
+
+    def __init__(self, prefix, result):
+        self._prefix = list(prefix)
+        self._result = result
+        self._iter = iter(result)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._prefix:
+            return self._prefix.pop(0)
+        return next(self._iter)
+
+    def close(self):
+        if hasattr(self._result, 'close'):
+            self._result.close()
+
+
+def serve(app, host='127.0.0.1', port=8000, **options):
+    """Run the app under the async server until interrupted."""
+    try:
+        asyncio.run(AsyncWSGIServer(app, host, port, **options).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Serve note.py from an asyncio event loop")
+    ap.add_argument('--host', default=os.getenv("SERVER_HOST", '127.0.0.1'))
+    ap.add_argument('--port', type=int, default=int(os.getenv("SERVER_PORT", 8000)))
+    ap.add_argument('--threads', type=int, default=int(os.getenv("SERVER_THREADS", 16)),
+                    help="app calls running at once (match DB_POOL_SIZE + DB_POOL_OVERFLOW)")
+    ap.add_argument('--max-connections', type=int, default=int(os.getenv("SERVER_MAX_CONNECTIONS", 10_000)))
+    args = ap.parse_args()
+    from note import app
+    serve(app, args.host, args.port, threads=args.threads, max_connections=args.max_connections)
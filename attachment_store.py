@@ -0,0 +1,285 @@
+# Content-addressed attachment storage
+#
+# Uploads are hashed (SHA-256) while they stream to disk and stored once under
+# a two-level sharded tree:  uploads/ab/cd/abcd…ef.webm
+# Which note uses which blob lives in `note_attachments`; `attachment_blobs`
+# keeps a reference count per blob so a file is unlinked only when the last
+# note that points at it goes away.
+import hashlib, os, sys, tempfile, time
+from werkzeug.utils import secure_filename
+
+CHUNK_SIZE = 64 * 1024
+REUSE_GRACE = 10 * 60       # remove() leaves blobs touched this recently to the reconciler
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS attachment_blobs (
+        blob_key   VARCHAR(80)  NOT NULL PRIMARY KEY,
+        size       BIGINT       NOT NULL,
+        refcount   INT          NOT NULL DEFAULT 0,
+        created_at DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS note_attachments (
+        id         INT AUTO_INCREMENT PRIMARY KEY,
+        note_id    INT          NOT NULL,
+        blob_key   VARCHAR(80)  NOT NULL,
+        filename   VARCHAR(255) NOT NULL,
+        size       BIGINT       NOT NULL,
+        created_at DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_note_attachments_note (note_id),
+        KEY idx_note_attachments_blob (blob_key)
+    ) ENGINE=InnoDB
+    """,
+]
+
+
+def static_path(blob_key):
+    """Path of a blob under static/ ('uploads/ab/cd/<key>')."""
+    return f"uploads/{blob_key[:2]}/{blob_key[2:4]}/{blob_key}"
+
+
+def file_ext(filename):
+    """Lower-cased extension without the dot ('' if none)."""
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+class AttachmentStore:
+    """Blob storage on the local filesystem, addressed by content hash."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def relpath(self, blob_key):
+        """Path of a blob relative to the store root ('ab/cd/<key>')."""
+        return os.path.join(blob_key[:2], blob_key[2:4], blob_key)
+
+    def path(self, blob_key):
+        return os.path.join(self.root, self.relpath(blob_key))
+
+    def put(self, stream, filename):
+        """
+        Copy `stream` to disk in chunks while hashing it. Returns (blob_key, size).
+        If an identical blob already exists the new copy is dropped.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            ext = file_ext(filename)
+            blob_key = digest.hexdigest() + (f".{ext}" if ext else '')
+            if self.touch(blob_key):
+                os.remove(tmp_path)
+            else:
+                final = self.path(blob_key)
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(tmp_path, final)
+            return blob_key, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def adopt(self, src_path, filename, expected_sha256=None):
+        """
+        Move an already-written file into the store without copying it.
+        Returns (blob_key, size), or (None, size) if `expected_sha256` does not
+        match, in which case the file is left where it is.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(src_path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            return None, size
+
+        ext = file_ext(filename)
+        blob_key = digest.hexdigest() + (f".{ext}" if ext else '')
+        if self.touch(blob_key):
+            os.remove(src_path)
+        else:
+            final = self.path(blob_key)
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(src_path, final)
+        return blob_key, size
+
+    def touch(self, blob_key):
+        """
+        Mark an existing blob as in use again (keeps remove() and the
+        reconciler's grace period off it). False if the file isn't there.
+        """
+        try:
+            os.utime(self.path(blob_key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save_upload(self, file):
+        """Store a Werkzeug FileStorage. Returns (blob_key, safe filename, size)."""
+        filename = secure_filename(file.filename) or 'file'
+        blob_key, size = self.put(file.stream, filename)
+        return blob_key, filename, size
+
+    def remove(self, blob_keys, grace=REUSE_GRACE):
+        """
+        Unlink blobs released by a committed transaction; returns the keys removed.
+        Each file is first moved aside, so a put()/adopt() of the same content
+        racing with us either touched it before (it is moved back and left to
+        the reconciler) or finds it gone and writes its own copy.
+        """
+        removed = []
+        for key in blob_keys:
+            final = self.path(key)
+            aside = os.path.join(self.tmp_dir, f"{key}.{os.getpid()}.removed")
+            try:
+                os.replace(final, aside)
+            except FileNotFoundError:
+                continue
+            if time.time() - os.stat(aside).st_mtime < grace:
+                os.replace(aside, final)
+            else:
+                os.remove(aside)
+                removed.append(key)
+        return removed
+
+
+# ---------- DB helpers (dictionary cursors, caller's transaction) ----------
+def ensure_schema(db):
+    cursor = db.cursor()
+    for ddl in SCHEMA:
+        cursor.execute(ddl)
+    cursor.close()
+
+
+def attach(cursor, note_id, blob_key, filename, size):
+    """Link a stored blob to a note and take a reference on it."""
+    cursor.execute("""
+        INSERT INTO attachment_blobs (blob_key, size, refcount) VALUES (%s, %s, 1)
+        ON DUPLICATE KEY UPDATE refcount = refcount + 1
+    """, (blob_key, size))
+    cursor.execute(
+        "INSERT INTO note_attachments (note_id, blob_key, filename, size) VALUES (%s, %s, %s, %s)",
+        (note_id, blob_key, filename, size))
+
+
+def list_attachments(cursor, note_id):
+    """Attachments of a note as dicts with id, filename, ext, size and static path."""
+    cursor.execute(
+        "SELECT id, blob_key, filename, size FROM note_attachments WHERE note_id=%s ORDER BY id",
+        (note_id,))
+    rows = []
+    for row in cursor.fetchall():
+        key = row['blob_key']
+        row['ext'] = file_ext(row['filename'])
+        row['path'] = static_path(key)
+        rows.append(row)
+    return rows
+
+
+def detach(cursor, note_id, attachment_ids=None):
+    """
+    Unlink attachments from a note (all of them when attachment_ids is None)
+    and drop their references. Returns the blob keys released; pass them to
+    collect_dead() once every attach() of the transaction has run.
+    """
+    sql = "SELECT id, blob_key FROM note_attachments WHERE note_id=%s"
+    params = [note_id]
+    if attachment_ids is not None:
+        if not attachment_ids:
+            return []
+        sql += " AND id IN (" + ", ".join(["%s"] * len(attachment_ids)) + ")"
+        params += list(attachment_ids)
+    cursor.execute(sql + " FOR UPDATE", params)
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    ids = [r['id'] for r in rows]
+    keys = [r['blob_key'] for r in rows]
+
+    marks = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"DELETE FROM note_attachments WHERE id IN ({marks})", ids)
+    for key in keys:
+        cursor.execute("UPDATE attachment_blobs SET refcount = refcount - 1 WHERE blob_key=%s", (key,))
+    return sorted(set(keys))
+
+
+def collect_dead(cursor, blob_keys):
+    """
+    Drop the attachment_blobs rows of released blobs that no note references
+    any more, right before the commit (a blob detached and attached again in
+    the same transaction survives). Returns the keys whose files remove() may
+    unlink once the transaction has committed.
+    """
+    unique = sorted(set(blob_keys))
+    if not unique:
+        return []
+    marks = ", ".join(["%s"] * len(unique))
+    cursor.execute(
+        f"SELECT blob_key FROM attachment_blobs WHERE blob_key IN ({marks}) AND refcount <= 0 FOR UPDATE",
+        unique)
+    dead = [r['blob_key'] for r in cursor.fetchall()]
+    if dead:
+        marks = ", ".join(["%s"] * len(dead))
+        cursor.execute(f"DELETE FROM attachment_blobs WHERE blob_key IN ({marks})", dead)
+    return dead
+
+
+# ---------- one-off migration from the old comma-joined column ----------
+def migrate_legacy(db, store, legacy_dir):
+    """
+    Move every file listed in notes.attachments into the store, record it in
+    note_attachments and clear the old column. Legacy files are deleted once
+    all notes have been migrated. Returns (notes migrated, files missing).
+    """
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("SELECT id, attachments FROM notes WHERE attachments IS NOT NULL AND attachments <> ''")
+    pending = cursor.fetchall()
+    migrated, missing, legacy_files = 0, [], set()
+
+    for note in pending:
+        for name in filter(None, note['attachments'].split(',')):
+            src = os.path.join(legacy_dir, name)
+            if not os.path.isfile(src):
+                missing.append(name)
+                continue
+            with open(src, 'rb') as fh:
+                blob_key, size = store.put(fh, name)
+            attach(cursor, note['id'], blob_key, name, size)
+            legacy_files.add(src)
+        cursor.execute("UPDATE notes SET attachments=NULL WHERE id=%s", (note['id'],))
+        db.commit()
+        migrated += 1
+
+    cursor.close()
+    for src in legacy_files:
+        os.remove(src)
+    return migrated, missing
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        print("usage: python attachment_store.py migrate")
+        sys.exit(1)
+    from note import get_db_connection, attachment_store
+    db = get_db_connection()
+    ensure_schema(db)
+    start = time.time()
+    count, missing = migrate_legacy(db, attachment_store, attachment_store.root)
+    db.close()
+    print(f"✅ Migrated {count} notes in {time.time() - start:.1f}s")
+    if missing:
+        print(f"⚠️ {len(missing)} referenced files were missing: {', '.join(missing[:20])}")
@@ -0,0 +1,114 @@
+# Password hashing off the request threads + login rate limiting
+#
+# The KDF runs in a small process pool (per app worker, so keep it small) and
+# a burst of logins doesn't hold the GIL against other requests. HASH_METHOD sets the
+# cost (any Werkzeug method string, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000"); hashes made with older parameters are upgraded
+# the next time their owner logs in. Token buckets per account and per IP
+# turn away abusive attempts before any hashing happens.
+import multiprocessing, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+DEFAULT_WORKERS = 2
+
+
+def normalize_method(method):
+    """
+    Spell out the parameters Werkzeug fills in, as it writes them into a hash:
+    'scrypt' -> 'scrypt:32768:8:1', 'pbkdf2:sha256' -> 'pbkdf2:sha256:<iterations>'.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return "scrypt:32768:8:1"
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """Werkzeug hashing dispatched to a lazily started process pool."""
+
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=None, timeout=30):
+        self.method = method
+        self.workers = workers or DEFAULT_WORKERS
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # one pool per process: a forked worker must not reuse its parent's pool
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._pool
+
+    def hash(self, password):
+        return self._executor().submit(generate_password_hash, password, self.method).result(self.timeout)
+
+    def check(self, pw_hash, password):
+        return self._executor().submit(check_password_hash, pw_hash, password).result(self.timeout)
+
+    def needs_rehash(self, pw_hash):
+        """True when the stored hash was made with different parameters than `method`."""
+        return normalize_method(pw_hash.split('$', 1)[0]) != normalize_method(self.method)
+
+    def warm_up(self):
+        """Start every worker process now instead of on the first login."""
+        pool = self._executor()
+        list(pool.map(abs, range(self.workers)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class TokenBucketLimiter:
+    """
+    `capacity` attempts, refilled at `capacity / period` per second, per key.
+    Buckets are kept in an LRU capped at max_keys so memory stays bounded.
+    """
+
+    def __init__(self, capacity, period, max_keys=100_000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()      # key -> (tokens, last_refill)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take one token for `key`; False if the bucket is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def retry_after(self, key):
+        """Seconds until `key` has a token again."""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, time.monotonic()))
+        missing = 1 - (tokens + (time.monotonic() - last) * self.rate)
+        return max(0, int(missing / self.rate) + 1) if missing > 0 else 0
+
+
+def parse_rate(spec, default):
+    """'5/60' -> (5, 60.0): five attempts per sixty seconds."""
+    try:
+        count, period = (spec or default).split('/')
+        return int(count), float(period)
+    except ValueError:
+        count, period = default.split('/')
+        return int(count), float(period)
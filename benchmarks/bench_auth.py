@@ -0,0 +1,66 @@
+"""
+Login throughput: password checks per second under concurrent requests.
+
+    python benchmarks/bench_auth.py [--threads 16] [--seconds 5] [--method scrypt:32768:8:1]
+
+  inline : check_password_hash on the request threads (the old login path)
+  pool   : auth_utils.PasswordHasher, KDF in a process pool
+  limited: same as pool, but every request uses one account, so the
+           token bucket turns most attempts away before hashing
+"""
+import argparse, os, sys, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from auth_utils import PasswordHasher, TokenBucketLimiter
+
+
+def run(check, threads, seconds):
+    done = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        while time.perf_counter() < stop:
+            check()
+            done[i] += 1
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(done) / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--threads', type=int, default=16)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--method', default="scrypt:32768:8:1")
+    args = ap.parse_args()
+
+    pw_hash = generate_password_hash("correct horse", args.method)
+    hasher = PasswordHasher(args.method)
+    hasher.warm_up()
+    limiter = TokenBucketLimiter(5, 60)
+
+    def limited():
+        if limiter.allow("alice"):
+            hasher.check(pw_hash, "correct horse")
+
+    results = {
+        'inline': run(lambda: check_password_hash(pw_hash, "correct horse"), args.threads, args.seconds),
+        'pool': run(lambda: hasher.check(pw_hash, "correct horse"), args.threads, args.seconds),
+        'limited': run(limited, args.threads, args.seconds),
+    }
+    hasher.shutdown()
+
+    print(f"{args.threads} threads, {hasher.workers} KDF processes, {args.method}")
+    print(f"{'path':<9}{'logins/s':>12}")
+    for name, r in results.items():
+        print(f"{name:<9}{r:>12,.1f}")
+
+
+if __name__ == '__main__':
+    main()
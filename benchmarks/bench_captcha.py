@@ -0,0 +1,72 @@
+"""
+CAPTCHA microbenchmark: renders per second before and after the rework.
+
+    python benchmarks/bench_captcha.py [--seconds 3]
+
+  legacy  : the original per-request path (font load from disk, 150
+            draw.point calls, default PNG compression)
+  render  : captcha_utils.render_captcha_png (cached font, array noise)
+  pool    : CaptchaPool.get(), i.e. what /captcha now does per request
+"""
+import argparse, io, os, random, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont
+from captcha_utils import CaptchaPool, generate_captcha_text, render_captcha_png
+
+
+def legacy_captcha_image(text):
+    """Verbatim copy of the pre-pool generate_captcha_image."""
+    width, height = 160, 60
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype("arial.ttf", 30)
+    except Exception:
+        font = ImageFont.load_default()
+    for i, ch in enumerate(text):
+        x = 12 + i * 22 + random.randint(-2, 2)
+        y = random.randint(0, 12)
+        draw.text((x, y), ch, font=font, fill=(random.randint(0, 120), random.randint(0, 120), random.randint(0, 120)))
+    for _ in range(150):
+        draw.point((random.randint(0, width), random.randint(0, height)),
+                   fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    buf.seek(0)
+    return buf
+
+
+def rate(fn, seconds):
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--seconds', type=float, default=3.0)
+    args = ap.parse_args()
+
+    legacy = rate(lambda: legacy_captcha_image(generate_captcha_text()), args.seconds)
+    render = rate(lambda: render_captcha_png(generate_captcha_text()), args.seconds)
+
+    # pops only: stay above low_water so the refill thread never competes
+    pool = CaptchaPool(size=2000, low_water=0)
+    pool.fill()
+    pops = 1500
+    start = time.perf_counter()
+    for _ in range(pops):
+        pool.get()
+    served = pops / (time.perf_counter() - start)
+
+    print(f"{'path':<8}{'per second':>14}{'speed-up':>10}")
+    for name, r in (('legacy', legacy), ('render', render), ('pool', served)):
+        print(f"{name:<8}{r:>14,.0f}{r / legacy:>9.1f}x")
+    print(f"(pool misses during run: {pool.misses})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Note body compression: storage and transfer, plain vs note_codec.
+
+Builds the same synthetic corpus twice in scratch SQLite files (the
+sqlite_backend schema): once with every body stored plain, as before, and
+once through note_codec.encode(). Then it compares
+
+  storage  : body bytes per size class, and database file size
+  list     : a dashboard page, old query (LEFT/CHAR_LENGTH of content) vs the stored excerpt
+  note     : fetching one note, plain text vs the compressed column
+  sync     : a 500-note sync page
+  cpu      : encode / decode time of a long note
+
+    python benchmarks/bench_compression.py --users 20 --notes-per-user 500 --long-ratio 0.2
+
+Short notes follow datagen.py. Long ones imitate speech-to-text transcripts:
+1,500-6,000 words drawn Zipf-like from a 5,000-word vocabulary, which
+compresses less well than datagen's 50 words.
+"""
+import argparse, json, os, platform, random, sqlite3, statistics, sys, tempfile, time
+from datetime import datetime, timedelta
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen, note_codec, sqlite_backend
+
+SYLLABLES = "ka ri to mo na shi te lu ven por al es ta re in con de pro ment ion at er".split()
+BUCKETS = (('short', 0, 1024), ('medium', 1024, 8192), ('long', 8192, None))
+
+# dashboard page before and after: excerpt cut from the body vs the stored one
+OLD_LIST = """
+    SELECT id, title, create_at, LEFT(content, 120) AS excerpt, CHAR_LENGTH(content) > 120 AS truncated
+    FROM notes WHERE user_id=%s ORDER BY create_at DESC, id DESC LIMIT 25
+"""
+NEW_LIST = """
+    SELECT id, title, create_at, LEFT(excerpt, 120) AS excerpt, content_chars > 120 AS truncated
+    FROM notes WHERE user_id=%s ORDER BY create_at DESC, id DESC LIMIT 25
+"""
+
+
+def vocabulary(rng, size=5000):
+    return [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+
+def transcript(rng, vocab, weights):
+    words = rng.choices(vocab, weights, k=rng.randint(1500, 6000))
+    out, i = [], 0
+    while i < len(words):           # sentences of 6-20 words
+        n = rng.randint(6, 20)
+        out.append(' '.join(words[i:i + n]).capitalize() + '.')
+        i += n
+    return ' '.join(out)
+
+
+def corpus(users, notes_per_user, long_ratio, seed):
+    rng = random.Random(seed)
+    vocab = vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    now = datetime.now()
+    for user_id in range(1, users + 1):
+        for _ in range(notes_per_user):
+            body = transcript(rng, vocab, weights) if rng.random() < long_ratio \
+                else datagen.sentence(rng, rng.randint(20, 200))
+            yield (datagen.sentence(rng, rng.randint(2, 6)).title(), body, user_id,
+                   now - timedelta(seconds=rng.randint(0, 365 * 86400)))
+
+
+def build(path, rows, min_size):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    sqlite_backend.ensure_schema(path)
+    conn = sqlite3.connect(path)
+    sql = ("INSERT INTO notes (title, content, content_z, content_format, excerpt, content_chars, search_terms, "
+           "user_id, create_at, change_seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    stored = {name: [0, 0, 0] for name, _, _ in BUCKETS}        # notes, raw bytes, stored bytes
+    batch = []
+    for seq, (title, body, user_id, created) in enumerate(rows, 1):
+        fields = note_codec.encode(body, min_size)
+        raw = len(body.encode('utf-8'))
+        size = sum(len(v.encode('utf-8')) if isinstance(v, str) else len(v)
+                   for v in (fields['content'], fields['content_z'], fields['search_terms']) if v is not None)
+        for name, low, high in BUCKETS:
+            if raw >= low and (high is None or raw < high):
+                stored[name][0] += 1
+                stored[name][1] += raw
+                stored[name][2] += size
+        batch.append((title, *(fields[c] for c in note_codec.BODY_COLUMNS), user_id,
+                      created.strftime(sqlite_backend.TIME_FMT), seq))
+        if len(batch) >= 1000:
+            conn.executemany(sql, batch)
+            batch.clear()
+    conn.executemany(sql, batch)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return stored
+
+
+def fetched_bytes(rows):
+    return sum(len(v) if isinstance(v, (bytes, str)) else 8 for row in rows for v in row if v is not None)
+
+
+def timed(cursor, sql, params_list):
+    samples, size = [], 0
+    for params in params_list:
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+        size += fetched_bytes(rows)
+    return {'p50_ms': round(statistics.median(samples), 3), 'bytes_per_query': size // len(params_list)}
+
+
+def measure(path, list_sql, users, note_ids, rng):
+    conn = sqlite_backend.connect(path)         # speaks the app's MySQL dialect
+    cursor = conn.cursor()
+    user_params = [(rng.randint(1, users),) for _ in range(200)]
+    note_params = [(rng.choice(note_ids),) for _ in range(500)]
+    out = {
+        'file_bytes': os.path.getsize(path),
+        'list': timed(cursor, list_sql, user_params),
+        'note': timed(cursor, "SELECT title, content, content_format, content_z FROM notes WHERE id=%s", note_params),
+        'sync': timed(cursor, "SELECT id, title, content, content_format, content_z FROM notes "
+                              "WHERE user_id=%s ORDER BY change_seq LIMIT 500", user_params[:50]),
+    }
+    cursor.close()
+    conn.close()
+    return out
+
+
+def cpu(rng, rounds=200):
+    vocab = vocabulary(rng)
+    text = transcript(rng, vocab, [1 / (r + 1) for r in range(len(vocab))])
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fields = note_codec.encode(text)
+    encode_ms = (time.perf_counter() - start) * 1000 / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        str(note_codec.LazyBody(fields['content_format'], fields['content_z']))
+    decode_ms = (time.perf_counter() - start) * 1000 / rounds
+    return {'chars': len(text), 'encode_ms': round(encode_ms, 3), 'decode_ms': round(decode_ms, 3),
+            'codec': note_codec.FORMAT_NAMES[fields['content_format']]}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--users', type=int, default=20)
+    ap.add_argument('--notes-per-user', type=int, default=500)
+    ap.add_argument('--long-ratio', type=float, default=0.2, help="share of notes that are long transcripts")
+    ap.add_argument('--min-size', type=int, default=note_codec.COMPRESS_MIN, help="compression threshold (bytes)")
+    ap.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'notes_compression'))
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help="write results as JSON")
+    args = ap.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    plain_path = os.path.join(args.workdir, 'plain.sqlite3')
+    packed_path = os.path.join(args.workdir, 'packed.sqlite3')
+    t0 = time.perf_counter()
+    make = lambda: corpus(args.users, args.notes_per_user, args.long_ratio, args.seed)
+    storage = {'plain': build(plain_path, make(), 0), 'compressed': build(packed_path, make(), args.min_size)}
+    print(f"built {args.users * args.notes_per_user} notes twice in {time.perf_counter() - t0:.1f}s")
+
+    note_ids = list(range(1, args.users * args.notes_per_user + 1))
+    results = {
+        'plain': measure(plain_path, OLD_LIST, args.users, note_ids, random.Random(args.seed)),
+        'compressed': measure(packed_path, NEW_LIST, args.users, note_ids, random.Random(args.seed)),
+    }
+
+    print(f"\n{'bodies':<8}{'notes':>8}{'raw MB':>10}{'stored MB':>11}{'saved':>8}")
+    for name, _, _ in BUCKETS:
+        count, raw, _ = storage['plain'][name]
+        stored = storage['compressed'][name][2]
+        if count:
+            print(f"{name:<8}{count:>8}{raw / 1e6:>10.2f}{stored / 1e6:>11.2f}{(1 - stored / raw) * 100:>7.1f}%")
+    plain, packed = results['plain'], results['compressed']
+    print(f"{'db file':<8}{'':>8}{plain['file_bytes'] / 1e6:>10.2f}{packed['file_bytes'] / 1e6:>11.2f}"
+          f"{(1 - packed['file_bytes'] / plain['file_bytes']) * 100:>7.1f}%")
+
+    print(f"\n{'query':<8}{'plain B':>12}{'new B':>12}{'plain ms':>10}{'new ms':>10}")
+    for q in ('list', 'note', 'sync'):
+        print(f"{q:<8}{plain[q]['bytes_per_query']:>12,}{packed[q]['bytes_per_query']:>12,}"
+              f"{plain[q]['p50_ms']:>10.3f}{packed[q]['p50_ms']:>10.3f}")
+    costs = cpu(random.Random(args.seed))
+    print(f"\nlong note ({costs['chars']:,} chars, {costs['codec']}): encode {costs['encode_ms']} ms, "
+          f"decode {costs['decode_ms']} ms")
+
+    if args.out:
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': {k: v for k, v in vars(args).items() if k != 'out'},
+            },
+            'storage': storage, 'queries': results, 'cpu': costs,
+        }
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
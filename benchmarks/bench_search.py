@@ -0,0 +1,133 @@
+"""
+Search benchmark: old `LIKE '%kw%'` scan vs. FULLTEXT search (search_utils).
+
+Builds a synthetic corpus in a scratch database (never the app database),
+then times both queries for the same random keywords and users.
+
+    python benchmarks/bench_search.py --notes 1000000 --users 1000 --queries 200
+
+Uses DB_HOST / DB_USER / DB_PASS from .env and BENCH_DB_NAME (default
+flaskdb_bench). Pass --reuse to skip corpus generation on later runs.
+"""
+import argparse, os, random, statistics, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from dotenv import load_dotenv
+from note_codec import encode_values
+from search_utils import ensure_indexes, fulltext_search
+
+WORDS = ("meeting project budget travel recipe grocery lecture physics chemistry invoice "
+         "holiday birthday reminder doctor workout running python flask database index "
+         "garden music guitar piano novel chapter review feedback release deploy server "
+         "client design sketch family weekend morning evening coffee library exam notes").split()
+
+
+def connect(database=None):
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        user=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASS", ""),
+        database=database,
+    )
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def build_corpus(db, notes, users, batch=5000):
+    cursor = db.cursor()
+    cursor.execute("DROP TABLE IF EXISTS notes")
+    cursor.execute("""
+        CREATE TABLE notes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            content TEXT,
+            content_z MEDIUMBLOB NULL,
+            content_format TINYINT NOT NULL DEFAULT 0,
+            excerpt VARCHAR(255) NOT NULL DEFAULT '',
+            content_chars INT NOT NULL DEFAULT 0,
+            search_terms MEDIUMTEXT NULL,
+            attachments TEXT,
+            create_at DATETIME NOT NULL,
+            KEY idx_notes_user_created (user_id, create_at)
+        ) ENGINE=InnoDB
+    """)
+    rng = random.Random(42)
+    sql = ("INSERT INTO notes (user_id, title, content, content_z, content_format, excerpt, content_chars, "
+           "search_terms, create_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW() - INTERVAL %s SECOND)")
+    rows = []
+    for i in range(notes):
+        rows.append((rng.randint(1, users), sentence(rng, 4), *encode_values(sentence(rng, rng.randint(20, 200))), i))
+        if len(rows) >= batch:
+            cursor.executemany(sql, rows); db.commit(); rows = []
+    if rows:
+        cursor.executemany(sql, rows); db.commit()
+    cursor.close()
+    print("building FULLTEXT indexes ...")
+    ensure_indexes(db)
+
+
+def like_search(cursor, user_id, keyword):
+    like = f"%{keyword}%"
+    cursor.execute("""
+        SELECT * FROM notes
+        WHERE user_id=%s AND (title LIKE %s OR content LIKE %s OR search_terms LIKE %s)
+        ORDER BY create_at DESC
+    """, (user_id, like, like, like))
+    return cursor.fetchall()
+
+
+def timed(fn, cases):
+    samples = []
+    for args in cases:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 2),
+        'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 2),
+        'mean_ms': round(statistics.fmean(samples), 2),
+    }
+
+
+def main():
+    load_dotenv()
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--notes', type=int, default=1_000_000)
+    ap.add_argument('--users', type=int, default=1000)
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--reuse', action='store_true', help="keep the existing bench corpus")
+    args = ap.parse_args()
+
+    bench_db = os.getenv("BENCH_DB_NAME", "flaskdb_bench")
+    admin = connect()
+    admin.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {bench_db}")
+    admin.close()
+    db = connect(bench_db)
+
+    if not args.reuse:
+        start = time.perf_counter()
+        print(f"generating {args.notes:,} notes for {args.users:,} users ...")
+        build_corpus(db, args.notes, args.users)
+        print(f"corpus ready in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(7)
+    cases = [(rng.randint(1, args.users), ' '.join(rng.sample(WORDS, rng.choice([1, 2]))))
+             for _ in range(args.queries)]
+    cursor = db.cursor(dictionary=True)
+
+    like = timed(lambda uid, q: like_search(cursor, uid, q), cases)
+    fts = timed(lambda uid, q: fulltext_search(cursor, uid, q), cases)
+    cursor.close(); db.close()
+
+    print(f"\n{'query':<10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, r in (('LIKE', like), ('FULLTEXT', fts)):
+        print(f"{name:<10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['mean_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
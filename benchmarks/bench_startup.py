@@ -0,0 +1,150 @@
+"""
+Worker startup: import time, create_app() time and time-to-first-response.
+
+Each run is a fresh interpreter that imports note, calls create_app() and
+then forks --workers workers, as a pre-forking server does; each worker
+times the first request of every route. Modes:
+
+  lazy     : create_app(); mail, CAPTCHA, storage and the DB pool are built by
+             the first request that needs them
+  preload  : create_app(Config(PRELOAD=True)); all of it is built before the
+             fork and shared copy-on-write (each worker still renders its own
+             CAPTCHAs)
+
+    python benchmarks/bench_startup.py --runs 5 --workers 2
+    python benchmarks/bench_startup.py --root /path/to/old/checkout --modes lazy   # an earlier tree
+
+ttfr is import + create_app + the first /login, i.e. how long a cold worker
+keeps its first user waiting (with preload, create_app is paid once by the
+parent rather than by every worker); process adds interpreter start-up and exit.
+private KB is what each worker no longer shares with its parent after the
+requests (Linux only). Runs on the SQLite stand-in in --workdir.
+"""
+import argparse, json, os, platform, statistics, subprocess, sys, tempfile, time
+from datetime import datetime
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ('lazy', 'preload')
+ROUTES = ('/login', '/captcha', '/view_all')
+
+
+def private_kb():
+    try:
+        with open('/proc/self/smaps_rollup') as fh:
+            return sum(int(line.split()[1]) for line in fh if line.startswith(('Private_Clean', 'Private_Dirty')))
+    except OSError:
+        return None
+
+
+def first_responses(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    out = {}
+    for route in ROUTES:
+        start = time.perf_counter()
+        status = client.get(route).status_code
+        out[route] = round((time.perf_counter() - start) * 1000, 2)
+        if status != 200:
+            raise SystemExit(f"{route} answered {status}")
+    out['private_kb'] = private_kb()
+    return out
+
+
+def child(mode, workers):
+    """One cold start; prints its timings as JSON."""
+    start = time.perf_counter()
+    import note
+    imported = time.perf_counter()
+    if hasattr(note, 'create_app'):
+        from app_config import Config
+        app = note.create_app(Config(PRELOAD=mode == 'preload'))
+    else:                   # a tree from before the app factory
+        app = note.app
+    created = time.perf_counter()
+
+    results = []
+    for _ in range(workers):
+        if not hasattr(os, 'fork'):
+            results.append(first_responses(app))
+            continue
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, json.dumps(first_responses(app)).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as fh:
+            results.append(json.loads(fh.read()))
+        os.waitpid(pid, 0)
+
+    report = {'import_ms': (imported - start) * 1000, 'create_app_ms': (created - imported) * 1000}
+    for key in (*ROUTES, 'private_kb'):
+        values = [r[key] for r in results if r[key] is not None]
+        report[key] = statistics.median(values) if values else None
+    report['ttfr_ms'] = report['import_ms'] + report['create_app_ms'] + report['/login']
+    print(json.dumps(report))
+
+
+def run(mode, args, env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, '--workers', str(args.workers)],
+                          env=env, cwd=args.workdir, capture_output=True, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise SystemExit(f"{mode} run failed:\n{proc.stderr[-2000:]}")
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    report['process_ms'] = wall
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('--workers', type=int, default=2, help="forked workers per run")
+    ap.add_argument('--modes', default=','.join(MODES))
+    ap.add_argument('--root', default=ROOT, help="checkout whose note.py is measured")
+    ap.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'notes_startup'))
+    ap.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument('--out', help="write results as JSON")
+    args = ap.parse_args()
+
+    if args.child:                      # note is found through PYTHONPATH (--root)
+        return child(args.child, args.workers)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(args.root), DB_BACKEND='sqlite',
+               DB_SQLITE_PATH=os.path.join(args.workdir, 'flaskdb.sqlite3'))
+    modes = [m for m in args.modes.split(',') if m]
+    run(modes[0], args, env)            # creates the database and warms the OS file cache
+    results = {}
+    for mode in modes:
+        runs = [run(mode, args, env) for _ in range(args.runs)]
+        results[mode] = {key: round(statistics.median(r[key] for r in runs), 2) if runs[0][key] is not None else None
+                         for key in runs[0]}
+
+    columns = ('import_ms', 'create_app_ms', *ROUTES, 'ttfr_ms', 'process_ms', 'private_kb')
+    print(f"{args.runs} runs x {args.workers} workers, medians in ms ({args.root})")
+    print(f"{'mode':<9}" + ''.join(f"{c.replace('_ms', ''):>13}" for c in columns))
+    for mode, r in results.items():
+        print(f"{mode:<9}" + ''.join(f"{r[c]:>13,.1f}" if r[c] is not None else f"{'-':>13}" for c in columns))
+
+    if args.out:
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': {k: v for k, v in vars(args).items() if k not in ('out', 'child')},
+            },
+            'results': results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
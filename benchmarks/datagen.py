@@ -0,0 +1,103 @@
+"""
+Synthetic data for benchmarks: users, notes and attachments at a chosen scale.
+
+    DB_BACKEND=sqlite DB_SQLITE_PATH=/tmp/bench.sqlite3 \\
+        python benchmarks/datagen.py --users 200 --notes-per-user 500 --attach-ratio 0.1
+
+Writes through the app's own connection pool and attachment store (so it
+works against MySQL or the SQLite stand-in alike). Accounts are user0..userN-1,
+all with the password "benchmark-password"; the hash is computed once and
+shared, since the KDF would otherwise dominate generation time.
+"""
+import argparse, io, os, random, sys, time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+WORDS = ("meeting project budget travel recipe grocery lecture physics chemistry invoice "
+         "holiday birthday reminder doctor workout running python flask database index "
+         "garden music guitar piano novel chapter review feedback release deploy server "
+         "client design sketch family weekend morning evening coffee library exam notes").split()
+ATTACHMENT_KINDS = (('photo.png', 48 * 1024), ('scan.pdf', 160 * 1024), ('memo.webm', 512 * 1024))
+BATCH = 1000
+PASSWORD = "benchmark-password"
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def populate(db, store, users, notes_per_user, attach_ratio=0.1, distinct_blobs=50,
+             password_method="pbkdf2:sha256:1000", seed=1):
+    """Insert `users` accounts with `notes_per_user` notes each. Returns counts."""
+    from attachment_store import attach
+    from note_codec import encode_values
+
+    rng = random.Random(seed)
+    cursor = db.cursor()
+
+    # a handful of distinct blobs, shared by many notes (as the dedup store would)
+    blobs = []
+    for i in range(distinct_blobs):
+        filename, size = ATTACHMENT_KINDS[i % len(ATTACHMENT_KINDS)]
+        blob_key, size = store.put(io.BytesIO(rng.randbytes(size)), filename)
+        blobs.append((blob_key, filename, size))
+
+    pw_hash = generate_password_hash(PASSWORD, password_method)
+    user_ids = []
+    for n in range(users):
+        cursor.execute(
+            "INSERT INTO noteusers (email, username, password, mobile) VALUES (%s, %s, %s, %s)",
+            (f"user{n}@bench.local", f"user{n}", pw_hash, f"9{n:09d}"))
+        user_ids.append(cursor.lastrowid)
+    db.commit()
+
+    now = datetime.now()
+    sql = ("INSERT INTO notes (title, content, content_z, content_format, excerpt, content_chars, search_terms, "
+           "user_id, create_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+    rows, counts = [], {'users': users, 'notes': 0, 'attachments': 0}
+    for user_id in user_ids:
+        for _ in range(notes_per_user):
+            row = (sentence(rng, rng.randint(2, 6)).title(), *encode_values(sentence(rng, rng.randint(20, 200))),
+                   user_id, now - timedelta(seconds=rng.randint(0, 365 * 86400)))
+            counts['notes'] += 1
+            if rng.random() >= attach_ratio:
+                rows.append(row)
+                if len(rows) >= BATCH:
+                    cursor.executemany(sql, rows)
+                    rows.clear()
+                    db.commit()
+                continue
+            cursor.execute(sql, row)
+            note_id = cursor.lastrowid
+            for blob_key, filename, size in rng.sample(blobs, rng.randint(1, min(3, len(blobs)))):
+                attach(cursor, note_id, blob_key, filename, size)
+                counts['attachments'] += 1
+    if rows:
+        cursor.executemany(sql, rows)
+    db.commit()
+    cursor.close()
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--users', type=int, default=100)
+    ap.add_argument('--notes-per-user', type=int, default=200)
+    ap.add_argument('--attach-ratio', type=float, default=0.1, help="share of notes with attachments")
+    ap.add_argument('--distinct-blobs', type=int, default=50)
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    from note import db_pool, attachment_store, hasher
+    start = time.perf_counter()
+    with db_pool.connection() as db:
+        counts = populate(db, attachment_store, args.users, args.notes_per_user, args.attach_ratio,
+                          args.distinct_blobs, seed=args.seed)
+    hasher.shutdown()
+    print(f"{counts} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
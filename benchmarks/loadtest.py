@@ -0,0 +1,263 @@
+"""
+End-to-end load test of the Flask app: throughput and p50/p95/p99 latency
+per scenario, saved as JSON so runs can be compared.
+
+    python benchmarks/loadtest.py --threads 8 --seconds 10 --out results/base.json
+    python benchmarks/loadtest.py --reuse --out results/new.json --compare results/base.json
+
+Scenarios (pick with --scenarios):
+  login     : GET /logout, GET /captcha, solve it, POST /login
+  dashboard : GET /view_all, then the next page
+  search    : GET /search with two random words
+  note      : GET /note/<id> for a random note of the user
+  crud      : add a note with an attachment, edit it, delete it
+
+Requests go through the in-process WSGI test client, one client (and one
+logged-in account) per thread, so the numbers measure the app, its pool and
+the database rather than a web server. By default the database is the SQLite
+stand-in (sqlite_backend) in --workdir, filled by datagen.py on first run;
+pass --mysql to use DB_HOST/DB_NAME etc. from the environment instead
+(point DB_NAME at a scratch database: the generator inserts user0..userN).
+"""
+import argparse, io, json, os, platform, random, re, sys, tempfile, threading, time
+from datetime import datetime
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen
+
+SCENARIOS = ('login', 'dashboard', 'search', 'note', 'crud')
+PASSWORD_METHOD = "pbkdf2:sha256:1000"      # cheap KDF unless --hash-method says otherwise
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+class LoadError(Exception):
+    pass
+
+
+def expect(resp, *statuses):
+    if resp.status_code not in statuses:
+        raise LoadError(f"{resp.request.path} -> {resp.status_code}")
+    return resp
+
+
+# ---------- scenarios: one call = one timed operation ----------
+def login(client, user):
+    expect(client.get('/captcha'), 200)
+    with client.session_transaction() as sess:
+        text = sess['captcha_text']
+    resp = expect(client.post('/login', data={'username': user['username'], 'password': datagen.PASSWORD,
+                                              'captcha': text}), 302)
+    if not resp.location.endswith('/view_all'):
+        raise LoadError("login rejected")
+
+
+def scenario_login(client, user, rng):
+    expect(client.get('/logout'), 302)
+    login(client, user)
+
+
+def scenario_dashboard(client, user, rng):
+    page = expect(client.get('/view_all'), 200).get_data(as_text=True)
+    m = re.search(r'after=([^&"]+)', page)
+    if m:
+        expect(client.get(f'/view_all?after={m.group(1)}'), 200)
+
+
+def scenario_search(client, user, rng):
+    q = ' '.join(rng.sample(datagen.WORDS, 2))
+    expect(client.get('/search', query_string={'q': q}), 200)
+
+
+def scenario_note(client, user, rng):
+    if not user['note_ids']:
+        return
+    expect(client.get(f"/note/{rng.choice(user['note_ids'])}"), 200)
+
+
+def scenario_crud(client, user, rng):
+    data = {'title': datagen.sentence(rng, 4), 'content': datagen.sentence(rng, 80),
+            'attachments': (io.BytesIO(rng.randbytes(32 * 1024)), 'loadtest.png')}
+    expect(client.post('/add_note', data=data, content_type='multipart/form-data'), 302)
+    page = expect(client.get('/view_all?per_page=1'), 200).get_data(as_text=True)
+    m = re.search(r'/note/(\d+)', page)
+    if not m:
+        raise LoadError("new note not listed")
+    note_id = m.group(1)
+    expect(client.post(f'/edit_note/{note_id}', data={'title': 'edited', 'content': datagen.sentence(rng, 40)}), 302)
+    expect(client.post(f'/delete_note/{note_id}'), 302)
+
+
+# ---------- runner ----------
+def run_scenario(app, fn, users, threads, seconds, seed):
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    samples = {}
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        user = users[i % len(users)]
+        client = app.test_client()
+        login(client, user)
+        barrier.wait()
+        stop = time.perf_counter() + seconds
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                fn(client, user, rng)
+            except Exception as e:      # count and keep going; one sample of each kind is reported
+                errors[i] += 1
+                samples.setdefault(type(e).__name__, str(e))
+                continue
+            latencies[i].append(time.perf_counter() - t0)
+
+    ts = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for t in ts:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = sorted(x for per in latencies for x in per)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'ops': len(lat),
+        'errors': sum(errors),
+        'error_samples': samples,
+        'throughput': round(len(lat) / elapsed, 2),
+        'mean_ms': ms(sum(lat) / len(lat)) if lat else None,
+        'p50_ms': ms(percentile(lat, 50)),
+        'p95_ms': ms(percentile(lat, 95)),
+        'p99_ms': ms(percentile(lat, 99)),
+        'max_ms': ms(lat[-1]) if lat else None,
+    }
+
+
+def load_users(db_pool, count):
+    with db_pool.connection() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT id, username FROM noteusers WHERE username LIKE 'user%' ORDER BY id LIMIT %s", (count,))
+        users = cursor.fetchall()
+        for user in users:
+            cursor.execute("SELECT id FROM notes WHERE user_id=%s ORDER BY id LIMIT 500", (user['id'],))
+            user['note_ids'] = [r['id'] for r in cursor.fetchall()]
+        cursor.close()
+    return users
+
+
+def print_table(results, baseline=None):
+    head = f"{'scenario':<11}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(head + ("   vs baseline (ops/s, p95)" if baseline else ''))
+    for name, r in results.items():
+        line = (f"{name:<11}{r['throughput']:>10,.1f}{r['p50_ms'] or 0:>10.2f}"
+                f"{r['p95_ms'] or 0:>10.2f}{r['p99_ms'] or 0:>10.2f}{r['errors']:>8}")
+        base = (baseline or {}).get(name)
+        if base and base['throughput'] and base['p95_ms']:
+            line += (f"   {(r['throughput'] / base['throughput'] - 1) * 100:+6.1f}%"
+                     f"  {((r['p95_ms'] or 0) / base['p95_ms'] - 1) * 100:+6.1f}%")
+        print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS))
+    ap.add_argument('--threads', type=int, default=8)
+    ap.add_argument('--seconds', type=float, default=10.0, help="duration of each scenario")
+    ap.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'notes_loadtest'),
+                    help="database, uploads and queues for the run")
+    ap.add_argument('--users', type=int, default=50)
+    ap.add_argument('--notes-per-user', type=int, default=200)
+    ap.add_argument('--attach-ratio', type=float, default=0.1)
+    ap.add_argument('--reuse', action='store_true', help="keep the data already in --workdir")
+    ap.add_argument('--mysql', action='store_true', help="use the MySQL settings from the environment")
+    ap.add_argument('--hash-method', default=PASSWORD_METHOD)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help="write results as JSON")
+    ap.add_argument('--compare', help="earlier JSON result to diff against")
+    args = ap.parse_args()
+
+    # paths are relative to where the command was run; the run itself chdirs to --workdir
+    args.out = args.out and os.path.abspath(args.out)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    names = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # note.py reads its configuration at import time, so set it up first
+    os.makedirs(args.workdir, exist_ok=True)
+    db_path = os.path.join(args.workdir, 'flaskdb.sqlite3')
+    if not args.reuse and not args.mysql:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    if not args.mysql:
+        os.environ['DB_BACKEND'] = 'sqlite'
+        os.environ['DB_SQLITE_PATH'] = db_path
+    os.environ.setdefault('DB_POOL_SIZE', str(args.threads))
+    os.environ['HASH_METHOD'] = args.hash_method
+    # every thread logs in from the same address: lift the limits for the run
+    os.environ['LOGIN_RATE_ACCOUNT'] = os.environ['LOGIN_RATE_IP'] = '1000000/1'
+    os.chdir(args.workdir)
+
+    import note
+    if not args.reuse:
+        t0 = time.perf_counter()
+        with note.db_pool.connection() as db:
+            counts = datagen.populate(db, note.attachment_store, args.users, args.notes_per_user,
+                                      args.attach_ratio, password_method=args.hash_method, seed=args.seed)
+        print(f"generated {counts} in {time.perf_counter() - t0:.1f}s")
+    users = load_users(note.db_pool, args.users)
+    if not users:
+        sys.exit("no benchmark users in the database (run without --reuse)")
+
+    results = {}
+    for name in names:
+        results[name] = run_scenario(note.app, globals()[f'scenario_{name}'], users,
+                                     args.threads, args.seconds, args.seed)
+        for kind, sample in results[name]['error_samples'].items():
+            print(f"  {name}: {kind}: {sample}", file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['scenarios']
+    print(f"{args.threads} threads x {args.seconds:g}s, {'mysql' if args.mysql else 'sqlite'}, "
+          f"{len(users)} users")
+    print_table(results, baseline)
+
+    if args.out:
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'backend': 'mysql' if args.mysql else 'sqlite',
+                'args': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+                'pool': note.db_pool.stats(),
+                'cache': note.note_cache.stats(),
+            },
+            'scenarios': results,
+        }
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"saved {args.out}")
+
+    note.mail_queue.stop()
+    note.hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
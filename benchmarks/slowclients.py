@@ -0,0 +1,260 @@
+"""
+Slow-client benchmark: the same app and thread budget served by a
+thread-per-request WSGI server and by async_server.py, side by side.
+
+    python benchmarks/slowclients.py --threads 16 --slow 300 --trickle 5 --out results/slow.json
+
+While --slow clients trickle their requests in (headers spread over --trickle
+seconds, as on a bad mobile link) and read the responses slowly, --fast
+clients keep fetching GET /api/v1/notes and their latency is measured. With a
+fixed pool of threads, every slow client holds a thread until it is done, so
+fast requests queue behind them; the async server only hands a thread to a
+request once it has fully arrived.
+
+Each server runs in its own process (so the clients here don't compete with
+it for the GIL) on the SQLite stand-in in --workdir, filled by datagen.py.
+"""
+import argparse, asyncio, json, logging, os, platform, socket, subprocess, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen
+from loadtest import percentile, PASSWORD_METHOD
+
+MODES = ('sync', 'async')
+
+
+# ---------- server side (child process) ----------
+def serve(mode, port, threads):
+    from note import app
+    if mode == 'async':
+        from async_server import serve as serve_async
+        serve_async(app, '127.0.0.1', port, threads=threads)
+        return
+
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """A thread-per-request server with a fixed number of threads (like gunicorn gthread)."""
+        request_queue_size = 4096
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._work, request, client_address)
+
+        def _work(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+# ---------- client side ----------
+def request_bytes(port, token):
+    return (f"GET /api/v1/notes?limit=20 HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            f"Authorization: Bearer {token}\r\nAccept: application/json\r\n"
+            f"Connection: close\r\n\r\n").encode()
+
+
+async def fast_client(port, token, stop, timeout, latencies, errors):
+    payload = request_bytes(port, token)
+    while time.perf_counter() < stop:
+        t0 = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            writer.write(payload)
+            data = await asyncio.wait_for(reader.read(), timeout - (time.perf_counter() - t0))
+            writer.close()
+            if not data.startswith(b'HTTP/1.1 200') and not data.startswith(b'HTTP/1.0 200'):
+                errors['status'] = errors.get('status', 0) + 1
+                continue
+        except asyncio.TimeoutError:
+            errors['timeout'] = errors.get('timeout', 0) + 1
+            continue
+        except OSError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            await asyncio.sleep(0.05)
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+
+async def slow_client(port, token, stop, trickle, done):
+    payload = request_bytes(port, token)
+    pieces = 20
+    step = max(1, len(payload) // pieces)
+    while time.perf_counter() < stop:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for i in range(0, len(payload), step):
+                writer.write(payload[i:i + step])
+                await writer.drain()
+                await asyncio.sleep(trickle / pieces)
+            while await reader.read(512):          # read the response in dribbles
+                await asyncio.sleep(0.05)
+            writer.close()
+            done[0] += 1
+        except OSError:
+            await asyncio.sleep(0.5)
+
+
+async def drive(port, token, args):
+    stop = time.perf_counter() + args.seconds
+    latencies, errors, done = [], {}, [0]
+    slow = [asyncio.create_task(slow_client(port, token, stop, args.trickle, done)) for _ in range(args.slow)]
+    await asyncio.sleep(min(1.0, args.trickle / 2))         # let the slow clients take their seats
+    fast = [asyncio.create_task(fast_client(port, token, stop, args.timeout, latencies, errors))
+            for _ in range(args.fast)]
+    await asyncio.gather(*fast)
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+    return latencies, errors, done[0]
+
+
+def wait_for_port(port, proc, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"server exited with {proc.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("server did not start")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_mode(mode, token, args):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+                             '--threads', str(args.threads)], stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, proc)
+        t0 = time.perf_counter()
+        latencies, errors, slow_done = asyncio.run(drive(port, token, args))
+        elapsed = time.perf_counter() - t0
+    finally:
+        proc.terminate()
+        proc.wait()
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'ops': len(lat),
+        'errors': sum(errors.values()),
+        'error_kinds': errors,
+        'throughput': round(len(lat) / elapsed, 2),
+        'p50_ms': ms(percentile(lat, 50)),
+        'p95_ms': ms(percentile(lat, 95)),
+        'p99_ms': ms(percentile(lat, 99)),
+        'max_ms': ms(lat[-1]) if lat else None,
+        'slow_completed': slow_done,
+    }
+
+
+def print_table(results):
+    print(f"{'server':<8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'slow done':>11}")
+    for name, r in results.items():
+        print(f"{name:<8}{r['throughput']:>10,.1f}{r['p50_ms'] or 0:>10.2f}{r['p95_ms'] or 0:>10.2f}"
+              f"{r['p99_ms'] or 0:>10.2f}{r['errors']:>8}{r['slow_completed']:>11}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--modes', default=','.join(MODES))
+    ap.add_argument('--threads', type=int, default=16, help="worker threads of either server")
+    ap.add_argument('--slow', type=int, default=200, help="slow clients")
+    ap.add_argument('--fast', type=int, default=8, help="fast clients (measured)")
+    ap.add_argument('--trickle', type=float, default=5.0, help="seconds a slow client takes to send its request")
+    ap.add_argument('--seconds', type=float, default=15.0)
+    ap.add_argument('--timeout', type=float, default=10.0, help="fast requests slower than this count as errors")
+    ap.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'notes_slowclients'))
+    ap.add_argument('--users', type=int, default=5)
+    ap.add_argument('--notes-per-user', type=int, default=100)
+    ap.add_argument('--reuse', action='store_true', help="keep the data already in --workdir")
+    ap.add_argument('--out', help="write results as JSON")
+    ap.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    args.out = args.out and os.path.abspath(args.out)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    db_path = os.path.join(args.workdir, 'flaskdb.sqlite3')
+    if not args.serve and not args.reuse:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    # note.py reads its configuration at import time; server processes inherit it
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = db_path
+    os.environ['DB_POOL_SIZE'] = str(args.threads)
+    os.environ['HASH_METHOD'] = PASSWORD_METHOD
+    os.chdir(args.workdir)
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads)
+        return
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    if set(modes) - set(MODES):
+        ap.error(f"modes are {', '.join(MODES)}")
+
+    import note
+    if not args.reuse:
+        with note.db_pool.connection() as db:
+            counts = datagen.populate(db, note.attachment_store, args.users, args.notes_per_user,
+                                      password_method=PASSWORD_METHOD)
+        print(f"generated {counts}")
+    with note.db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM noteusers WHERE username='user0'")
+        row = cursor.fetchone()
+        cursor.close()
+    if not row:
+        sys.exit("no benchmark users in the database (run without --reuse)")
+    token = note.tokens.dumps({'uid': row[0]}, salt='api-token')
+    note.mail_queue.stop()
+    note.hasher.shutdown()
+
+    results = {}
+    for mode in modes:
+        results[mode] = run_mode(mode, token, args)
+    print(f"{args.threads} threads, {args.slow} slow clients ({args.trickle:g}s each), "
+          f"{args.fast} fast clients x {args.seconds:g}s")
+    print_table(results)
+
+    if args.out:
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'args': {k: v for k, v in vars(args).items() if k not in ('out', 'serve', 'port')},
+            },
+            'servers': results,
+        }
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,33 @@
 # Libraries
 
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import random, string, io
+from collections import deque
+from functools import lru_cache
+import numpy as np
+import os, random, string, io, threading
+
+WIDTH, HEIGHT = 160, 60
+NOISE_DOTS = 150
 
 # Function to generate captcha
 def generate_captcha_text(length=6):
     characters = string.ascii_uppercase + string.ascii_lowercase + string.digits
     return "".join(random.choice(characters) for _ in range(length))
 
-# Func to generate captcha image
-def generate_captcha_image(text):
-    width, height = 160, 60
-    image = Image.new('RGB',(width,height),(255,255,255))
-    draw = ImageDraw.Draw(image)
-
+# Font is read from disk once per process (the fallback included)
+@lru_cache(maxsize=None)
+def get_font(size=30):
     try:
         # font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 360)
-        font = ImageFont.truetype("arial.ttf",30)
+        return ImageFont.truetype("arial.ttf", size)
     except Exception as e:
-        font = ImageFont.load_default()
-    
-    '''# Adding noisy lines
-    for _ in range(4):
-        start = (random.randint(0,width), random.randint(0,height))
-        end = (random.randint(0,width), random.randint(0,height))
-        draw.line([start,end], fill = (random.randint(100,200), random.randint(100,200), random.randint(100,200)), width=2)
-    '''
+        return ImageFont.load_default()
+
+# Render captcha text to PNG bytes
+def render_captcha_png(text):
+    image = Image.new('RGB',(WIDTH,HEIGHT),(255,255,255))
+    draw = ImageDraw.Draw(image)
+    font = get_font()
 
     # Draw characters, with slight jittered
     for i,ch in enumerate(text):
@@ -33,12 +35,83 @@ def generate_captcha_image(text):
         y = random.randint(0,12)
         draw.text((x,y), ch, font=font, fill=(random.randint(0,120), random.randint(0,120), random.randint(0,120)))
 
-    # Adding noisy dots
-    for _ in range(150):
-        draw.point((random.randint(0,width), random.randint(0,height)), fill=(random.randint(0,255), random.randint(0,255), random.randint(0,255)))
-
+    # Adding noisy dots: one array write instead of 150 draw.point calls
+    pixels = np.array(image)
+    ys = np.random.randint(0, HEIGHT, NOISE_DOTS)
+    xs = np.random.randint(0, WIDTH, NOISE_DOTS)
+    pixels[ys, xs] = np.random.randint(0, 256, (NOISE_DOTS, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
 
     buf = io.BytesIO()
-    image.save(buf, format='PNG')
+    image.save(buf, format='PNG', compress_level=1)
+    return buf.getvalue()
+
+# Func to generate captcha image (file-like, kept for send_file callers)
+def generate_captcha_image(text):
+    buf = io.BytesIO(render_captcha_png(text))
     buf.seek(0)
     return buf
+
+
+class CaptchaPool:
+    """
+    Bounded pool of pre-rendered (text, PNG bytes) pairs.
+
+    get() is a deque pop; a background thread tops the pool back up whenever
+    it falls below `low_water`. If the pool ever runs dry, get() renders
+    inline so a request never waits on the refill thread. A forked worker
+    drops whatever it inherited and renders its own, so no two processes
+    ever hand out the same CAPTCHA.
+    """
+
+    def __init__(self, size=200, low_water=50):
+        self.size = size
+        self.low_water = low_water
+        self._items = deque()
+        self._need_refill = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.misses = 0
+
+    def _ensure_thread(self):
+        # started on first use so forked workers each get their own thread
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # items rendered before a fork exist in every sibling: a solved one could be replayed
+                    self._items.clear()
+                    self._thread = None
+                    self._pid = os.getpid()
+                    np.random.seed()        # `random` reseeds itself after fork, numpy does not
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._refill_loop, name="captcha-refill", daemon=True)
+                    self._thread.start()
+                    self._need_refill.set()
+
+    def _refill_loop(self):
+        while True:
+            self._need_refill.wait()
+            while len(self._items) < self.size:
+                text = generate_captcha_text()
+                self._items.append((text, render_captcha_png(text)))
+            self._need_refill.clear()
+
+    def fill(self):
+        """Render synchronously until full (in the process that serves them, never before a fork)."""
+        while len(self._items) < self.size:
+            text = generate_captcha_text()
+            self._items.append((text, render_captcha_png(text)))
+
+    def get(self):
+        """Take one (text, png_bytes) pair."""
+        self._ensure_thread()
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            self.misses += 1
+            text = generate_captcha_text()
+            item = (text, render_captcha_png(text))
+        if len(self._items) < self.low_water:
+            self._need_refill.set()
+        return item
@@ -0,0 +1,275 @@
+# Resumable chunked uploads (voice recordings, large attachments)
+#
+# A session is a `<id>.part` file plus a `<id>.json` metadata file under
+# uploads/.partial/. Chunks are appended as they arrive, so a dropped
+# connection only loses the chunk in flight: the client asks for the current
+# offset and carries on from there. On completion the file is checksummed
+# and moved (not copied) into the attachment store.
+import json, os, re, secrets, threading, time
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl        # serialises appends across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+COPY_SIZE = 64 * 1024
+_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class UploadError(Exception):
+    """Client-visible upload failure; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def parse_content_range(header):
+    """'bytes 0-1023/4096' -> (0, 1023, 4096); total is None for '*'."""
+    match = _RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError("Missing or malformed Content-Range header")
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    if end < start:
+        raise UploadError("Content-Range end before start")
+    return start, end, None if total == '*' else int(total)
+
+
+class ChunkedUploads:
+    """
+    Upload sessions on local disk.
+
+      max_size  : largest file a session may grow to (bytes)
+      max_chunk : largest single chunk request (bytes)
+      ttl       : unfinished sessions older than this are swept (seconds)
+    """
+
+    def __init__(self, root, max_size=512 * 1024 * 1024, max_chunk=8 * 1024 * 1024, ttl=24 * 3600):
+        self.root = root
+        self.max_size = max_size
+        self.max_chunk = max_chunk
+        self.ttl = ttl
+        self._locks = {}            # upload_id -> [lock, holders]
+        self._locks_guard = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # ---------- files ----------
+    def _part(self, upload_id):
+        return os.path.join(self.root, upload_id + '.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, upload_id + '.json')
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """
+        The session's part file opened for writing, held by this thread alone
+        (one lock per upload, so a slow chunk only holds up its own session)
+        and by this process alone (flock). None if the file is gone, i.e. the
+        upload was completed, discarded or swept meanwhile.
+        """
+        with self._locks_guard:
+            entry = self._locks.setdefault(upload_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                try:
+                    fh = open(self._part(upload_id), 'r+b')
+                except FileNotFoundError:
+                    yield None
+                    return
+                with fh:
+                    if fcntl:
+                        fcntl.flock(fh, fcntl.LOCK_EX)
+                    yield fh
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[upload_id]
+
+    def _write_meta(self, meta):
+        tmp = self._meta_path(meta['id']) + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, self._meta_path(meta['id']))
+
+    def _load(self, upload_id, user_id):
+        if not re.fullmatch(r"[A-Za-z0-9_-]{16,64}", upload_id or ''):
+            raise UploadError("Unknown upload", 404)
+        try:
+            with open(self._meta_path(upload_id)) as fh:
+                meta = json.load(fh)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", 404)
+        if meta['user_id'] != user_id:
+            raise UploadError("Unknown upload", 404)
+        return meta
+
+    def _discard(self, upload_id):
+        for path in (self._part(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # ---------- API ----------
+    def create(self, user_id, filename, total=None):
+        """Open a new session. `total` may be unknown (e.g. a live recording)."""
+        filename = secure_filename(filename or '') or 'upload'
+        if total is not None and total > self.max_size:
+            raise UploadError(f"File too large (limit {self.max_size} bytes)", 413)
+        self.sweep()
+        meta = {
+            'id': secrets.token_urlsafe(18),
+            'user_id': user_id,
+            'filename': filename,
+            'total': total,
+            'status': 'uploading',
+            'created_at': time.time(),
+        }
+        open(self._part(meta['id']), 'wb').close()
+        self._write_meta(meta)
+        return self.status(meta['id'], user_id)
+
+    def status(self, upload_id, user_id):
+        """Session info including `offset`, the byte the next chunk must start at."""
+        meta = self._load(upload_id, user_id)
+        meta['offset'] = os.path.getsize(self._part(upload_id)) if meta['status'] == 'uploading' else meta.get('size')
+        meta['max_chunk'] = self.max_chunk
+        return meta
+
+    def append(self, upload_id, user_id, content_range, stream, length):
+        """Append one chunk read from `stream`. Returns the new offset."""
+        meta = self._load(upload_id, user_id)
+        if meta['status'] != 'uploading':
+            raise UploadError("Upload already completed", 409)
+        start, end, total = parse_content_range(content_range)
+        size = end - start + 1
+        if length is not None and length != size:
+            raise UploadError("Content-Length does not match Content-Range")
+        if size > self.max_chunk:
+            raise UploadError(f"Chunk too large (limit {self.max_chunk} bytes)", 413)
+        if total is not None and meta['total'] is not None and total != meta['total']:
+            raise UploadError("Total size changed mid-upload")
+        if end + 1 > min(self.max_size, meta['total'] or self.max_size):
+            raise UploadError(f"File too large (limit {self.max_size} bytes)", 413)
+
+        with self._locked(upload_id) as out:
+            # again under the lock: complete() may have moved the file meanwhile
+            meta = self._load(upload_id, user_id)
+            if out is None or meta['status'] != 'uploading':
+                raise UploadError("Upload already completed", 409)
+            offset = out.seek(0, os.SEEK_END)
+            if start != offset:
+                raise UploadError("Chunk does not start at the current offset", 409, offset)
+            remaining = size
+            while remaining:
+                data = stream.read(min(COPY_SIZE, remaining))
+                if not data:
+                    # client went away mid-chunk: drop the partial chunk so resume is exact
+                    out.truncate(offset)
+                    raise UploadError("Chunk body ended early", 400, offset)
+                out.write(data)
+                remaining -= len(data)
+            out.flush()
+            return offset + size
+
+    def complete(self, upload_id, user_id, sha256, store):
+        """
+        Verify the client's SHA-256 (required, hex), move the file into `store`
+        and mark the session complete. Returns the updated session metadata.
+        """
+        meta = self._load(upload_id, user_id)
+        if meta['status'] != 'uploading':
+            return meta
+        sha256 = (sha256 or '').lower()
+        if not _SHA256_RE.fullmatch(sha256):
+            raise UploadError("'sha256' of the whole file is required", 422)
+        # the same lock as append(), so no chunk is still being written into the file we move
+        with self._locked(upload_id) as part:
+            meta = self._load(upload_id, user_id)
+            if part is None or meta['status'] != 'uploading':
+                return meta         # completed by a concurrent request
+            size = os.fstat(part.fileno()).st_size
+            if meta['total'] is not None and size != meta['total']:
+                raise UploadError(f"Upload incomplete ({size} of {meta['total']} bytes)", 409, size)
+
+            blob_key, size = store.adopt(self._part(upload_id), meta['filename'], expected_sha256=sha256)
+            if blob_key is None:
+                self._discard(upload_id)
+                raise UploadError("Checksum mismatch; upload discarded", 422)
+            meta.update(status='complete', blob_key=blob_key, size=size)
+            self._write_meta(meta)
+            return meta
+
+    def claim(self, upload_ids, user_id):
+        """
+        Hand completed uploads over to a note: returns ([(blob_key, filename,
+        size)], claimed ids). The sessions are only marked claimed; forget()
+        them once the transaction attaching the blobs has committed, or
+        release() them if it rolled back. Unknown or unfinished ids are skipped.
+        """
+        uploads, claimed = [], []
+        for upload_id in upload_ids:
+            try:
+                meta = self._load(upload_id, user_id)
+            except UploadError:
+                continue
+            if meta['status'] == 'complete':
+                meta.update(status='claimed')
+                self._write_meta(meta)
+                uploads.append((meta['blob_key'], meta['filename'], meta['size']))
+                claimed.append(upload_id)
+        return uploads, claimed
+
+    def forget(self, upload_ids):
+        """Drop sessions claimed by a committed transaction."""
+        for upload_id in upload_ids:
+            self._discard(upload_id)
+
+    def release(self, upload_ids):
+        """Make sessions claimed by a rolled-back transaction claimable again."""
+        for upload_id in upload_ids:
+            try:
+                with open(self._meta_path(upload_id)) as fh:
+                    meta = json.load(fh)
+            except (FileNotFoundError, ValueError):
+                continue
+            if meta['status'] == 'claimed':
+                meta.update(status='complete')
+                self._write_meta(meta)
+
+    def pending_blobs(self):
+        """Blob keys of completed sessions whose attaching transaction hasn't committed."""
+        keys = []
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root, name)) as fh:
+                        meta = json.load(fh)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if meta.get('status') in ('complete', 'claimed'):
+                    keys.append(meta['blob_key'])
+        return keys
+
+    def sweep(self):
+        """Delete sessions (and their partial files) older than the TTL."""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                upload_id = name[:-5]
+                try:
+                    # the .part file's mtime moves with every chunk, so active uploads survive
+                    last = max(os.path.getmtime(os.path.join(self.root, name)),
+                               os.path.getmtime(self._part(upload_id)) if os.path.exists(self._part(upload_id)) else 0)
+                except FileNotFoundError:
+                    continue
+                if last < cutoff:
+                    self._discard(upload_id)
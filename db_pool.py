@@ -0,0 +1,211 @@
+# MySQL connection pool (sized, health-checked, with overflow)
+import threading, time
+from collections import deque
+from contextlib import contextmanager
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeout(Error):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class PooledConnection:
+    """Thin proxy around a MySQL connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checked_out = False
+        self.lease = 0          # bumped on every checkout
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        return self._pool.cursor_wrapper(cursor) if self._pool.cursor_wrapper else cursor
+
+    def commit(self):
+        self._raw.commit()
+        if self._pool.on_commit:
+            self._pool.on_commit()
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)."""
+        if self.checked_out:
+            self._pool.release(self)
+
+    def close_lease(self, lease):
+        """Release only if still held under `lease` (not re-checked-out by someone else)."""
+        if self.checked_out and self.lease == lease:
+            self._pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+
+      size         : connections kept open while idle
+      max_overflow : extra connections opened under load, closed on release
+      timeout      : seconds to wait for a free connection before PoolTimeout
+      recycle      : close and reopen connections older than this (seconds)
+      ping_after   : ping connections idle longer than this before handing out
+      connector    : function opening a raw connection (default mysql.connector.connect)
+      cursor_wrapper : optional function applied to every cursor handed out (instrumentation)
+      on_commit    : optional function called after every successful commit (replica pinning)
+    """
+
+    def __init__(self, size=5, max_overflow=10, timeout=10, recycle=1800, ping_after=30,
+                 connector=None, cursor_wrapper=None, on_commit=None, **connect_args):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.connector = connector or mysql.connector.connect
+        self.cursor_wrapper = cursor_wrapper
+        self.on_commit = on_commit
+        self.connect_args = connect_args
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0          # connections currently open (idle + in use)
+        self._in_use = 0
+
+        # counters for stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # ---------- internals ----------
+    def _connect(self):
+        return PooledConnection(self, self.connector(**self.connect_args))
+
+    def _discard(self, conn):
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+        self._discarded += 1
+
+    def _is_healthy(self, conn):
+        now = time.monotonic()
+        if self.recycle and now - conn.created_at > self.recycle:
+            return False
+        if now - conn.last_used > self.ping_after:
+            try:
+                conn._raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    # ---------- public API ----------
+    def acquire(self, timeout=None):
+        """Check out a live connection, waiting up to `timeout` seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(msg=f"No database connection available after {timeout}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        # connect / health-check outside the lock so slow handshakes don't block others
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        conn.lease += 1
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Return a connection; open transactions are rolled back, broken ones dropped."""
+        conn.checked_out = False
+        conn.last_used = time.monotonic()
+        keep = True
+        try:
+            if conn._raw.in_transaction:
+                conn._raw.rollback()
+        except Exception:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append(conn)
+            else:
+                self._open -= 1
+                self._discard(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """`with pool.connection() as db:` — always hands the connection back."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def dispose(self):
+        """Close every idle connection (e.g. after fork)."""
+        with self._cond:
+            while self._idle:
+                self._open -= 1
+                self._discard(self._idle.pop())
+
+    def stats(self):
+        """Snapshot of pool usage, for sizing the pool per worker."""
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_total_s': round(self._wait_total, 6),
+                'wait_avg_s': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+                'wait_max_s': round(self._wait_max, 6),
+            }
@@ -0,0 +1,203 @@
+# Primary / read-replica routing
+#
+# Writes, and any lookup not marked read-only, use the primary pool. Read-only
+# lookups go to the replicas, round-robin over the healthy ones. A replica
+# that fails to hand out a connection is skipped for `retry_after` seconds and
+# the read moves on to the next one, then to the primary; a replica whose pool
+# is merely busy is skipped for that one read only. A replica that drops the
+# connection mid-query is marked down the same way and the statement is run
+# again on the primary (ReplicaConnection), so the request still succeeds.
+#
+# Replicas lag behind the primary, so reads stay on the primary for a user for
+# `pin_seconds` after they commit a write (note.py also pins the browser
+# session, which covers every worker process the browser reaches). Other
+# clients of the same user may still read a lagging replica: note.py only
+# caches such a read once the primary confirms it is current.
+import itertools, threading, time
+from mysql.connector import errors
+from db_pool import PoolTimeout
+
+# a replica that went away, as opposed to a bad query (which the primary would reject too)
+FAILOVER_ERRORS = (errors.OperationalError, errors.InterfaceError)
+
+
+class _FailoverCursor:
+    """Cursor of a ReplicaConnection; re-runs its statement on the primary if the replica fails."""
+
+    def __init__(self, conn, args, kwargs):
+        self._conn = conn
+        self._args = args
+        self._kwargs = kwargs
+        self._cursor = conn.current.cursor(*args, **kwargs)
+        self._on_primary = conn.replica is None
+        self._last = None
+        self._fetched = 0
+
+    def _fail_over(self, e):
+        if self._on_primary:
+            raise e
+        self._conn.fail_over(e)
+        try:
+            self._cursor.close()
+        except Exception:
+            pass
+        self._cursor = self._conn.current.cursor(*self._args, **self._kwargs)
+        self._on_primary = True
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        self._last, self._fetched = (sql, params, args, kwargs), 0
+        try:
+            return self._cursor.execute(sql, params, *args, **kwargs)
+        except FAILOVER_ERRORS as e:
+            self._fail_over(e)
+            return self._cursor.execute(sql, params, *args, **kwargs)
+
+    def _fetch(self, method, *args):
+        try:
+            rows = getattr(self._cursor, method)(*args)
+        except FAILOVER_ERRORS as e:
+            if self._fetched or self._last is None:
+                if not self._on_primary:
+                    self._conn.fail_over(e)     # later reads go elsewhere
+                raise               # part of the result was already handed out
+            self._fail_over(e)
+            sql, params, a, kw = self._last
+            self._cursor.execute(sql, params, *a, **kw)
+            rows = getattr(self._cursor, method)(*args)
+        if rows:
+            self._fetched += 1
+        return rows
+
+    def fetchone(self):
+        return self._fetch('fetchone')
+
+    def fetchmany(self, *args):
+        return self._fetch('fetchmany', *args)
+
+    def fetchall(self):
+        return self._fetch('fetchall')
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ReplicaConnection:
+    """
+    A replica's pooled connection that switches to a primary connection when
+    the replica fails mid-query. `replica` is the replica's name while reads
+    still come from it, None once they have moved to the primary.
+    """
+
+    lease = 0       # note.py's teardown bookkeeping; the leases that matter are kept in _held
+
+    def __init__(self, router, name, conn):
+        self.router = router
+        self.replica = name
+        self.current = conn
+        self._held = [(conn, conn.lease)]
+
+    def fail_over(self, e):
+        if self.replica is None:        # another cursor of this connection already moved
+            return
+        self.router.mark_down(self.replica, e)
+        self.router.fallbacks += 1
+        self.replica = None
+        self.current = self.router.primary.acquire()
+        self._held.append((self.current, self.current.lease))
+
+    def cursor(self, *args, **kwargs):
+        return _FailoverCursor(self, args, kwargs)
+
+    def close(self):
+        # by lease: a connection handed back once may already belong to another request
+        for conn, lease in self._held:
+            conn.close_lease(lease)
+
+    def close_lease(self, lease):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ReplicaRouter:
+    """
+    Picks the pool a connection comes from.
+
+      primary     : ConnectionPool of the primary
+      replicas    : {name: ConnectionPool} of read replicas (may be empty)
+      retry_after : seconds a failed replica is left out
+      pin_seconds : how long a user's reads stay on the primary after a write
+    """
+
+    def __init__(self, primary, replicas=None, retry_after=30, pin_seconds=5):
+        self.primary = primary
+        self.replicas = dict(replicas or {})
+        self.retry_after = retry_after
+        self.pin_seconds = pin_seconds
+        self._down_until = {name: 0.0 for name in self.replicas}
+        self._rr = itertools.count()
+        self._pins = {}             # user_id -> monotonic time the pin ends
+        self._lock = threading.Lock()
+        self.reads = {name: 0 for name in self.replicas}
+        self.fallbacks = 0          # read-only lookups that ended up on the primary
+        self.failovers = 0          # replicas marked down
+
+    # ---------- read-your-writes ----------
+    def pin(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._pins[user_id] = now + self.pin_seconds
+            if len(self._pins) > 10_000:        # drop expired pins now and then
+                self._pins = {u: t for u, t in self._pins.items() if t > now}
+
+    def pinned(self, user_id):
+        with self._lock:
+            return self._pins.get(user_id, 0) > time.monotonic()
+
+    # ---------- checkout ----------
+    def mark_down(self, name, e):
+        self._down_until[name] = time.monotonic() + self.retry_after
+        self.failovers += 1
+        print(f"❌ Replica {name} unavailable, skipping for {self.retry_after}s: {e}")
+
+    def acquire_read(self):
+        """A ReplicaConnection to a healthy replica, else a connection from the primary."""
+        names = list(self.replicas)
+        if names:
+            start = next(self._rr)
+            now = time.monotonic()
+            for i in range(len(names)):
+                name = names[(start + i) % len(names)]
+                if self._down_until[name] > now:
+                    continue
+                try:
+                    conn = self.replicas[name].acquire(timeout=0.05)
+                except PoolTimeout:
+                    continue            # busy, not broken
+                except Exception as e:
+                    self.mark_down(name, e)
+                    continue
+                self.reads[name] += 1
+                return ReplicaConnection(self, name, conn)
+        self.fallbacks += 1
+        return self.primary.acquire()
+
+    def stats(self):
+        now = time.monotonic()
+        out = {'replicas': len(self.replicas),
+               'replicas_down': sum(1 for t in self._down_until.values() if t > now),
+               'fallbacks': self.fallbacks, 'failovers': self.failovers,
+               'pinned_users': sum(1 for t in list(self._pins.values()) if t > now)}
+        for name, count in self.reads.items():
+            out[f"reads_{name.replace('.', '_').replace(':', '_').replace('-', '_')}"] = count
+        return out
@@ -0,0 +1,241 @@
+# Lazily generated previews of attachments
+#
+#   thumb : image thumbnail (Pillow), or a frame of a video when ffmpeg is installed
+#   wave  : waveform PNG of an audio file (WAV natively, other formats via ffmpeg)
+#
+# A preview is rendered the first time it is asked for, by a bounded thread
+# pool; concurrent requests for the same one share a single render. Outputs
+# live under uploads/.derived/ab/cd/<blob_key>.<kind>.<fmt> and are kept under
+# a size budget by an LRU (recency persisted as file mtime, so it survives
+# restarts). Blobs are content-addressed, so a preview only goes stale when
+# its blob is deleted: invalidate() removes it then.
+import io, os, shutil, subprocess, threading, wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as RenderTimeout
+
+IMAGE_EXTS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+VIDEO_EXTS = {'mp4', 'webm', 'ogg'}
+AUDIO_EXTS = {'mp3', 'wav', 'm4a', 'webm', 'ogg'}
+
+THUMB_SIZE = (320, 320)
+WAVE_SIZE = (600, 80)
+WAVE_COLOR = (13, 110, 253, 255)
+FFMPEG = shutil.which('ffmpeg')
+
+
+class PreviewUnavailable(Exception):
+    """This kind of preview can't be made for this file (format, missing ffmpeg...)."""
+
+
+# ---------- renderers (bytes in a worker thread) ----------
+def _run_ffmpeg(args, timeout=30):
+    if not FFMPEG:
+        raise PreviewUnavailable("ffmpeg is not installed")
+    proc = subprocess.run([FFMPEG, '-v', 'error', *args], capture_output=True, timeout=timeout)
+    if proc.returncode != 0 or not proc.stdout:
+        raise PreviewUnavailable(proc.stderr.decode(errors='replace')[:200] or "ffmpeg failed")
+    return proc.stdout
+
+
+def render_thumb(path, ext):
+    from PIL import Image           # imported on the first render, not with the app
+    if ext in IMAGE_EXTS:
+        img = Image.open(path)
+        img.draft('RGB', THUMB_SIZE)        # JPEG: let the decoder downscale while reading
+    elif ext in VIDEO_EXTS:
+        png = _run_ffmpeg(['-ss', '1', '-i', path, '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'])
+        img = Image.open(io.BytesIO(png))
+    else:
+        raise PreviewUnavailable(f"no thumbnail for .{ext}")
+    img = img.convert('RGB')
+    img.thumbnail(THUMB_SIZE)
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=80, optimize=True)
+    return out.getvalue()
+
+
+def _pcm_samples(path, ext, rate=8000):
+    """Mono signed 16-bit samples at a low rate: plenty for a 600px waveform."""
+    import numpy as np
+    if ext == 'wav':
+        with wave.open(path) as w:
+            if w.getsampwidth() == 2:
+                channels = w.getnchannels()
+                step = max(1, w.getframerate() // rate)
+                parts = []
+                while True:         # a chunk at a time; chunks start on a multiple of step
+                    frames = w.readframes(step * 4096)
+                    if not frames:
+                        break
+                    samples = np.frombuffer(frames, '<i2')
+                    parts.append(samples[:len(samples) - len(samples) % channels:channels * step])
+                return np.concatenate(parts) if parts else np.zeros(0, np.int16)
+    raw = _run_ffmpeg(['-i', path, '-ac', '1', '-ar', str(rate), '-f', 's16le', '-'])
+    return np.frombuffer(raw[:len(raw) - len(raw) % 2], '<i2')
+
+
+def render_wave(path, ext):
+    if ext not in AUDIO_EXTS:
+        raise PreviewUnavailable(f"no waveform for .{ext}")
+    from PIL import Image, ImageDraw
+    import numpy as np
+    samples = _pcm_samples(path, ext)
+    width, height = WAVE_SIZE
+    img = Image.new('RGBA', WAVE_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    if len(samples):
+        per_col = max(1, len(samples) // width)
+        cols = min(width, len(samples) // per_col)
+        # int32 first: abs(-32768) does not fit in int16
+        peaks = np.abs(samples[:cols * per_col].astype(np.int32)).reshape(cols, per_col).max(axis=1)
+        top = int(peaks.max()) or 1
+        mid = height / 2
+        for x, peak in enumerate(peaks.tolist()):
+            h = max(1, peak / top * (mid - 1))
+            draw.line([(x, mid - h), (x, mid + h)], fill=WAVE_COLOR)
+    out = io.BytesIO()
+    img.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+KINDS = {
+    'thumb': (render_thumb, 'jpg', 'image/jpeg'),
+    'wave': (render_wave, 'png', 'image/png'),
+}
+
+
+class DerivativeCache:
+    """
+    Disk cache of previews keyed by (blob_key, kind).
+
+      store     : the AttachmentStore holding the originals
+      max_bytes : total size budget for previews; least recently used go first
+      workers   : renders running at once (each holds one decoded file in memory)
+    """
+
+    def __init__(self, store, max_bytes=512 * 1024 * 1024, workers=2, timeout=20):
+        self.store = store
+        self.root = os.path.join(store.root, '.derived')
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='derive')
+        self._inflight = {}
+        self._lru = None            # path -> size, oldest first; loaded on first use
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def path(self, blob_key, kind):
+        return os.path.join(self.root, blob_key[:2], blob_key[2:4], f"{blob_key}.{kind}.{KINDS[kind][1]}")
+
+    @staticmethod
+    def mimetype(kind):
+        return KINDS[kind][2]
+
+    # ---------- LRU bookkeeping ----------
+    def _load(self):
+        # caller holds the lock
+        if self._lru is not None:
+            return
+        found = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, p, st.st_size))
+        found.sort()
+        self._lru = OrderedDict((p, size) for _, p, size in found)
+        self._bytes = sum(size for _, _, size in found)
+
+    def _touch(self, path):
+        with self._lock:
+            self._load()
+            if path in self._lru:
+                self._lru.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _add(self, path, size):
+        victims = []
+        with self._lock:
+            self._load()
+            self._bytes += size - self._lru.pop(path, 0)
+            self._lru[path] = size
+            while self._bytes > self.max_bytes and len(self._lru) > 1:
+                victim, vsize = self._lru.popitem(last=False)
+                self._bytes -= vsize
+                victims.append(victim)
+        for victim in victims:
+            try:
+                os.remove(victim)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+
+    # ---------- rendering ----------
+    def _render(self, blob_key, kind, ext):
+        out_path = self.path(blob_key, kind)
+        data = KINDS[kind][0](self.store.path(blob_key), ext)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp = f"{out_path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, out_path)
+        self._add(out_path, len(data))
+        self.renders += 1
+        return out_path
+
+    def get(self, blob_key, kind, ext):
+        """
+        Path of the preview, rendering it first if needed. Raises
+        PreviewUnavailable, or RenderTimeout if the render pool is backed up.
+        """
+        if kind not in KINDS:
+            raise PreviewUnavailable(f"unknown preview '{kind}'")
+        out_path = self.path(blob_key, kind)
+        if os.path.exists(out_path):
+            self.hits += 1
+            self._touch(out_path)
+            return out_path
+        if not os.path.exists(self.store.path(blob_key)):
+            raise PreviewUnavailable("original is missing")
+
+        with self._lock:
+            future = self._inflight.get((blob_key, kind))
+            if future is None:
+                future = self._pool.submit(self._render, blob_key, kind, ext)
+                self._inflight[(blob_key, kind)] = future
+                future.add_done_callback(lambda f, k=(blob_key, kind): self._inflight.pop(k, None))
+        try:
+            return future.result(self.timeout)
+        except (PreviewUnavailable, RenderTimeout):
+            raise
+        except Exception as e:          # undecodable file etc.
+            raise PreviewUnavailable(str(e))
+
+    def invalidate(self, blob_keys):
+        """Drop every preview of these blobs (call after the blobs are removed)."""
+        for key in blob_keys:
+            for kind in KINDS:
+                p = self.path(key, kind)
+                with self._lock:
+                    if self._lru is not None and p in self._lru:
+                        self._bytes -= self._lru.pop(p)
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'files': len(self._lru), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'renders': self.renders, 'hits': self.hits, 'evictions': self.evictions,
+                    'inflight': len(self._inflight)}
@@ -0,0 +1,261 @@
+# Outbound mail queue
+#
+# Requests only enqueue: messages are written to a small SQLite outbox that
+# every worker process on the host shares, and a pool of background threads
+# sends them in batches over one SMTP connection per batch. Failed sends are
+# retried with exponential backoff; messages that keep failing are moved to a
+# dead-letter table for inspection.
+import json, random, smtplib, sqlite3, sys, threading, time
+from collections import deque
+from contextlib import closing
+from urllib.request import pathname2url
+from flask_mail import Message
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload     TEXT    NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_try_at REAL    NOT NULL,
+    claimed_at  REAL,
+    created_at  REAL    NOT NULL,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (claimed_at, next_try_at);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id         INTEGER PRIMARY KEY,
+    payload    TEXT    NOT NULL,
+    attempts   INTEGER NOT NULL,
+    created_at REAL    NOT NULL,
+    failed_at  REAL    NOT NULL,
+    last_error TEXT
+);
+"""
+
+
+def message_to_payload(msg):
+    return json.dumps({
+        'subject': msg.subject,
+        'recipients': list(msg.recipients),
+        'body': msg.body,
+        'html': msg.html,
+        'sender': msg.sender,
+        'reply_to': msg.reply_to,
+    })
+
+
+def payload_to_message(payload):
+    data = json.loads(payload)
+    sender = data.get('sender')
+    return Message(data['subject'], recipients=data['recipients'], body=data.get('body'),
+                   html=data.get('html'), reply_to=data.get('reply_to'),
+                   sender=tuple(sender) if isinstance(sender, list) else sender)
+
+
+def has_pending(path):
+    """
+    True if the outbox at `path` holds undelivered mail. Cheap, and neither
+    creates the file nor needs Flask-Mail, so callers can check before
+    building a MailQueue.
+    """
+    try:
+        with closing(sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True, timeout=5)) as db:
+            return db.execute("SELECT 1 FROM outbox LIMIT 1").fetchone() is not None
+    except sqlite3.Error:       # no outbox yet
+        return False
+
+
+class MailQueue:
+    """
+    Persistent outbox plus sender threads.
+
+      workers      : sender threads per process
+      batch_size   : messages sent over one SMTP connection
+      max_attempts : tries before a message is dead-lettered
+      backoff      : base retry delay in seconds (doubles each attempt)
+      claim_ttl    : a claimed batch not finished in this time is retried
+                     (covers a worker that died mid-send)
+    """
+
+    def __init__(self, path, mail, app, workers=2, batch_size=20, max_attempts=5,
+                 backoff=30, claim_ttl=300, poll_interval=2.0):
+        self.path = path
+        self.mail = mail
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.claim_ttl = claim_ttl
+        self.poll_interval = poll_interval
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._latencies = deque(maxlen=500)     # (smtp send seconds, queued-to-sent seconds)
+        self._sent = 0
+        self._failed = 0
+
+        with closing(self._db()) as db:
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    # ---------- producer side ----------
+    def enqueue(self, msg):
+        """Persist a flask_mail.Message for background delivery and return at once."""
+        now = time.time()
+        with closing(self._db()) as db:
+            db.execute("INSERT INTO outbox (payload, next_try_at, created_at) VALUES (?, ?, ?)",
+                       (message_to_payload(msg), now, now))
+        self.start()
+        self._wake.set()
+
+    # ---------- worker side ----------
+    def start(self):
+        """Start sender threads (lazily, so each forked worker gets its own)."""
+        if self._threads and self._threads[0].is_alive():
+            return
+        with self._start_lock:
+            if self._threads and self._threads[0].is_alive():
+                return
+            self._threads = []          # inherited across a fork: the threads stayed in the parent
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"mail-sender-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def _claim(self, db):
+        """Atomically take up to batch_size due messages."""
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute("""
+                SELECT id, payload, attempts, created_at FROM outbox
+                WHERE (claimed_at IS NULL OR claimed_at < ?) AND next_try_at <= ?
+                ORDER BY next_try_at LIMIT ?
+            """, (now - self.claim_ttl, now, self.batch_size)).fetchall()
+            if rows:
+                marks = ','.join('?' * len(rows))
+                db.execute(f"UPDATE outbox SET claimed_at=? WHERE id IN ({marks})",
+                           [now] + [r[0] for r in rows])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _record_failure(self, db, row, error):
+        msg_id, payload, attempts, created_at = row
+        attempts += 1
+        self._failed += 1
+        if attempts >= self.max_attempts:
+            db.execute("INSERT INTO dead_letters (id, payload, attempts, created_at, failed_at, last_error) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (msg_id, payload, attempts, created_at, time.time(), error))
+            db.execute("DELETE FROM outbox WHERE id=?", (msg_id,))
+        else:
+            delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+            db.execute("UPDATE outbox SET attempts=?, next_try_at=?, claimed_at=NULL, last_error=? WHERE id=?",
+                       (attempts, time.time() + delay, error, msg_id))
+
+    def send_batch(self, db):
+        """Send one claimed batch over a single SMTP connection. Returns messages handled."""
+        rows = self._claim(db)
+        if not rows:
+            return 0
+        handled = set()
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as smtp:
+                    for row in rows:
+                        start = time.time()
+                        try:
+                            smtp.send(payload_to_message(row[1]))
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except Exception as e:      # this message only (bad recipient etc.)
+                            self._record_failure(db, row, str(e))
+                            handled.add(row[0])
+                            continue
+                        done = time.time()
+                        db.execute("DELETE FROM outbox WHERE id=?", (row[0],))
+                        handled.add(row[0])
+                        self._latencies.append((done - start, done - row[3]))
+                        self._sent += 1
+            except Exception as e:                  # connection-level: the rest of the batch retries
+                for row in rows:
+                    if row[0] not in handled:
+                        self._record_failure(db, row, f"smtp: {e}")
+        return len(rows)
+
+    def _run(self):
+        db = self._db()
+        while not self._stop.is_set():
+            try:
+                if self.send_batch(db):
+                    continue
+            except Exception as e:
+                print(f"❌ Mail worker error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        db.close()
+
+    # ---------- reporting ----------
+    def stats(self):
+        """Queue depth, dead letters and send latency (seconds) for this process."""
+        with closing(self._db()) as db:
+            pending, in_flight = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(claimed_at IS NOT NULL), 0) FROM outbox").fetchone()
+            dead = db.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        send = sorted(l[0] for l in self._latencies)
+        total = sorted(l[1] for l in self._latencies)
+
+        def pct(values, p):
+            return round(values[min(len(values) - 1, int(len(values) * p))], 4) if values else None
+
+        return {
+            'queue_depth': pending,
+            'in_flight': in_flight,
+            'dead_letters': dead,
+            'sent': self._sent,
+            'failed_attempts': self._failed,
+            'send_latency_p50_s': pct(send, 0.5),
+            'send_latency_p95_s': pct(send, 0.95),
+            'queued_to_sent_p50_s': pct(total, 0.5),
+            'queued_to_sent_p95_s': pct(total, 0.95),
+        }
+
+    def retry_dead(self):
+        """Move every dead letter back into the outbox. Returns how many."""
+        with closing(self._db()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute("SELECT payload, created_at FROM dead_letters").fetchall()
+            db.executemany("INSERT INTO outbox (payload, next_try_at, created_at) VALUES (?, ?, ?)",
+                           [(p, time.time(), c) for p, c in rows])
+            db.execute("DELETE FROM dead_letters")
+            db.execute("COMMIT")
+        self._wake.set()
+        return len(rows)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] not in (['stats'], ['retry-dead']):
+        print("usage: python mail_queue.py stats | retry-dead")
+        sys.exit(1)
+    from note import mail_queue
+    if sys.argv[1] == 'stats':
+        print(json.dumps(mail_queue.stats(), indent=2))
+    else:
+        print(f"✅ Re-queued {mail_queue.retry_dead()} dead letters")
@@ -0,0 +1,250 @@
+# Hot-path instrumentation + Prometheus text exposition
+#
+# Per request: latency by route/method/status, number and total time of DB
+# queries (the pool hands out cursors wrapped by wrap_cursor), and time spent
+# rendering templates. Also upload bytes/time and whatever stats() the app's
+# components already keep (pool, cache, mail queue), read at scrape time.
+# Requests and queries over SLOW_REQUEST_MS / SLOW_QUERY_MS are logged with
+# their breakdown, and PROFILE_SAMPLE_RATE profiles a fraction of requests
+# with cProfile into PROFILE_DIR.
+#
+# Numbers are per process: with several workers, scrape each one (or sum).
+import cProfile, logging, os, random, threading, time
+from bisect import bisect_left
+from flask import g, has_app_context, request, before_render_template, template_rendered
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+QUERY_VERBS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'ALTER', 'DROP'}
+
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    pairs = (f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+             for n, v in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_label_str(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}       # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(row)) for labels, row in self._values.items()]
+        names = self.labels + ('le',)
+        for labels, row in items:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                total += count
+                yield f"{self.name}_bucket{_label_str(names, labels + (bound,))} {total}"
+            yield f"{self.name}_sum{_label_str(self.labels, labels)} {row[-1]:.6f}"
+            yield f"{self.name}_count{_label_str(self.labels, labels)} {total}"
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute()/executemany() into the owning Instrumentation."""
+
+    def __init__(self, cursor, owner):
+        self._cursor = cursor
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params, *args, **kwargs)
+        finally:
+            self._owner.observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq, *args, **kwargs)
+        finally:
+            self._owner.observe_query(sql, time.perf_counter() - start)
+
+
+class Instrumentation:
+    """
+    Metrics registry plus the Flask hooks that feed it.
+
+      slow_request : log requests slower than this many seconds (0 = off)
+      slow_query   : log queries slower than this many seconds (0 = off)
+      profile_rate : fraction of requests run under cProfile (0 = off)
+      profile_dir  : where sampled profiles (.prof, for pstats/snakeviz) go
+    """
+
+    def __init__(self, slow_request=1.0, slow_query=0.2, profile_rate=0.0, profile_dir='profiles',
+                 logger=None):
+        self.slow_request = slow_request
+        self.slow_query = slow_query
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.logger = logger or logging.getLogger(__name__)
+        self._collectors = []
+
+        self.requests = Histogram('http_request_duration_seconds', "Request latency",
+                                  ('route', 'method', 'status'))
+        self.request_queries = Histogram('http_request_db_queries', "DB queries per request",
+                                         ('route',), COUNT_BUCKETS)
+        self.request_db_time = Histogram('http_request_db_seconds', "DB time per request", ('route',))
+        self.request_render_time = Histogram('http_request_render_seconds', "Template time per request",
+                                             ('route',))
+        self.queries = Histogram('db_query_duration_seconds', "Query latency by statement type", ('verb',))
+        self.renders = Histogram('template_render_seconds', "Template render time", ('template',))
+        self.upload_bytes = Counter('upload_bytes_total', "Bytes received as attachments", ('kind',))
+        self.uploads = Histogram('upload_duration_seconds', "Time to receive and store an upload", ('kind',))
+        self.slow_requests = Counter('slow_requests_total', "Requests over the slow-request threshold",
+                                     ('route',))
+        self.slow_queries = Counter('slow_queries_total', "Queries over the slow-query threshold", ('verb',))
+        self.metrics = [self.requests, self.request_queries, self.request_db_time, self.request_render_time,
+                        self.queries, self.renders, self.upload_bytes, self.uploads,
+                        self.slow_requests, self.slow_queries]
+
+    # ---------- feeding ----------
+    def wrap_cursor(self, cursor):
+        return InstrumentedCursor(cursor, self)
+
+    def observe_query(self, sql, elapsed):
+        head = sql.lstrip()[:8].split(None, 1)
+        verb = head[0].upper() if head and head[0].upper() in QUERY_VERBS else 'OTHER'
+        self.queries.observe(elapsed, verb)
+        if has_app_context():
+            stats = g.get('_req_stats')
+            if stats is not None:
+                stats['queries'] += 1
+                stats['db'] += elapsed
+        if self.slow_query and elapsed >= self.slow_query:
+            self.slow_queries.inc(verb)
+            self.logger.warning("slow query %.1fms: %s", elapsed * 1000, ' '.join(sql.split())[:500])
+
+    def observe_upload(self, kind, nbytes, elapsed):
+        self.upload_bytes.inc(kind, amount=nbytes or 0)
+        self.uploads.observe(elapsed, kind)
+
+    def collect(self, prefix, stats_fn):
+        """Export the numeric fields of stats_fn() as `<prefix>_<field>` gauges at scrape time."""
+        self._collectors.append((prefix, stats_fn))
+
+    # ---------- Flask hooks ----------
+    def init_app(self, app):
+        self.logger = app.logger
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._render_start, app)
+        template_rendered.connect(self._render_end, app)
+
+    def _before(self):
+        g._req_stats = {'start': time.perf_counter(), 'queries': 0, 'db': 0.0, 'render': 0.0,
+                        'render_start': None}
+        if self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:      # another profiler is already active in this thread
+                return
+            g._profiler = profiler
+
+    def _teardown(self, exc):
+        stats = g.pop('_req_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats['start']
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        status = getattr(g, '_status', None) or (500 if exc else 200)
+
+        self.requests.observe(elapsed, route, request.method, str(status))
+        self.request_queries.observe(stats['queries'], route)
+        self.request_db_time.observe(stats['db'], route)
+        self.request_render_time.observe(stats['render'], route)
+        if self.slow_request and elapsed >= self.slow_request:
+            self.slow_requests.inc(route)
+            self.logger.warning("slow request %.1fms %s %s -> %s (db: %d queries %.1fms, render %.1fms)",
+                                elapsed * 1000, request.method, request.full_path.rstrip('?'), status,
+                                stats['queries'], stats['db'] * 1000, stats['render'] * 1000)
+
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{elapsed * 1000:.0f}ms.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+
+    def _after(self, response):
+        # teardown doesn't see the response, so stash its status here
+        g._status = response.status_code
+        return response
+
+    def _render_start(self, sender, template, context, **extra):
+        stats = g.get('_req_stats')
+        if stats is not None:
+            stats['render_start'] = time.perf_counter()
+
+    def _render_end(self, sender, template, context, **extra):
+        stats = g.get('_req_stats')
+        if stats is None or stats['render_start'] is None:
+            return
+        elapsed = time.perf_counter() - stats['render_start']
+        stats['render'] += elapsed
+        stats['render_start'] = None
+        self.renders.observe(elapsed, template.name or '<string>')
+
+    # ---------- exposition ----------
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                self.logger.warning("metrics collector %s failed: %s", prefix, e)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return '\n'.join(lines) + '\n'
@@ -15,17 +15,33 @@ Author: Sreevardhan
 """
 
 # ---------- Imports ----------
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from itsdangerous import URLSafeTimedSerializer, SignatureExpired
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_app_context, has_request_context, Response, make_response, stream_with_context
+from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode
 from flask_mail import Mail, Message
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
-from datetime import timedelta
-import os
-from captcha_utils import generate_captcha_image, generate_captcha_text
+from werkzeug.utils import send_file as send_path
+from datetime import datetime
+import gc, os, time, zipfile
+from functools import wraps
+from app_config import Config, Lazy
+from db_pool import ConnectionPool
+from db_router import ReplicaRouter
+from search_utils import fulltext_search, SEARCH_PAGE_SIZE
+from attachment_store import AttachmentStore, attach, collect_dead, list_attachments, file_ext
+from derivatives import DerivativeCache, PreviewUnavailable, RenderTimeout
+from upload_reconciler import UploadReconciler
+from note_codec import BodyCompactor, as_text, lazy_body
+from note_history import HistoryCompactor, list_revisions, load_revision
+from note_ops import NoteError, clean_fields, create_note, update_note, delete_note as remove_note
+from sync_utils import CursorExpired, TombstoneCompactor, changes_since, parse_cursor, touch_note, SYNC_PAGE_SIZE, SYNC_MAX_PAGE_SIZE
+from chunked_upload import ChunkedUploads, UploadError
+from mail_queue import MailQueue, has_pending
+from note_cache import NoteCache
+from auth_utils import PasswordHasher, TokenBucketLimiter, parse_rate
+from notes_transfer import TransferError, export_ndjson, export_zip, import_records, import_zip
+from metrics import Instrumentation
 # from otp_utils import generate_otp, save_otp, verify_otp, get_stored_otp
 
 
@@ -33,40 +49,326 @@ from captcha_utils import generate_captcha_image, generate_captcha_text
 load_dotenv()
 
 app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET", "dev_secret_please_change")
-app.permanent_session_lifetime = timedelta(days=7)
-
-# Mail setup
-app.config.update(
-    MAIL_SERVER='smtp.gmail.com',
-    MAIL_PORT=587,
-    MAIL_USE_TLS=True,
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_DEFAULT_SENDER=("Flash Notes", os.getenv("MAIL_USERNAME"))
+
+# Request / DB / template / upload timings, exposed at /metrics
+instrumentation = Instrumentation(
+    slow_request=float(os.getenv("SLOW_REQUEST_MS", 1000)) / 1000,
+    slow_query=float(os.getenv("SLOW_QUERY_MS", 200)) / 1000,
+    profile_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+    profile_dir=os.getenv("PROFILE_DIR", os.path.join(os.getcwd(), 'profiles'))
 )
-mail = Mail(app)
-tokens = URLSafeTimedSerializer(app.secret_key)
+instrumentation.init_app(app)
+
+
+def configure(config):
+    """Copy a Config into the app; the subsystems below read it when first used."""
+    app.config.from_object(config)
+    app.secret_key = config.SECRET_KEY
+
+
+configure(Config())
+
+
+# ---------- Lazily built subsystems ----------
+# Each is built from app.config the first time a request (or preload()) uses it.
+
+# Mail: requests only enqueue; background threads deliver in batches with retries
+def _build_mail():
+    return Mail(app)
+
+
+def _build_mail_queue():
+    return MailQueue(
+        app.config['MAIL_QUEUE_PATH'], mail.instance(), app,
+        workers=app.config['MAIL_WORKERS'],
+        batch_size=app.config['MAIL_BATCH_SIZE']
+    )
+
+
+def _build_tokens():
+    return URLSafeTimedSerializer(app.secret_key)
+
+
+mail = Lazy(_build_mail)
+mail_queue = Lazy(_build_mail_queue)
+tokens = Lazy(_build_tokens)
+_mail_drain_pid = None
+
+
+@app.before_request
+def drain_mail_queue():
+    # outbox mail left by an earlier process goes out without waiting for a new
+    # message; mail and the senders are only built if there is some
+    global _mail_drain_pid
+    if _mail_drain_pid != os.getpid():
+        _mail_drain_pid = os.getpid()
+        if has_pending(app.config['MAIL_QUEUE_PATH']):
+            mail_queue.start()
+
 
-# File upload config
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static/uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+def mail_message(subject, **kwargs):
+    """A Message for mail_queue (Message reads its default sender from the mail extension)."""
+    mail.instance()
+    return Message(subject, **kwargs)
+
+
+# File uploads: content-addressed blobs, resumable uploads, previews
+def _build_attachment_store():
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return AttachmentStore(app.config['UPLOAD_FOLDER'])
+
+
+def _build_chunked_uploads():
+    return ChunkedUploads(
+        os.path.join(attachment_store.root, '.partial'),
+        max_size=app.config['UPLOAD_MAX_BYTES'],
+        max_chunk=app.config['UPLOAD_MAX_CHUNK_BYTES']
+    )
+
+
+# Thumbnails / waveforms, rendered on first request and kept under a disk budget
+def _build_derivatives():
+    return DerivativeCache(
+        attachment_store.instance(),
+        max_bytes=app.config['PREVIEW_CACHE_BYTES'],
+        workers=app.config['PREVIEW_WORKERS']
+    )
+
+
+attachment_store = Lazy(_build_attachment_store)
+chunked_uploads = Lazy(_build_chunked_uploads)
+derivatives = Lazy(_build_derivatives)
+PREVIEW_MAX_AGE = 7 * 24 * 3600
+
+ATTACHMENT_MAX_AGE = 365 * 24 * 3600
+
+
+def remove_blobs(blob_keys):
+    """
+    Delete blobs collect_dead() released (after commit) together with their
+    previews. Keys attached again since, or held by a pending chunked upload,
+    are kept; remove() leaves recently touched files to the reconciler.
+    """
+    keys = set(blob_keys) - set(chunked_uploads.pending_blobs())
+    if keys:
+        with db_pool.connection() as db:
+            cursor = db.cursor()
+            marks = ", ".join(["%s"] * len(keys))
+            cursor.execute(f"SELECT blob_key FROM attachment_blobs WHERE blob_key IN ({marks})", sorted(keys))
+            keys -= {row[0] for row in cursor.fetchall()}
+            cursor.close()
+        derivatives.invalidate(attachment_store.remove(sorted(keys)))
+    upload_reconciler.start()
+
+
+def save_upload(file):
+    """attachment_store.save_upload, counted in the upload metrics."""
+    start = time.perf_counter()
+    stored = attachment_store.save_upload(file)
+    instrumentation.observe_upload('form', stored[2], time.perf_counter() - start)
+    upload_reconciler.start()
+    return stored
 
 
 # ---------- Database Connection ----------
-def get_db_connection():
-    """Connect to MySQL and return the connection."""
+def pin_to_primary():
+    """Commit hook: keep this browser and user reading from the primary until replicas catch up."""
+    if not db_router.replicas or not has_request_context():
+        return
+    if 'Authorization' not in request.headers:      # API clients have no session cookie to carry it
+        session['_primary_until'] = time.time() + db_router.pin_seconds
+    user_id = session.get('user_id') or g.get('user_id')
+    if user_id:
+        db_router.pin(user_id)
+
+
+def _connect_args():
+    config = app.config
+    if config['DB_BACKEND'] == "sqlite":
+        # Local stand-in for benchmarks / development without a MySQL server
+        import sqlite_backend
+        sqlite_backend.ensure_schema(config['DB_SQLITE_PATH'])
+        return dict(connector=sqlite_backend.connect, path=config['DB_SQLITE_PATH'])
+    return dict(host=config['DB_HOST'], user=config['DB_USER'], password=config['DB_PASS'],
+                database=config['DB_NAME'])
+
+
+def _pool_args():
+    return dict(
+        size=app.config['DB_POOL_SIZE'],
+        max_overflow=app.config['DB_POOL_OVERFLOW'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        recycle=app.config['DB_POOL_RECYCLE'],
+        cursor_wrapper=instrumentation.wrap_cursor
+    )
+
+
+def _build_db_pool():
+    # no connection is opened until the first acquire(), so a preloaded pool is safe to fork
+    return ConnectionPool(on_commit=pin_to_primary, **_pool_args(), **_connect_args())
+
+
+def _build_db_router():
+    # MySQL read replicas: DB_REPLICA_HOSTS=host[:port],... (same database and
+    # credentials unless DB_REPLICA_USER / DB_REPLICA_PASS are set)
+    config = app.config
+    primary = db_pool.instance()
+    replica_pools = {}
+    replica_hosts = config['DB_REPLICA_HOSTS'] if config['DB_BACKEND'] != "sqlite" else ""
+    for replica in filter(None, (h.strip() for h in replica_hosts.split(','))):
+        host, _, port = replica.partition(':')
+        replica_pools[replica] = ConnectionPool(**_pool_args(), **dict(
+            primary.connect_args, host=host, port=int(port or 3306),
+            user=config['DB_REPLICA_USER'] or config['DB_USER'],
+            password=config['DB_REPLICA_PASS'] or config['DB_PASS'],
+            connection_timeout=config['DB_REPLICA_CONNECT_TIMEOUT']
+        ))
+    return ReplicaRouter(
+        primary, replica_pools,
+        retry_after=config['DB_REPLICA_RETRY'],
+        pin_seconds=config['DB_PRIMARY_PIN_SECONDS']
+    )
+
+
+db_pool = Lazy(_build_db_pool)
+db_router = Lazy(_build_db_router)
+
+
+def get_db_connection(read_only=False):
+    """
+    Check out a pooled MySQL connection; db.close() returns it to the pool.
+    read_only lookups may be served by a replica, unless this session or user
+    wrote something in the last few seconds.
+    """
     try:
-        return mysql.connector.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            user=os.getenv("DB_USER", "root"),
-            password=os.getenv("DB_PASS", ""),
-            database=os.getenv("DB_NAME", "flaskdb")
-        )
+        if read_only and db_router.replicas and has_request_context() \
+                and session.get('_primary_until', 0) < time.time() \
+                and not db_router.pinned(session.get('user_id') or g.get('user_id')):
+            db = db_router.acquire_read()
+        else:
+            db = db_pool.acquire()
     except Error as e:
         print(f"❌ Database error: {e}")
         return None
+    # remembered so teardown can hand it back if the route raised before db.close()
+    if has_app_context():
+        g.setdefault('db_connections', []).append((db, db.lease))
+    return db
+
+
+@app.teardown_appcontext
+def release_db_connections(exc):
+    """Return any connection a request forgot (or failed) to close."""
+    for db, lease in g.pop('db_connections', []):
+        db.close_lease(lease)
+
+
+# Background pass that quarantines unreferenced upload files and reports missing ones
+def _build_upload_reconciler():
+    return UploadReconciler(
+        attachment_store.instance(), db_pool,
+        interval=app.config['RECONCILE_INTERVAL'],
+        grace=app.config['RECONCILE_GRACE_HOURS'] * 3600,
+        quarantine_days=app.config['RECONCILE_QUARANTINE_DAYS'],
+        rate=app.config['RECONCILE_RATE'],
+        protected=chunked_uploads.pending_blobs,
+        on_quarantine=derivatives.invalidate
+    )
+
+
+upload_reconciler = Lazy(_build_upload_reconciler)
+
+# Compresses note bodies written before the compressed format existed (note_codec)
+def _build_body_compactor():
+    return BodyCompactor(db_pool, rate=app.config['NOTE_COMPRESS_RATE'])
+
+
+body_compactor = Lazy(_build_body_compactor)
+
+
+# ---------- Auth ----------
+# KDF work runs in a process pool; per-account / per-IP buckets stop floods before hashing
+def _build_hasher():
+    return PasswordHasher(method=app.config['HASH_METHOD'], workers=app.config['AUTH_WORKERS'] or None)
+
+
+def _build_account_limiter():
+    return TokenBucketLimiter(*parse_rate(app.config['LOGIN_RATE_ACCOUNT'], "5/60"))
+
+
+def _build_ip_limiter():
+    return TokenBucketLimiter(*parse_rate(app.config['LOGIN_RATE_IP'], "30/60"))
+
+
+hasher = Lazy(_build_hasher)
+account_limiter = Lazy(_build_account_limiter)
+ip_limiter = Lazy(_build_ip_limiter)
+
+
+# ---------- Note Cache ----------
+def _build_note_cache():
+    return NoteCache(
+        max_entries=app.config['NOTE_CACHE_SIZE'],
+        ttl=app.config['NOTE_CACHE_TTL'],
+        shared_url=app.config['NOTE_CACHE_REDIS_URL'],
+        validate=app.config['NOTE_CACHE_VALIDATE'],
+        gen_path=app.config['NOTE_CACHE_GEN_PATH']
+    )
+
+
+note_cache = Lazy(_build_note_cache)
+
+
+def cache_stamp(sql, params):
+    """change_seq the primary has now for a cached row (None if the row is gone)."""
+    db = get_db_connection()
+    cursor = db.cursor()
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    cursor.close(); db.close()
+    return row[0] if row else None
+
+
+def load_note(user_id, note_id):
+    """Read-through: cached note + attachments, or None if it isn't the user's note."""
+    key = note_cache.note_key(user_id, note_id)
+    note_stamp = "SELECT change_seq FROM notes WHERE id=%s AND user_id=%s"
+    entry = note_cache.get(key)
+    if entry is not None and note_cache.validate and entry['stamp'] != cache_stamp(note_stamp, (note_id, user_id)):
+        entry = None        # written by another worker since it was cached
+    if entry is None:
+        db = get_db_connection(read_only=True)
+        replica = getattr(db, 'replica', None)
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, user_id, title, content, content_format, content_z, create_at, updated_at, version,
+                   change_seq
+            FROM notes WHERE id=%s AND user_id=%s
+        """, (note_id, user_id))
+        note = cursor.fetchone()
+        attachments = list_attachments(cursor, note_id) if note else []
+        cursor.close(); db.close()
+        if not note:
+            return None
+        stamp = note.pop('change_seq')
+        if replica and stamp != cache_stamp(note_stamp, (note_id, user_id)):
+            key = None      # a lagging replica (another device of a pinned user): serve, don't cache
+        # a compressed body stays compressed (in the cache too) until a page prints it
+        entry = note_cache.put_note(key, lazy_body(note), attachments, stamp)
+    return entry
+
+
+def note_response(entry, template):
+    """Render a note page with validators; answers 304 without rendering when the client is current."""
+    not_modified = (entry['etag'] in request.if_none_match
+                    and not session.get('_flashes'))     # pending flashes must be shown
+    response = Response(status=304) if not_modified else \
+        make_response(render_template(template, note=entry['note'], attachments=entry['attachments']))
+    response.set_etag(entry['etag'])
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 # ---------- Routes ----------
@@ -91,18 +393,21 @@ def register():
             flash("Please fill all the fields", "warning")
             return redirect(url_for('register'))
 
+        hashed_pw = hasher.hash(password)
         db = get_db_connection()
         cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM noteusers WHERE email=%s OR username=%s OR mobile = %s", (email, username,mobile))
-        if cursor.fetchone():
-            flash("User already exists", "danger")
+        try:
+            # unique keys on email / username / mobile (schema.py) do the duplicate check
+            cursor.execute("INSERT INTO noteusers (email, username, password,mobile) VALUES (%s, %s, %s,%s)",
+                           (email, username, hashed_pw,mobile))
+            db.commit()
+        except mysql.connector.IntegrityError as e:
+            db.rollback()
             cursor.close(); db.close()
+            if e.errno != errorcode.ER_DUP_ENTRY:
+                raise
+            flash("User already exists", "danger")
             return redirect(url_for('register'))
-
-        hashed_pw = generate_password_hash(password)
-        cursor.execute("INSERT INTO noteusers (email, username, password,mobile) VALUES (%s, %s, %s,%s)",
-                       (email, username, hashed_pw,mobile))
-        db.commit()
         cursor.close(); db.close()
         flash("✅ Registration successful! Please login.", "success")
         return redirect(url_for('login'))
@@ -111,12 +416,20 @@ def register():
 
 
 # ========== CAPTCHA ==========
+def _build_captcha_pool():
+    from captcha_utils import CaptchaPool       # Pillow + numpy: loaded when the first CAPTCHA is asked for
+    return CaptchaPool(size=app.config['CAPTCHA_POOL_SIZE'])
+
+
+captcha_pool = Lazy(_build_captcha_pool)
+
+
 @app.route('/captcha')
 def captcha():
-    text = generate_captcha_text()
+    """Serve a pre-rendered CAPTCHA from the pool."""
+    text, png = captcha_pool.get()
     session['captcha_text'] = text
-    img_buf = generate_captcha_image(text)
-    return send_file(img_buf, mimetype='image/png')
+    return Response(png, mimetype='image/png', headers={'Cache-Control': 'no-store'})
 
 '''
 # ========== SEND & VALIDATE CAPTCHA ==========
@@ -163,9 +476,9 @@ def send_otp():
     try:
         if app.config.get('MAIL_USERNAME'):
             # send to registered email (for dev convenience)
-            msg = Message("Your Flash Notes OTP", recipients=[user['email']])
+            msg = mail_message("Your Flash Notes OTP", recipients=[user['email']])
             msg.body = f"Your OTP is: {otp} (valid 5 minutes)."
-            mail.send(msg)
+            mail_queue.enqueue(msg)
             flash("OTP sent to your registered email address.", "info")
         else:
             # dev fallback: show OTP in flash (not for production)
@@ -226,19 +539,33 @@ def login():
             flash("Incorrect CAPTCHA. Try again.", "danger")
             return redirect(url_for('login'))
         
+        # Throttle before touching the DB or the KDF
+        if not ip_limiter.allow(request.remote_addr) or not account_limiter.allow(username.lower()):
+            wait = max(ip_limiter.retry_after(request.remote_addr), account_limiter.retry_after(username.lower()))
+            flash(f"Too many login attempts. Try again in {wait} seconds.", "danger")
+            return render_template('login.html'), 429
+
         # Checking DB for the user
-        db = get_db_connection()
+        db = get_db_connection(read_only=True)
         cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM noteusers WHERE username=%s", (username,))
+        cursor.execute("SELECT id, username, password FROM noteusers WHERE username=%s", (username,))
         user = cursor.fetchone()
-        cursor.close(); db.close()
-
-        if user and check_password_hash(user['password'], password):
+        cursor.close(); db.close()      # don't hold a pooled connection while hashing
+
+        if user and hasher.check(user['password'], password):
+            # Transparently upgrade hashes made with older cost parameters
+            if hasher.needs_rehash(user['password']):
+                new_hash = hasher.hash(password)
+                db = get_db_connection()
+                cursor = db.cursor()
+                cursor.execute("UPDATE noteusers SET password=%s WHERE id=%s", (new_hash, user['id']))
+                db.commit()
+                cursor.close(); db.close()
             session['user_id'] = user['id']
             session['username'] = user['username']
             flash(f"Welcome {user['username']}!", "success")
             return redirect(url_for('view_all'))
-        
+
         flash("Invalid credentials", "danger")
         
     return render_template('login.html')
@@ -262,7 +589,7 @@ def forgot():
             flash("Please enter your email", "warning")
             return redirect(url_for('forgot'))
 
-        db = get_db_connection()
+        db = get_db_connection(read_only=True)
         cursor = db.cursor(dictionary=True)
         cursor.execute("SELECT * FROM noteusers WHERE email=%s", (email,))
         user = cursor.fetchone()
@@ -275,11 +602,11 @@ def forgot():
         token = tokens.dumps(email, salt='reset-password')
         reset_link = url_for('reset_password', token=token, _external=True)
 
-        msg = Message("Password Reset - Flash Notes", recipients=[email])
+        msg = mail_message("Password Reset - Flash Notes", recipients=[email])
         msg.body = f"Hello {user['username']},\n\nClick below to reset your password:\n{reset_link}\n\nLink valid for 5 minutes.\n\n- Flash Notes Team"
 
         try:
-            mail.send(msg)
+            mail_queue.enqueue(msg)
             flash("Reset link sent to your email.", "info")
         except Exception as e:
             flash(f"Failed to send email: {e}", "danger")
@@ -306,7 +633,7 @@ def reset_password(token):
         db = get_db_connection()
         cursor = db.cursor()
         cursor.execute("UPDATE noteusers SET password=%s WHERE email=%s",
-                       (generate_password_hash(pw), email))
+                       (hasher.hash(pw), email))
         db.commit()
         cursor.close(); db.close()
         flash("Password reset successfully.", "success")
@@ -331,42 +658,113 @@ def add_note():
             flash("Title is required", "warning")
             return redirect(url_for('add_note'))
 
-        uploaded_files = request.files.getlist('attachments')
-        saved_files = []
-        for file in uploaded_files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                saved_files.append(filename)
-
-        attachments_str = ','.join(saved_files) if saved_files else None
+        # Stream + hash each upload into the blob store before touching the DB
+        uploads = [save_upload(f)
+                   for f in request.files.getlist('attachments') if f and f.filename]
+        # ...plus anything already sent through the chunked upload API
+        chunked, claimed = chunked_uploads.claim(request.form.getlist('upload_ids'), user_id)
 
         db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute("INSERT INTO notes (title, content, user_id, attachments, create_at) VALUES (%s, %s, %s, %s, NOW())",
-                       (title, content, user_id, attachments_str))
-        db.commit()
-        cursor.close(); db.close()
+        cursor = db.cursor(dictionary=True)
+        try:
+            create_note(cursor, user_id, title, content, uploads + chunked)
+            db.commit()
+        except Exception:
+            db.rollback()
+            chunked_uploads.release(claimed)
+            raise
+        finally:
+            cursor.close(); db.close()
+        chunked_uploads.forget(claimed)
+        note_cache.invalidate_lists(user_id)
         flash("Note added successfully!", "success")
         return redirect(url_for('view_all'))
 
     return render_template('addnote.html')
 
 
+# Dashboard paging: keyset cursor on (create_at, id) so deep pages cost the same as page one
+NOTES_PAGE_SIZE = 24
+NOTES_MAX_PAGE_SIZE = 100
+EXCERPT_LEN = 120
+
+
+def encode_cursor(note):
+    """Opaque 'next page' cursor pointing just past `note`."""
+    return f"{note['create_at'].strftime('%Y%m%d%H%M%S%f')}.{note['id']}"
+
+
+def decode_cursor(cursor):
+    """Parse a cursor from encode_cursor(); returns (create_at, id) or None if malformed."""
+    try:
+        stamp, note_id = cursor.split('.')
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(note_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def list_notes(user_id, after_token, per_page):
+    """One page of the user's notes, newest first (cached): (notes, next_cursor)."""
+    after = decode_cursor(after_token)
+    key = note_cache.list_key(user_id, after_token if after else '', per_page)
+    list_stamp = "SELECT change_seq FROM noteusers WHERE id=%s"
+    cached = note_cache.get(key)
+    if cached and (not note_cache.validate or cached['stamp'] == cache_stamp(list_stamp, (user_id,))):
+        return cached['value']
+    # any write after this stamp invalidates what the query below returns
+    stamp = cache_stamp(list_stamp, (user_id,)) if note_cache.validate else None
+
+    # Only the columns the cards render: the stored excerpt, never the body
+    sql = """
+        SELECT id, title, create_at, version,
+               LEFT(excerpt, %s) AS excerpt,
+               content_chars > %s AS truncated
+        FROM notes
+        WHERE user_id=%s
+    """
+    params = [EXCERPT_LEN, EXCERPT_LEN, user_id]
+    if after:
+        sql += " AND (create_at < %s OR (create_at = %s AND id < %s))"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY create_at DESC, id DESC LIMIT %s"
+    params.append(per_page + 1)     # one extra row tells us whether a next page exists
+
+    db = get_db_connection(read_only=True)
+    cursor = db.cursor(dictionary=True)
+    cursor.execute(sql, params)
+    notes = cursor.fetchall()
+    if getattr(db, 'replica', None):
+        # the replica's counter, from the same snapshot as the page
+        cursor.execute(list_stamp, (user_id,))
+        seen = (cursor.fetchone() or {}).get('change_seq')
+        stamp = cache_stamp(list_stamp, (user_id,))
+        if seen != stamp:
+            key = None      # a lagging replica: serve the page, don't cache it
+    cursor.close(); db.close()
+    body_compactor.start()
+
+    next_cursor = None
+    if len(notes) > per_page:
+        notes = notes[:per_page]
+        next_cursor = encode_cursor(notes[-1])
+    note_cache.put_list(key, (notes, next_cursor), stamp)
+    return notes, next_cursor
+
+
 @app.route('/view_all')
 def view_all():
-    """View all notes belonging to the logged-in user."""
+    """View the logged-in user's notes, newest first, one page at a time."""
     if 'user_id' not in session:
         flash("Please login first", "warning")
         return redirect(url_for('login'))
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM notes WHERE user_id=%s ORDER BY create_at DESC", (session['user_id'],))
-    notes = cursor.fetchall()
-    cursor.close(); db.close()
-    return render_template('viewnote.html', notes=notes)
+    per_page = request.args.get('per_page', NOTES_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, NOTES_MAX_PAGE_SIZE))
+    after_token = request.args.get('after', '')
+    notes, next_cursor = list_notes(session['user_id'], after_token, per_page)
+
+    return render_template('viewnote.html', notes=notes, next_cursor=next_cursor,
+                           per_page=per_page, is_first_page=decode_cursor(after_token) is None)
 
 
 @app.route('/note/<int:note_id>')
@@ -376,16 +774,11 @@ def single_note(note_id):
         flash("Please login first", "warning")
         return redirect(url_for('login'))
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM notes WHERE id=%s AND user_id=%s", (note_id, session['user_id']))
-    note = cursor.fetchone()
-    cursor.close(); db.close()
-
-    if not note:
+    entry = load_note(session['user_id'], note_id)
+    if not entry:
         flash("Note not found.", "danger")
         return redirect(url_for('view_all'))
-    return render_template('singlenote.html', note=note)
+    return note_response(entry, 'singlenote.html')
 
 
 @app.route('/edit_note/<int:note_id>', methods=['GET', 'POST'])
@@ -395,77 +788,56 @@ def edit_note(note_id):
         flash("Please login first", "warning")
         return redirect(url_for('login'))
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM notes WHERE id=%s AND user_id=%s", (note_id, session['user_id']))
-    note = cursor.fetchone()
-
-    if not note:
-        flash("Unauthorized or invalid note.", "danger")
-        cursor.close(); db.close()
-        return redirect(url_for('view_all'))
+    if request.method == 'GET':
+        entry = load_note(session['user_id'], note_id)
+        if not entry:
+            flash("Unauthorized or invalid note.", "danger")
+            return redirect(url_for('view_all'))
+        return note_response(entry, 'updatenote.html')
 
-    if request.method == 'POST':
-        title = request.form['title'].strip()
-        content = request.form['content'].strip()
-
-        # ✅ Step 1: Update title and content
-        cursor.execute(
-            "UPDATE notes SET title=%s, content=%s WHERE id=%s AND user_id=%s",
-            (title, content, note_id, session['user_id'])
-        )
-
-        # ✅ Step 2: Handle file deletions (safe and clean)
-        files_to_delete = request.form.getlist('delete_files')
-
-        # Existing attachments (split safely even if None)
-        existing_files = note['attachments'].split(',') if note.get('attachments') else []
-
-        # Delete the selected files from storage
-        if files_to_delete:
-            for filename in files_to_delete:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-            # Remove deleted files from attachment list
-            remaining_files = [f for f in existing_files if f not in files_to_delete]
-        else:
-            # If no files marked for deletion, keep all
-            remaining_files = existing_files
-
-        # Update database with new attachments list
-        new_attachments = ','.join(remaining_files)
-        cursor.execute("UPDATE notes SET attachments = %s WHERE id=%s", (new_attachments, note_id))
-        note['attachments'] = new_attachments  # Update local variable
-
-
-        # ✅ Step 3: Handle new uploads
-        uploaded_files = request.files.getlist('attachments')
-        saved_files = []
-        for file in uploaded_files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                saved_files.append(filename)
-
-        if saved_files:
-            if note['attachments']:
-                updated_list = note['attachments'].split(',') + saved_files
-            else:
-                updated_list = saved_files
+    # Partial update: a field that wasn't sent keeps its current value
+    try:
+        changes = clean_fields(request.form, partial=True)
+    except NoteError as e:
+        flash(str(e), "warning")
+        return redirect(url_for('edit_note', note_id=note_id))
+    base_version = request.form.get('version', type=int)
+    delete_ids = [int(i) for i in request.form.getlist('delete_files') if i.isdigit()]
 
-            cursor.execute("UPDATE notes SET attachments = %s WHERE id=%s", (','.join(updated_list), note_id))
+    # Stream new files into the blob store before the transaction starts
+    uploads = [save_upload(f) for f in request.files.getlist('attachments') if f and f.filename]
+    chunked, claimed = chunked_uploads.claim(request.form.getlist('upload_ids'), session['user_id'])
 
+    db = get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    try:
+        _, released = update_note(cursor, session['user_id'], note_id, changes, base_version,
+                                  delete_ids, uploads + chunked)
+        dead_blobs = collect_dead(cursor, released)
         db.commit()
+    except Exception as e:
+        # New blobs stay unreferenced on disk; re-sending the same files reuses them
+        db.rollback()
+        chunked_uploads.release(claimed)
+        if not isinstance(e, NoteError):
+            raise
+        if e.status == 404:
+            flash("Unauthorized or invalid note.", "danger")
+            return redirect(url_for('view_all'))
+        flash("This note was changed in another window since you opened it. "
+              "Review the latest version and apply your edits again.", "warning")
+        return redirect(url_for('edit_note', note_id=note_id))
+    finally:
         cursor.close(); db.close()
 
-        flash("✅ Note updated successfully", "success")
-        return redirect(url_for('view_all'))
-
-    cursor.close(); db.close()
-    return render_template('updatenote.html', note=note)
+    chunked_uploads.forget(claimed)
+    note_cache.invalidate_note(session['user_id'], note_id)
+    history_compactor.start()
+    # Blobs no other note references can go once the commit has landed
+    remove_blobs(dead_blobs)
 
+    flash("✅ Note updated successfully", "success")
+    return redirect(url_for('view_all'))
 
 
 @app.route('/delete_note/<int:note_id>', methods=['POST'])
@@ -477,27 +849,585 @@ def delete_note(note_id):
 
     db = get_db_connection()
     cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT attachments FROM notes WHERE id=%s AND user_id=%s",
-                   (note_id, session['user_id']))
-    note = cursor.fetchone()
-
-    if note and note.get('attachments'):
-        for filename in note['attachments'].split(','):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-
-    cursor.execute("DELETE FROM notes WHERE id=%s AND user_id=%s", (note_id, session['user_id']))
+    try:
+        dead_blobs = collect_dead(cursor, remove_note(cursor, session['user_id'], note_id))
+        tombstone_compactor.start()
+    except NoteError:
+        dead_blobs = []
     db.commit()
     cursor.close(); db.close()
+    note_cache.invalidate_note(session['user_id'], note_id)
+    remove_blobs(dead_blobs)
     flash("🗑️ Note deleted successfully", "success")
     return redirect(url_for('view_all'))
 
 
+# ========== HISTORY ==========
+# Earlier versions of a note, kept by update_note() (note_history)
+def _build_history_compactor():
+    return HistoryCompactor(
+        db_pool,
+        keep_days=app.config['HISTORY_KEEP_DAYS'],
+        max_days=app.config['HISTORY_MAX_DAYS'],
+        interval=app.config['HISTORY_COMPACT_INTERVAL']
+    )
+
+
+history_compactor = Lazy(_build_history_compactor)
+
+
+@app.route('/note/<int:note_id>/history')
+def note_history(note_id):
+    """List the saved revisions of a note."""
+    if 'user_id' not in session:
+        flash("Please login first", "warning")
+        return redirect(url_for('login'))
+
+    entry = load_note(session['user_id'], note_id)
+    if not entry:
+        flash("Note not found.", "danger")
+        return redirect(url_for('view_all'))
+    db = get_db_connection(read_only=True)
+    cursor = db.cursor(dictionary=True)
+    revisions = list_revisions(cursor, note_id)
+    cursor.close(); db.close()
+    return render_template('history.html', note=entry['note'], revisions=revisions)
+
+
+@app.route('/note/<int:note_id>/history/<int:revision>')
+def note_revision(note_id, revision):
+    """Show one revision, rebuilt from its snapshot."""
+    if 'user_id' not in session:
+        flash("Please login first", "warning")
+        return redirect(url_for('login'))
+
+    entry = load_note(session['user_id'], note_id)
+    db = get_db_connection(read_only=True)
+    cursor = db.cursor(dictionary=True)
+    old = load_revision(cursor, note_id, revision) if entry else None
+    cursor.close(); db.close()
+    if not old:
+        flash("Revision not found.", "danger")
+        return redirect(url_for('note_history', note_id=note_id) if entry else url_for('view_all'))
+    return render_template('revision.html', note=entry['note'], revision=old)
+
+
+@app.route('/note/<int:note_id>/history/<int:revision>/restore', methods=['POST'])
+def restore_revision(note_id, revision):
+    """Make a revision the current version; the version it replaces goes into the history too."""
+    if 'user_id' not in session:
+        flash("Please login first", "warning")
+        return redirect(url_for('login'))
+
+    db = get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id FROM notes WHERE id=%s AND user_id=%s", (note_id, session['user_id']))
+        old = load_revision(cursor, note_id, revision) if cursor.fetchone() else None
+        if not old:
+            raise NoteError("Revision not found", 404)
+        update_note(cursor, session['user_id'], note_id, {'title': old['title'], 'content': old['content']})
+        db.commit()
+    except NoteError:
+        db.rollback()
+        flash("Revision not found.", "danger")
+        return redirect(url_for('view_all'))
+    finally:
+        cursor.close(); db.close()
+
+    note_cache.invalidate_note(session['user_id'], note_id)
+    history_compactor.start()
+    flash(f"✅ Restored revision {revision}", "success")
+    return redirect(url_for('single_note', note_id=note_id))
+
+
+# ========== JSON API (v1) ==========
+# The note operations without redirects or page renders, for scripts and the
+# mobile wrapper. Auth: the browser session, or "Authorization: Bearer <token>"
+# with a token from POST /api/v1/token (valid API_TOKEN_TTL seconds).
+
+
+def current_user_id():
+    """Session user, else the user a valid bearer token was issued to, else None."""
+    if 'user_id' in session:
+        return session['user_id']
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        try:
+            return tokens.loads(auth[7:], salt='api-token', max_age=app.config['API_TOKEN_TTL'])['uid']
+        except (BadSignature, KeyError, TypeError):
+            return None
+    return None
+
+
+def api_error(message, status, **extra):
+    return jsonify({'error': message, **extra}), status
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.user_id = current_user_id()
+        if g.user_id is None:
+            return api_error("Login required", 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def api_note(note, attachments=None):
+    """Compact JSON shape of a note: list rows carry an excerpt, full notes their content."""
+    out = {'id': note['id'], 'title': note['title'], 'version': note.get('version'),
+           'created': note['create_at'].isoformat() if note.get('create_at') else None}
+    if note.get('updated_at'):
+        out['updated'] = note['updated_at'].isoformat()
+    if 'content' in note:
+        out['content'] = as_text(note['content'])
+    else:
+        out['excerpt'] = note['excerpt']
+        out['truncated'] = bool(note['truncated'])
+    if attachments is not None:
+        out['attachments'] = [{'id': a['id'], 'filename': a['filename'], 'size': a['size'],
+                               'url': url_for('download_attachment', attachment_id=a['id'])} for a in attachments]
+    return out
+
+
+def apply_note_op(cursor, user_id, op):
+    """
+    Run one API write inside the caller's transaction:
+    (result, released_blobs, claimed_upload_ids, created).
+    """
+    if not isinstance(op, dict):
+        raise NoteError("Each operation must be an object", 422)
+    kind = op.get('op')
+    note_id = op.get('id')
+    if kind in ('update', 'delete') and not isinstance(note_id, int):
+        raise NoteError("'id' is required", 422)
+    delete_ids = [i for i in op.get('delete_attachments') or [] if isinstance(i, int)]
+    upload_ids = [str(i) for i in op.get('upload_ids') or []]
+
+    if kind == 'create':
+        fields = clean_fields(op)
+        uploads, claimed = chunked_uploads.claim(upload_ids, user_id)
+        note_id = create_note(cursor, user_id, fields['title'], fields['content'], uploads)
+        return {'op': kind, 'id': note_id, 'version': 1}, [], claimed, True
+    if kind == 'update':
+        base_version = op.get('version')
+        if base_version is not None and not isinstance(base_version, int):
+            raise NoteError("'version' must be an integer", 422)
+        uploads, claimed = chunked_uploads.claim(upload_ids, user_id)
+        version, released = update_note(cursor, user_id, note_id, clean_fields(op, partial=True),
+                                        base_version, delete_ids, uploads)
+        return {'op': kind, 'id': note_id, 'version': version}, released, claimed, False
+    if kind == 'delete':
+        released = remove_note(cursor, user_id, note_id)
+        tombstone_compactor.start()
+        return {'op': kind, 'id': note_id}, released, [], False
+    raise NoteError("'op' must be create, update or delete", 422)
+
+
+def run_note_ops(user_id, ops):
+    """
+    Apply operations in one transaction with one commit; all or nothing.
+    Returns the per-op results, or raises NoteError (with .index) after rolling back.
+    """
+    results, released, claimed, touched, created = [], [], [], set(), False
+    db = get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    try:
+        for index, op in enumerate(ops):
+            try:
+                result, freed, taken, is_new = apply_note_op(cursor, user_id, op)
+                claimed += taken
+            except NoteError as e:
+                e.index = index
+                raise
+            results.append(result)
+            released += freed
+            created = created or is_new
+            if not is_new:
+                touched.add(result['id'])
+        # only after every op: a blob deleted by one op and re-added by another stays
+        dead_blobs = collect_dead(cursor, released)
+        db.commit()
+    except Exception:
+        db.rollback()
+        chunked_uploads.release(claimed)
+        raise
+    finally:
+        cursor.close(); db.close()
+
+    chunked_uploads.forget(claimed)
+    for note_id in touched:
+        note_cache.invalidate_note(user_id, note_id)
+    if created:
+        note_cache.invalidate_lists(user_id)
+    remove_blobs(dead_blobs)
+    return results
+
+
+def api_write(ops, batch=False):
+    """Run ops and turn a NoteError into its JSON error response."""
+    try:
+        return run_note_ops(g.user_id, ops), None
+    except NoteError as e:
+        extra = {'index': e.index} if batch else {}
+        if e.current_version is not None:
+            extra['current_version'] = e.current_version
+        return None, api_error(str(e), e.status, **extra)
+
+
+@app.route('/api/v1/token', methods=['POST'])
+def api_token():
+    """Exchange {username, password} for a bearer token."""
+    data = request.get_json(silent=True) or {}
+    username = str(data.get('username', '')).strip()
+    password = str(data.get('password', ''))
+    if not ip_limiter.allow(request.remote_addr) or not account_limiter.allow(username.lower()):
+        return api_error("Too many login attempts", 429)
+
+    db = get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("SELECT id, password FROM noteusers WHERE username=%s", (username,))
+    user = cursor.fetchone()
+    cursor.close(); db.close()
+    if not user or not hasher.check(user['password'], password):
+        return api_error("Invalid credentials", 401)
+    return jsonify({'token': tokens.dumps({'uid': user['id']}, salt='api-token'),
+                    'expires_in': app.config['API_TOKEN_TTL']})
+
+
+@app.route('/api/v1/notes', methods=['GET', 'POST'])
+@api_login_required
+def api_notes():
+    """GET: one page of notes (?limit=&after=). POST: create {title, content, upload_ids?}."""
+    if request.method == 'GET':
+        per_page = max(1, min(request.args.get('limit', NOTES_PAGE_SIZE, type=int), NOTES_MAX_PAGE_SIZE))
+        notes, next_cursor = list_notes(g.user_id, request.args.get('after', ''), per_page)
+        return jsonify({'notes': [api_note(n) for n in notes], 'next': next_cursor})
+
+    op = dict(request.get_json(silent=True) or {}, op='create')
+    results, error = api_write([op])
+    if error:
+        return error
+    response = jsonify(results[0])
+    response.status_code = 201
+    response.headers['Location'] = url_for('api_note_detail', note_id=results[0]['id'])
+    return response
+
+
+@app.route('/api/v1/notes/<int:note_id>', methods=['GET', 'PATCH', 'DELETE'])
+@api_login_required
+def api_note_detail(note_id):
+    """GET one note with attachments; PATCH {title?, content?, version?, ...}; DELETE."""
+    if request.method == 'GET':
+        entry = load_note(g.user_id, note_id)
+        if not entry:
+            return api_error("Note not found", 404)
+        if entry['etag'] in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = jsonify(api_note(entry['note'], entry['attachments']))
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    op = {'op': 'delete', 'id': note_id} if request.method == 'DELETE' else \
+        dict(request.get_json(silent=True) or {}, op='update', id=note_id)
+    results, error = api_write([op])
+    if error:
+        return error
+    return ('', 204) if request.method == 'DELETE' else jsonify(results[0])
+
+
+@app.route('/api/v1/notes/batch', methods=['POST'])
+@api_login_required
+def api_notes_batch():
+    """{ops: [{op: create|update|delete, ...}, ...]} in one transaction; all or nothing."""
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    if not isinstance(ops, list) or not ops:
+        return api_error("'ops' must be a non-empty list", 422)
+    if len(ops) > app.config['API_BATCH_MAX']:
+        return api_error(f"At most {app.config['API_BATCH_MAX']} operations per batch", 413)
+    results, error = api_write(ops, batch=True)
+    return error or jsonify({'results': results})
+
+
+# ========== SYNC ==========
+# Deltas for offline clients: everything written or deleted after a cursor.
+def _build_tombstone_compactor():
+    return TombstoneCompactor(
+        db_pool,
+        ttl_days=app.config['TOMBSTONE_TTL_DAYS'],
+        interval=app.config['TOMBSTONE_COMPACT_INTERVAL']
+    )
+
+
+tombstone_compactor = Lazy(_build_tombstone_compactor)
+
+
+@app.route('/sync')
+@api_login_required
+def sync():
+    """?since=<cursor>&limit=N -> {notes, deleted, cursor, has_more}; omit since for a full sync."""
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return api_error("Invalid cursor", 400)
+    limit = max(1, min(request.args.get('limit', SYNC_PAGE_SIZE, type=int), SYNC_MAX_PAGE_SIZE))
+
+    db = get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    try:
+        delta = changes_since(cursor, g.user_id, since, limit)
+    except CursorExpired:
+        return api_error("Cursor expired; sync again without 'since'", 410)
+    finally:
+        cursor.close(); db.close()
+
+    delta['notes'] = [api_note(n, n['attachments']) for n in delta['notes']]
+    return jsonify(delta)
+
+
+# ========== CHUNKED UPLOADS ==========
+def upload_error(e):
+    """JSON body for an UploadError (includes the resume offset when known)."""
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+
+def upload_info(meta):
+    return {'upload_id': meta['id'], 'filename': meta['filename'], 'status': meta['status'],
+            'offset': meta.get('offset', meta.get('size')), 'total': meta['total'], 'max_chunk': chunked_uploads.max_chunk}
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Open a resumable upload session: JSON {filename, size?}."""
+    user_id = current_user_id()      # session or API token
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    data = request.get_json(silent=True) or request.form
+    try:
+        total = int(data['size']) if data.get('size') not in (None, '') else None
+        meta = chunked_uploads.create(user_id, data.get('filename', ''), total)
+    except ValueError:
+        return jsonify({'error': 'Invalid size'}), 400
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(upload_info(meta)), 201
+
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """GET: current offset (for resuming). PUT: append bytes given by Content-Range."""
+    user_id = current_user_id()      # session or API token
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    try:
+        if request.method == 'PUT':
+            start = time.perf_counter()
+            chunked_uploads.append(upload_id, user_id, request.headers.get('Content-Range'),
+                                   request.stream, request.content_length)
+            instrumentation.observe_upload('chunk', request.content_length, time.perf_counter() - start)
+        meta = chunked_uploads.status(upload_id, user_id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(upload_info(meta))
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Verify the SHA-256 and finish; attaches straight to `note_id` if one is given."""
+    user_id = current_user_id()      # session or API token
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    data = request.get_json(silent=True) or request.form
+    note_id = data.get('note_id')
+    if note_id not in (None, ''):
+        try:
+            note_id = int(note_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid note_id'}), 400
+    try:
+        meta = chunked_uploads.complete(upload_id, user_id, data.get('sha256'), attachment_store)
+    except UploadError as e:
+        return upload_error(e)
+
+    if note_id:
+        db = get_db_connection()
+        cursor = db.cursor()
+        claimed = []
+        try:
+            cursor.execute("SELECT id FROM notes WHERE id=%s AND user_id=%s", (note_id, user_id))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Note not found'}), 404
+            touch_note(cursor, user_id, note_id)        # attachments count as a change for sync
+            uploads, claimed = chunked_uploads.claim([upload_id], user_id)
+            for upload in uploads:
+                attach(cursor, note_id, *upload)
+            db.commit()
+        except Exception:
+            db.rollback()
+            chunked_uploads.release(claimed)
+            raise
+        finally:
+            cursor.close(); db.close()
+        chunked_uploads.forget(claimed)
+        note_cache.invalidate_note(user_id, note_id)
+        meta['status'] = 'attached'
+    return jsonify(upload_info(meta))
+
+
+# ========== ATTACHMENTS ==========
+def find_attachment(user_id, attachment_id):
+    """blob_key + filename of an attachment on one of the user's notes, or None."""
+    db = get_db_connection(read_only=True)
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT a.blob_key, a.filename FROM note_attachments a JOIN notes n ON n.id = a.note_id
+        WHERE a.id=%s AND n.user_id=%s
+    """, (attachment_id, user_id))
+    att = cursor.fetchone()
+    cursor.close(); db.close()
+    return att
+
+
+def send_stored(path, etag, max_age, mimetype=None, download_name=None, as_attachment=False):
+    """
+    Serve a file from the upload store. Its URL always maps to the same bytes,
+    so it gets a strong ETag and immutable caching. With ATTACHMENT_OFFLOAD the
+    front proxy sends the bytes (and handles Range) once we've ruled out a 304;
+    otherwise werkzeug does, with Range support and wsgi.file_wrapper (sendfile
+    under gunicorn/uWSGI) for whole-file responses.
+    """
+    offload = bool(app.config['ATTACHMENT_OFFLOAD'])
+    response = send_path(os.path.abspath(path), request.environ, mimetype=mimetype,
+                         download_name=download_name, as_attachment=as_attachment,
+                         use_x_sendfile=offload, conditional=not offload, etag=etag, max_age=max_age,
+                         response_class=app.response_class)
+    if offload:
+        response.make_conditional(request)
+        if app.config['ATTACHMENT_OFFLOAD'] == 'x-accel':
+            rel = os.path.relpath(path, attachment_store.root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/') + '/' + rel
+            del response.headers['X-Sendfile']
+    response.headers['Cache-Control'] = f'private, max-age={max_age}, immutable'
+    return response
+
+
+@app.before_request
+def hide_upload_store():
+    # uploads/ lives under static/ for historical reasons; files are only served with an owner check
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('uploads/'):
+        return render_template('404.html'), 404
+
+
+@app.route('/attachments/<int:attachment_id>')
+def download_attachment(attachment_id):
+    """The original file; ?download=1 asks the browser to save it instead of showing it."""
+    user_id = current_user_id()      # session or API token
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    att = find_attachment(user_id, attachment_id)
+    if not att or not os.path.exists(attachment_store.path(att['blob_key'])):
+        return jsonify({'error': 'Attachment not found'}), 404
+    # blob keys are content hashes: a strong validator that never changes
+    return send_stored(attachment_store.path(att['blob_key']), att['blob_key'], ATTACHMENT_MAX_AGE,
+                       download_name=att['filename'], as_attachment=bool(request.args.get('download')))
+
+
+@app.route('/attachments/<int:attachment_id>/<kind>')
+def attachment_preview(attachment_id, kind):
+    """Thumbnail ('thumb') or waveform ('wave') of one of the user's attachments."""
+    user_id = current_user_id()      # session or API token
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    att = find_attachment(user_id, attachment_id)
+    if not att:
+        return jsonify({'error': 'Attachment not found'}), 404
+
+    try:
+        path = derivatives.get(att['blob_key'], kind, file_ext(att['filename']))
+    except PreviewUnavailable:
+        return jsonify({'error': 'No preview for this file'}), 404
+    except RenderTimeout:
+        response = jsonify({'error': 'Preview is still being generated'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    return send_stored(path, f"{att['blob_key']}.{kind}", PREVIEW_MAX_AGE, mimetype=derivatives.mimetype(kind))
+
+
+# ========== EXPORT / IMPORT ==========
+@app.route('/export')
+def export_notes():
+    """Stream all of the user's notes as NDJSON (default) or a ZIP with attachments."""
+    if 'user_id' not in session:
+        flash("Please login first", "warning")
+        return redirect(url_for('login'))
+
+    user_id = session['user_id']
+    fmt = request.args.get('format', 'ndjson')
+
+    def generate():
+        # the connection lives exactly as long as the stream
+        with db_pool.connection() as db:
+            if fmt == 'zip':
+                yield from export_zip(db, user_id, attachment_store)
+            else:
+                yield from export_ndjson(db, user_id)
+
+    stamp = datetime.now().strftime('%Y%m%d')
+    if fmt == 'zip':
+        mimetype, filename = 'application/zip', f"flash-notes-{stamp}.zip"
+    else:
+        mimetype, filename = 'application/x-ndjson', f"flash-notes-{stamp}.ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/import', methods=['POST'])
+def import_notes():
+    """Bulk-import notes from an NDJSON file or an export ZIP."""
+    if 'user_id' not in session:
+        flash("Please login first", "warning")
+        return redirect(url_for('login'))
+
+    file = request.files.get('file')
+    if not file or not file.filename:
+        flash("Choose an export file to import", "warning")
+        return redirect(url_for('view_all'))
+
+    db = get_db_connection()
+    try:
+        if zipfile.is_zipfile(file.stream):
+            file.stream.seek(0)
+            summary = import_zip(db, session['user_id'], file.stream, attachment_store,
+                                 max_entry_bytes=app.config['UPLOAD_MAX_BYTES'],
+                                 max_bytes=app.config['IMPORT_MAX_BYTES'])
+        else:
+            file.stream.seek(0)
+            summary = import_records(db, session['user_id'], file.stream, attachment_store)
+    except TransferError as e:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': str(e)}), 413
+        flash(str(e), "warning")
+        return redirect(url_for('view_all'))
+    finally:
+        db.close()
+    note_cache.invalidate_lists(session['user_id'])
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(summary)
+    flash(f"Imported {summary['notes']} notes ({summary['attachments']} attachments).", "success")
+    return redirect(url_for('view_all'))
+
+
 # ========== SEARCH ==========
 @app.route('/search')
 def search_notes():
-    """Search notes by title or content."""
+    """Ranked full-text search over the user's notes."""
     if 'user_id' not in session:
         flash("Please login to search notes", "warning")
         return redirect(url_for('login'))
@@ -505,22 +1435,19 @@ def search_notes():
     keyword = request.args.get('q', '').strip()
     if not keyword:
         return redirect(url_for('view_all'))
+    page = max(1, request.args.get('page', 1, type=int))
 
-    db = get_db_connection()
+    db = get_db_connection(read_only=True)
     cursor = db.cursor(dictionary=True)
-    like = f"%{keyword}%"
-    cursor.execute("""
-        SELECT * FROM notes
-        WHERE user_id=%s AND (title LIKE %s OR content LIKE %s)
-        ORDER BY create_at DESC
-    """, (session['user_id'], like, like))
-    notes = cursor.fetchall()
+    notes, has_more = fulltext_search(cursor, session['user_id'], keyword,
+                                      page=page, per_page=SEARCH_PAGE_SIZE, excerpt_len=EXCERPT_LEN)
     cursor.close(); db.close()
 
-    if not notes:
+    if not notes and page == 1:
         flash(f"No results found for '{keyword}'", "info")
 
-    return render_template('viewnote.html', notes=notes, search_term=keyword)
+    return render_template('viewnote.html', notes=notes, search_term=keyword,
+                           page=page, has_more=has_more)
 
 
 # ========== STATIC PAGES ==========
@@ -541,10 +1468,10 @@ def contact():
             flash("Please fill all fields", "warning")
             return redirect(url_for('contact'))
 
-        msg = Message(f"Contact from {name}", recipients=[app.config['MAIL_USERNAME']])
+        msg = mail_message(f"Contact from {name}", recipients=[app.config['MAIL_USERNAME']])
         msg.body = f"From: {name} <{email}>\n\n{message}"
         try:
-            mail.send(msg)
+            mail_queue.enqueue(msg)
             flash("Message sent successfully!", "success")
         except Exception as e:
             flash(f"Failed to send message: {e}", "danger")
@@ -552,6 +1479,31 @@ def contact():
     return render_template('contact.html')
 
 
+# ========== METRICS ==========
+def stats_once_built(subsystem):
+    """Stats of a lazy subsystem; a scrape doesn't build it."""
+    return lambda: subsystem.stats() if subsystem.initialized else {}
+
+
+instrumentation.collect('db_pool', stats_once_built(db_pool))
+instrumentation.collect('db_router', stats_once_built(db_router))
+instrumentation.collect('note_cache', stats_once_built(note_cache))
+instrumentation.collect('mail_queue', stats_once_built(mail_queue))
+instrumentation.collect('previews', stats_once_built(derivatives))
+instrumentation.collect('upload_reconciler', stats_once_built(upload_reconciler))
+instrumentation.collect('note_bodies', stats_once_built(body_compactor))
+instrumentation.collect('note_history', stats_once_built(history_compactor))
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text format; set METRICS_TOKEN to require `Authorization: Bearer <token>`."""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+
 # ========== ERROR HANDLER ==========
 @app.errorhandler(404)
 def not_found(e):
@@ -559,6 +1511,55 @@ def not_found(e):
     return render_template('404.html'), 404
 
 
+# ========== APP FACTORY ==========
+SUBSYSTEMS = {
+    'mail': mail, 'mail_queue': mail_queue, 'tokens': tokens, 'captcha_pool': captcha_pool,
+    'attachment_store': attachment_store, 'chunked_uploads': chunked_uploads, 'derivatives': derivatives,
+    'upload_reconciler': upload_reconciler, 'db_pool': db_pool, 'db_router': db_router,
+    'hasher': hasher, 'account_limiter': account_limiter, 'ip_limiter': ip_limiter, 'note_cache': note_cache,
+    'body_compactor': body_compactor, 'history_compactor': history_compactor,
+    'tombstone_compactor': tombstone_compactor,
+}
+
+
+def preload():
+    """
+    Build every subsystem and compile the templates now, in the parent of
+    forked workers so they share all of it copy-on-write. No DB connection,
+    thread or process pool is started here, and no CAPTCHA is rendered:
+    each worker renders its own, or siblings would hand out the same ones.
+    """
+    for subsystem in SUBSYSTEMS.values():
+        subsystem.instance()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    gc.freeze()         # the collector would otherwise write to (and un-share) these objects
+
+
+def create_app(config=None):
+    """
+    Configure the app from `config` (default: the environment) and return it,
+    e.g. gunicorn --preload 'note:create_app()'. Routes live on the
+    module-level app, so this is one app per process, set up before its first
+    request; with config.PRELOAD the subsystems are built now instead of on
+    first use.
+    """
+    config = config or Config()
+    built = [name for name, subsystem in SUBSYSTEMS.items() if subsystem.initialized]
+    if built:
+        print(f"⚠️ create_app(): {', '.join(built)} already built with the previous settings")
+    configure(config)
+    if config.PRELOAD:
+        preload()
+    return app
+
+
 # ========== MAIN ==========
 if __name__ == '__main__':
-    app.run(debug=True)
+    app = create_app()
+    if os.getenv("SERVER_MODE", "sync") == 'async':
+        from async_server import serve
+        serve(app, os.getenv("SERVER_HOST", '127.0.0.1'), int(os.getenv("SERVER_PORT", 8000)),
+              threads=int(os.getenv("SERVER_THREADS", 16)))
+    else:
+        app.run(debug=True)
@@ -0,0 +1,233 @@
+# Read-through cache for note pages
+#
+# Two tiers: an in-process LRU, and optionally Redis (NOTE_CACHE_REDIS_URL)
+# shared by every worker. Keys carry a generation number: writes bump the
+# note's generation (and the owner's list generation) instead of hunting for
+# keys to delete, so stale entries simply become unreachable and age out.
+# Callers take the key *before* reading the database, so a write that lands
+# during the read moves the generation past the entry it stores.
+# Generations live in Redis when it is set, else in a SQLite file that every
+# worker on the host shares (NOTE_CACHE_GEN_PATH), so a hit never needs the
+# database. With neither they are per-process and miss other workers' writes;
+# entries also carry the row's change_seq (`stamp`) and, with `validate`, the
+# caller compares it with the database on every hit (one primary-key lookup).
+# That is the default for per-process generations, and the option to turn on
+# for several hosts sharing a database without Redis.
+import hashlib, os, pickle, sqlite3, threading, time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries=10_000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteGenerations:
+    """
+    Generation counters in one SQLite file shared by every worker process on
+    the host. A counter not bumped for `keep` seconds (longer than any entry
+    lives) is dropped and reads as 0 again.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS generations (
+        name      TEXT PRIMARY KEY,
+        gen       INTEGER NOT NULL,
+        bumped_at REAL    NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_generations_bumped ON generations (bumped_at);
+    """
+
+    def __init__(self, path, keep=3600, sweep_batch=100):
+        self.path = path
+        self.keep = keep
+        self.sweep_batch = sweep_batch
+        self._local = threading.local()
+        self._db().executescript(self.SCHEMA)
+
+    def _db(self):
+        # one connection per thread, opened again in a forked child
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            local.db.execute("PRAGMA journal_mode=WAL")
+            local.pid = os.getpid()
+        return local.db
+
+    def get(self, name):
+        row = self._db().execute("SELECT gen FROM generations WHERE name=?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        now = time.time()
+        db = self._db()
+        db.execute("""
+            INSERT INTO generations (name, gen, bumped_at) VALUES (?, 1, ?)
+            ON CONFLICT(name) DO UPDATE SET gen=gen + 1, bumped_at=excluded.bumped_at
+        """, (name, now))
+        db.execute("""
+            DELETE FROM generations WHERE rowid IN (
+                SELECT rowid FROM generations WHERE bumped_at < ? LIMIT ?)
+        """, (now - self.keep, self.sweep_batch))
+
+
+def note_etag(note, attachments):
+    """Strong validator: changes whenever anything rendered on the note page changes."""
+    h = hashlib.sha1()
+    for field in ('id', 'title', 'content', 'create_at', 'updated_at', 'version'):
+        h.update(repr(note.get(field)).encode())
+    for att in attachments:
+        h.update(repr((att['id'], att['blob_key'], att['filename'])).encode())
+    return h.hexdigest()
+
+
+class NoteCache:
+    """Per-user, per-note cache used by single_note, edit_note (GET) and view_all."""
+
+    def __init__(self, max_entries=10_000, ttl=300, shared_url=None, validate=None, gen_path=None):
+        self.local = LRUCache(max_entries, ttl)
+        self.ttl = ttl
+        self.shared = None
+        if shared_url:
+            if redis is None:
+                raise RuntimeError("NOTE_CACHE_REDIS_URL is set but the 'redis' package is not installed")
+            self.shared = redis.Redis.from_url(shared_url)
+        # generations in a file only matter without Redis; entries outlive neither
+        self.host_gens = SQLiteGenerations(gen_path, keep=2 * ttl) if gen_path and self.shared is None else None
+        # entries must be checked against the DB unless every worker shares the generations
+        self.validate = (self.shared is None and self.host_gens is None) if validate is None else validate
+        self._gens = {}
+        self._gen_lock = threading.Lock()
+
+    # ---------- generations ----------
+    def _gen(self, name):
+        if self.shared is not None:
+            try:
+                return int(self.shared.get(name) or 0)
+            except redis.RedisError:
+                return None     # shared tier down: treat as a miss
+        if self.host_gens is not None:
+            try:
+                return self.host_gens.get(name)
+            except sqlite3.Error:
+                return None
+        return self._gens.get(name, 0)
+
+    def _bump(self, name):
+        if self.shared is not None:
+            try:
+                self.shared.incr(name)
+            except redis.RedisError:
+                pass
+            return
+        if self.host_gens is not None:
+            try:
+                self.host_gens.bump(name)
+            except sqlite3.Error as e:
+                print(f"⚠️ Note cache generation {name} not bumped: {e}")
+            return
+        with self._gen_lock:
+            self._gens[name] = self._gens.get(name, 0) + 1
+
+    # ---------- tiers ----------
+    def _get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                raw = self.shared.get(key)
+            except redis.RedisError:
+                raw = None
+            if raw is not None:
+                value = pickle.loads(raw)
+                self.local.set(key, value)
+        return value
+
+    def _set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.setex(key, self.ttl, pickle.dumps(value))
+            except redis.RedisError:
+                pass
+
+    # ---------- public API ----------
+    # Take the key first, read the database, then put under that same key.
+    def note_key(self, user_id, note_id):
+        gen = self._gen(f"ngen:{user_id}:{note_id}")
+        return None if gen is None else f"note:{user_id}:{note_id}:{gen}"
+
+    def list_key(self, user_id, *parts):
+        gen = self._gen(f"lgen:{user_id}")
+        return None if gen is None else f"list:{user_id}:{gen}:" + ':'.join(map(str, parts))
+
+    def get(self, key):
+        """Cached entry: {'note', 'attachments', 'etag', 'last_modified', 'stamp'} or {'value', 'stamp'}."""
+        return self._get(key) if key else None
+
+    def put_note(self, key, note, attachments, stamp=None):
+        entry = {
+            'note': note,
+            'attachments': attachments,
+            'etag': note_etag(note, attachments),
+            'last_modified': note.get('updated_at') or note.get('create_at'),
+            'stamp': stamp,
+        }
+        if key:
+            self._set(key, entry)
+        return entry
+
+    def put_list(self, key, value, stamp=None):
+        if key:
+            self._set(key, {'value': value, 'stamp': stamp})
+
+    def invalidate_note(self, user_id, note_id):
+        """After a note is edited or deleted: drop it and every list page it may be on."""
+        self._bump(f"ngen:{user_id}:{note_id}")
+        self._bump(f"lgen:{user_id}")
+
+    def invalidate_lists(self, user_id):
+        """After a note is added: list pages change, existing note pages do not."""
+        self._bump(f"lgen:{user_id}")
+
+    def stats(self):
+        return {'entries': len(self.local), 'hits': self.local.hits, 'misses': self.local.misses,
+                'shared': self.shared is not None, 'host_generations': self.host_gens is not None,
+                'validate': self.validate}
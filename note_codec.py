@@ -0,0 +1,270 @@
+# Storage format of note bodies
+#
+# Short bodies stay plain text in notes.content. A body of COMPRESS_MIN bytes
+# or more is stored compressed in notes.content_z (content is NULL) and
+# notes.content_format says how:
+#
+#   0 plain    1 zlib    2 zstd (only written when the zstandard package is installed)
+#
+# Every write also stores the list-view columns, excerpt (first EXCERPT_CHARS
+# characters) and content_chars, so the dashboard and search never read a
+# body, and for compressed bodies search_terms (their distinct words), which
+# the FULLTEXT indexes cover in place of the text itself.
+#
+# Rows written before this format are compressed in the background by
+# BodyCompactor, or at once with:
+#
+#   python note_codec.py compress    compress every plain body over the threshold
+#   python note_codec.py status      row counts and stored bytes per format
+import os, re, sys, threading, time, zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PLAIN, ZLIB, ZSTD = 0, 1, 2
+FORMAT_NAMES = {PLAIN: 'plain', ZLIB: 'zlib', ZSTD: 'zstd'}
+EXCERPT_CHARS = 255
+COMPRESS_MIN = int(os.getenv("NOTE_COMPRESS_MIN", 1024))
+CODEC = ZSTD if os.getenv("NOTE_CODEC", "zlib") == 'zstd' and zstandard else ZLIB
+BATCH = 200
+
+# columns every write of a body sets, in this order
+BODY_COLUMNS = ('content', 'content_z', 'content_format', 'excerpt', 'content_chars', 'search_terms')
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# ---------- encoding ----------
+def compress(raw, fmt):
+    if fmt == ZSTD:
+        return zstandard.ZstdCompressor(level=6).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def decompress(data, fmt):
+    if fmt == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("a note is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(bytes(data))
+    return zlib.decompress(bytes(data))
+
+
+def search_terms(text):
+    """Distinct lower-cased words, in first-seen order: what FULLTEXT needs, without the repetition."""
+    return ' '.join(dict.fromkeys(_WORD_RE.findall(text.lower())))
+
+
+def encode(text, min_size=None, fmt=None):
+    """Column values (BODY_COLUMNS) for storing `text`."""
+    text = text or ''
+    min_size = COMPRESS_MIN if min_size is None else min_size
+    fields = {'content': text, 'content_z': None, 'content_format': PLAIN,
+              'excerpt': text[:EXCERPT_CHARS], 'content_chars': len(text), 'search_terms': None}
+    raw = text.encode('utf-8')
+    if min_size and len(raw) >= min_size:
+        fmt = fmt or CODEC
+        packed = compress(raw, fmt)
+        terms = search_terms(text)
+        # not worth a decompress on every read unless it clearly saves space
+        if len(packed) + len(terms.encode('utf-8')) < len(raw) * 0.9:
+            fields.update(content=None, content_z=packed, content_format=fmt, search_terms=terms)
+    return fields
+
+
+def encode_values(text):
+    """encode() as a tuple in BODY_COLUMNS order, for INSERT parameters."""
+    fields = encode(text)
+    return tuple(fields[c] for c in BODY_COLUMNS)
+
+
+# ---------- decoding ----------
+class LazyBody:
+    """
+    A compressed body, decompressed the first time it is turned into text
+    (str(), or a template printing it). Cached note pages keep this form, so
+    a 304 or a page served from cache never pays for the decompression.
+    """
+
+    __slots__ = ('fmt', 'data', '_text')
+
+    def __init__(self, fmt, data):
+        self.fmt = fmt
+        self.data = bytes(data)
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = decompress(self.data, self.fmt).decode('utf-8')
+        return self._text
+
+    def __repr__(self):
+        # stable across processes: note_etag() hashes it
+        return f"LazyBody({self.fmt}, {len(self.data)}, {zlib.crc32(self.data)})"
+
+    def __getstate__(self):
+        return self.fmt, self.data          # the cache pickles the compressed form only
+
+    def __setstate__(self, state):
+        self.fmt, self.data = state
+        self._text = None
+
+
+def lazy_body(row):
+    """Replace a row's storage columns with 'content': a str, or a LazyBody if compressed."""
+    fmt = row.pop('content_format', PLAIN)
+    data = row.pop('content_z', None)
+    row.pop('search_terms', None)
+    if fmt and data is not None:
+        row['content'] = LazyBody(fmt, data)
+    return row
+
+
+def decode_body(row):
+    """Like lazy_body(), but 'content' is always a str (JSON, export)."""
+    lazy_body(row)
+    if isinstance(row.get('content'), LazyBody):
+        row['content'] = str(row['content'])
+    return row
+
+
+def as_text(content):
+    return content if content is None or isinstance(content, str) else str(content)
+
+
+# ---------- schema / migration ----------
+def ensure_schema(db, batch=5000):
+    """Add the body columns and fill the list-view columns of existing rows (MySQL)."""
+    from schema import add_column, add_index
+    cursor = db.cursor()
+    add_column(cursor, 'notes', 'content_z', "MEDIUMBLOB NULL")
+    add_column(cursor, 'notes', 'content_format', "TINYINT NOT NULL DEFAULT 0")
+    add_column(cursor, 'notes', 'excerpt', "VARCHAR(255) NOT NULL DEFAULT ''")
+    add_column(cursor, 'notes', 'content_chars', "INT NOT NULL DEFAULT 0")
+    add_column(cursor, 'notes', 'search_terms', "MEDIUMTEXT NULL")
+    add_index(cursor, 'notes', 'idx_notes_format_chars', ['content_format', 'content_chars'])
+
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notes")
+    top = cursor.fetchone()[0]
+    for start in range(0, top, batch):
+        cursor.execute("""
+            UPDATE notes SET excerpt = LEFT(COALESCE(content, ''), %s),
+                             content_chars = CHAR_LENGTH(COALESCE(content, ''))
+            WHERE id > %s AND id <= %s AND content_format = 0
+        """, (EXCERPT_CHARS, start, start + batch))
+        db.commit()
+    cursor.close()
+
+
+def compress_existing(db, min_size=None, fmt=None, limit=None, rate=0):
+    """
+    Re-encode plain bodies of at least min_size characters (the row's version
+    guards against a concurrent edit, which re-encodes it anyway). Returns
+    (rows compressed, bytes before, bytes after).
+    """
+    min_size = COMPRESS_MIN if min_size is None else min_size
+    cursor = db.cursor(dictionary=True)
+    done, before, after = 0, 0, 0
+    last = (min_size, 0)
+    while limit is None or done < limit:
+        step_start = time.time()
+        # keyset on (content_chars, id) so bodies that don't compress are passed over, not re-read
+        cursor.execute("""
+            SELECT id, version, content_chars FROM notes
+            WHERE content_format = 0 AND content_chars >= %s
+              AND (content_chars > %s OR (content_chars = %s AND id > %s))
+            ORDER BY content_chars, id LIMIT %s
+        """, (min_size, last[0], last[0], last[1], BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last = (rows[-1]['content_chars'], rows[-1]['id'])
+        for row in rows:
+            cursor.execute("SELECT content FROM notes WHERE id=%s", (row['id'],))
+            current = cursor.fetchone()
+            if not current:
+                continue
+            fields = encode(current['content'], min_size, fmt)
+            if fields['content_format'] == PLAIN:
+                continue
+            cursor.execute("""
+                UPDATE notes SET content=NULL, content_z=%s, content_format=%s, search_terms=%s
+                WHERE id=%s AND version=%s AND content_format = 0
+            """, (fields['content_z'], fields['content_format'], fields['search_terms'],
+                  row['id'], row['version']))
+            if cursor.rowcount:
+                done += 1
+                before += len(current['content'].encode('utf-8'))
+                after += len(fields['content_z']) + len(fields['search_terms'].encode('utf-8'))
+        db.commit()
+        if rate:
+            time.sleep(max(0.0, len(rows) / rate - (time.time() - step_start)))
+    cursor.close()
+    return done, before, after
+
+
+class BodyCompactor:
+    """
+    Background migration: one paced compress_existing() pass per process,
+    started on first use. Rows written since the format exists are already
+    encoded, so once the old rows are done a pass finds nothing.
+    """
+
+    def __init__(self, pool, rate=200, delay=60):
+        self.pool = pool
+        self.rate = rate
+        self.delay = delay          # let the process finish starting up first
+        self._thread = None
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.bytes_saved = 0
+
+    def start(self):
+        # started on first use so forked workers each get their own thread
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="body-compactor", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        time.sleep(self.delay)
+        try:
+            with self.pool.connection() as db:
+                done, before, after = compress_existing(db, rate=self.rate)
+            self.compressed += done
+            self.bytes_saved += before - after
+            if done:
+                print(f"✅ Compressed {done} note bodies, {before - after} bytes saved")
+        except Exception as e:
+            print(f"❌ Note body compression error: {e}")
+
+    def stats(self):
+        return {'compressed': self.compressed, 'bytes_saved': self.bytes_saved}
+
+
+def status(db):
+    """Rows and stored body bytes per format."""
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT content_format, COUNT(*), SUM(COALESCE(LENGTH(content), 0) + COALESCE(LENGTH(content_z), 0)
+                                             + COALESCE(LENGTH(search_terms), 0))
+        FROM notes GROUP BY content_format
+    """)
+    rows = cursor.fetchall()
+    cursor.close()
+    return {FORMAT_NAMES.get(fmt, fmt): {'rows': count, 'bytes': int(size or 0)} for fmt, count, size in rows}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['compress'], ['status']):
+        print("usage: python note_codec.py compress | status")
+        sys.exit(1)
+    from note import db_pool
+    with db_pool.connection() as db:
+        if sys.argv[1] == 'compress':
+            done, before, after = compress_existing(db)
+            print(f"✅ Compressed {done} note bodies: {before} -> {after} bytes")
+        for name, info in status(db).items():
+            print(f"{name:<6} {info['rows']:>9} rows {info['bytes']:>14,} bytes")
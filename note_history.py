@@ -0,0 +1,288 @@
+# Revision history of notes
+#
+# update_note() records the version it is about to replace, in the same
+# transaction as the UPDATE, so any earlier state of a note can be brought
+# back. A revision is stored as either
+#
+#   snapshot : the whole body, zlib-compressed
+#   delta    : an edit script from its chain's snapshot to this revision
+#
+# Each chain starts with a snapshot, and a new chain starts every
+# SNAPSHOT_EVERY revisions or once a delta outgrows half of its snapshot.
+# Deltas are taken against the snapshot rather than the previous revision,
+# so rebuilding a revision costs one snapshot plus one delta, and any delta
+# can be dropped without touching the rest.
+#
+# Notes that are never edited have no history at all. HistoryCompactor
+# thins revisions older than keep_days to the last one of each day, and drops
+# those older than max_days. A snapshot stays as long as a kept delta needs
+# it, and a note's most recent revision is always kept.
+#
+#   python note_history.py compact    apply the retention policy now
+#   python note_history.py stats      revisions, stored bytes vs full copies
+import difflib, json, re, sys, threading, time, zlib
+from datetime import datetime, timedelta
+
+SNAPSHOT, DELTA = 0, 1
+SNAPSHOT_EVERY = 20
+HISTORY_PAGE_SIZE = 100
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS note_revisions (
+        id       BIGINT       AUTO_INCREMENT PRIMARY KEY,
+        note_id  INT          NOT NULL,
+        revision INT          NOT NULL,
+        kind     TINYINT      NOT NULL,
+        base_id  BIGINT       NULL,
+        title    VARCHAR(255) NOT NULL,
+        data     MEDIUMBLOB   NOT NULL,
+        chars    INT          NOT NULL,
+        saved_at DATETIME     NOT NULL,
+        UNIQUE KEY uq_note_revisions (note_id, revision),
+        KEY idx_note_revisions_saved (saved_at)
+    ) ENGINE=InnoDB
+    """,
+]
+
+_TOKEN_RE = re.compile(r"\s+|\S+")
+
+
+# ---------- deltas ----------
+def tokens(text):
+    """Words and the whitespace between them; ''.join(tokens(t)) == t."""
+    return _TOKEN_RE.findall(text)
+
+
+def make_delta(base, new):
+    """
+    Edit script turning token list `base` into `new`: [start, end] copies
+    base[start:end], a string is inserted as is.
+    """
+    n, m = len(base), len(new)
+    head = 0
+    while head < min(n, m) and base[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < min(n, m) - head and base[n - 1 - tail] == new[m - 1 - tail]:
+        tail += 1
+
+    ops = []
+
+    def copy(i, j):
+        if i == j:
+            return
+        if ops and isinstance(ops[-1], list) and ops[-1][1] == i:
+            ops[-1][1] = j
+        else:
+            ops.append([i, j])
+
+    def insert(text):
+        if not text:
+            return
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        else:
+            ops.append(text)
+
+    copy(0, head)
+    # only the changed middle goes through the (quadratic worst case) matcher
+    a, b = base[head:n - tail], new[head:m - tail]
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            copy(head + i1, head + i2)
+        elif tag in ('replace', 'insert'):
+            insert(''.join(b[j1:j2]))
+    copy(n - tail, n)
+    return ops
+
+
+def apply_delta(base, ops):
+    return ''.join(''.join(base[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def _pack(obj):
+    return zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+# ---------- write side (inside the caller's transaction) ----------
+def record_revision(cursor, note_id, old):
+    """
+    Keep `old` (the note row about to be overwritten: version, title, decoded
+    content, create_at/updated_at) as a revision. Expects a dictionary cursor.
+    """
+    content = old['content'] or ''
+    cursor.execute("""
+        SELECT id, revision, kind, base_id FROM note_revisions
+        WHERE note_id=%s ORDER BY revision DESC LIMIT 1
+    """, (note_id,))
+    latest = cursor.fetchone()
+
+    kind, base_id, data = SNAPSHOT, None, None
+    if latest:
+        base_id = latest['id'] if latest['kind'] == SNAPSHOT else latest['base_id']
+        cursor.execute("SELECT revision, data FROM note_revisions WHERE id=%s", (base_id,))
+        base = cursor.fetchone()
+        if base and old['version'] - base['revision'] < SNAPSHOT_EVERY:
+            snapshot = _unpack(base['data'])
+            delta = _pack(make_delta(tokens(snapshot), tokens(content)))
+            if len(delta) * 2 < len(base['data']):
+                kind, data = DELTA, delta
+    if kind == SNAPSHOT:
+        base_id, data = None, _pack(content)
+
+    cursor.execute("""
+        INSERT INTO note_revisions (note_id, revision, kind, base_id, title, data, chars, saved_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (note_id, old['version'], kind, base_id, old['title'], data, len(content),
+          old.get('updated_at') or old.get('create_at') or datetime.now()))
+
+
+def purge_history(cursor, note_id):
+    """Drop a deleted note's revisions."""
+    cursor.execute("DELETE FROM note_revisions WHERE note_id=%s", (note_id,))
+
+
+# ---------- read side ----------
+def list_revisions(cursor, note_id, limit=HISTORY_PAGE_SIZE):
+    """Newest first: revision, title, chars, saved_at (no bodies)."""
+    cursor.execute("""
+        SELECT revision, title, chars, saved_at FROM note_revisions
+        WHERE note_id=%s ORDER BY revision DESC LIMIT %s
+    """, (note_id, limit))
+    return cursor.fetchall()
+
+
+def load_revision(cursor, note_id, revision):
+    """{revision, title, content, saved_at} rebuilt from its snapshot, or None."""
+    cursor.execute("""
+        SELECT revision, kind, base_id, title, data, saved_at FROM note_revisions
+        WHERE note_id=%s AND revision=%s
+    """, (note_id, revision))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    if row['kind'] == SNAPSHOT:
+        content = _unpack(row['data'])
+    else:
+        cursor.execute("SELECT data FROM note_revisions WHERE id=%s", (row['base_id'],))
+        base = cursor.fetchone()
+        content = apply_delta(tokens(_unpack(base['data'])), _unpack(row['data']))
+    return {'revision': row['revision'], 'title': row['title'], 'content': content, 'saved_at': row['saved_at']}
+
+
+# ---------- retention ----------
+def _prune_note(cursor, note_id, keep_after, drop_before):
+    cursor.execute("""
+        SELECT id, kind, base_id, saved_at FROM note_revisions WHERE note_id=%s ORDER BY revision
+    """, (note_id,))
+    rows = cursor.fetchall()
+    keep = {rows[-1]['id']} if rows else set()
+    last_of_day = {}
+    for r in rows:
+        if r['saved_at'] >= keep_after:
+            keep.add(r['id'])
+        elif r['saved_at'] >= drop_before:
+            last_of_day[r['saved_at'].date()] = r['id']         # rows come oldest first
+    keep.update(last_of_day.values())
+    keep.update(r['base_id'] for r in rows if r['id'] in keep and r['kind'] == DELTA)
+    doomed = [r['id'] for r in rows if r['id'] not in keep]
+    for i in range(0, len(doomed), 500):
+        part = doomed[i:i + 500]
+        cursor.execute(f"DELETE FROM note_revisions WHERE id IN ({', '.join(['%s'] * len(part))})", part)
+    return len(doomed)
+
+
+def compact_history(db, keep_days=30, max_days=365, batch=200):
+    """Apply the retention policy to every note with revisions older than keep_days. Returns rows removed."""
+    now = datetime.now()
+    keep_after, drop_before = now - timedelta(days=keep_days), now - timedelta(days=max_days)
+    cursor = db.cursor(dictionary=True)
+    removed, last = 0, 0
+    while True:
+        cursor.execute("""
+            SELECT DISTINCT note_id FROM note_revisions
+            WHERE saved_at < %s AND note_id > %s ORDER BY note_id LIMIT %s
+        """, (keep_after, last, batch))
+        note_ids = [r['note_id'] for r in cursor.fetchall()]
+        if not note_ids:
+            break
+        for note_id in note_ids:
+            removed += _prune_note(cursor, note_id, keep_after, drop_before)
+        db.commit()
+        last = note_ids[-1]
+    cursor.close()
+    return removed
+
+
+class HistoryCompactor:
+    """Daemon thread running compact_history every `interval` seconds."""
+
+    def __init__(self, pool, keep_days=30, max_days=365, interval=6 * 3600):
+        self.pool = pool
+        self.keep_days = keep_days
+        self.max_days = max_days
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self.removed = 0
+
+    def start(self):
+        # started on first use so forked workers each get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.pool.connection() as db:
+                    self.removed += compact_history(db, self.keep_days, self.max_days)
+            except Exception as e:
+                print(f"❌ History compaction error: {e}")
+
+    def stats(self):
+        return {'removed': self.removed}
+
+
+def history_stats(db):
+    """Revisions and snapshots kept, bytes stored, and what full copies would take."""
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT COUNT(*), SUM(kind = 0), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(chars), 0)
+        FROM note_revisions
+    """)
+    revisions, snapshots, stored, chars = cursor.fetchone()
+    cursor.close()
+    return {'revisions': revisions, 'snapshots': int(snapshots or 0), 'stored_bytes': int(stored),
+            'full_copy_chars': int(chars)}
+
+
+# ---------- migration ----------
+def ensure_schema(db):
+    cursor = db.cursor()
+    for ddl in SCHEMA:
+        cursor.execute(ddl)
+    cursor.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['compact'], ['stats']):
+        print("usage: python note_history.py compact | stats")
+        sys.exit(1)
+    from note import db_pool, history_compactor
+    with db_pool.connection() as db:
+        if sys.argv[1] == 'compact':
+            removed = compact_history(db, history_compactor.keep_days, history_compactor.max_days)
+            print(f"✅ Removed {removed} old revisions")
+        s = history_stats(db)
+    share = s['stored_bytes'] / s['full_copy_chars'] * 100 if s['full_copy_chars'] else 0
+    print(f"{s['revisions']} revisions ({s['snapshots']} snapshots): {s['stored_bytes']:,} bytes stored, "
+          f"{share:.1f}% of {s['full_copy_chars']:,} characters as full copies")
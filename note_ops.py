@@ -0,0 +1,99 @@
+# Note writes shared by the HTML routes and the JSON API
+#
+# Each function runs inside the caller's transaction on a dictionary cursor,
+# stamps the change with the owner's next sync sequence (sync_utils) and never
+# commits: the caller passes the blobs the functions release to collect_dead()
+# right before it commits once (a whole API batch is one commit), then
+# invalidates caches and removes the dead blobs.
+from attachment_store import attach, detach
+from note_codec import decode_body, encode, encode_values
+from note_history import purge_history, record_revision
+from sync_utils import next_seq, record_tombstone
+
+TITLE_MAX = 255
+NOTE_FIELDS = ('title', 'content')
+
+
+class NoteError(Exception):
+    """A write that can't be applied; status is the HTTP code to answer with."""
+
+    def __init__(self, message, status=400, current_version=None):
+        super().__init__(message)
+        self.status = status
+        self.current_version = current_version
+        self.index = None       # position of the failing operation in a batch
+
+
+def clean_fields(data, partial=False):
+    """Pick title/content out of `data`. Partial updates keep fields that weren't sent."""
+    fields = {}
+    for name in NOTE_FIELDS:
+        if name in data and data[name] is not None:
+            fields[name] = str(data[name]).strip()
+        elif not partial:
+            fields[name] = ''
+    if 'title' in fields and not fields['title']:
+        raise NoteError("Title is required", 422)
+    if len(fields.get('title', '')) > TITLE_MAX:
+        raise NoteError(f"Title is longer than {TITLE_MAX} characters", 422)
+    return fields
+
+
+def create_note(cursor, user_id, title, content, uploads=()):
+    """Insert a note with its (blob_key, filename, size) uploads; returns the new id."""
+    seq = next_seq(cursor, user_id)
+    cursor.execute("INSERT INTO notes (title, content, content_z, content_format, excerpt, content_chars, search_terms, "
+                   "user_id, create_at, updated_at, change_seq) "
+                   "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW(), %s)",
+                   (title, *encode_values(content), user_id, seq))
+    note_id = cursor.lastrowid
+    for blob_key, filename, size in uploads:
+        attach(cursor, note_id, blob_key, filename, size)
+    return note_id
+
+
+def update_note(cursor, user_id, note_id, changes, base_version=None, delete_ids=(), uploads=()):
+    """
+    One UPDATE writes the changed fields and bumps the version; when
+    base_version is given it refuses to apply on top of a newer version.
+    The row is locked first, so the attachment changes and the revision kept
+    of the replaced title/content (note_history) commit atomically with it.
+    Returns (new_version, released_blobs).
+    """
+    seq = next_seq(cursor, user_id)     # locks the owner's counter first, as every write does
+    cursor.execute("SELECT title, content, content_format, content_z, version, create_at, updated_at "
+                   "FROM notes WHERE id=%s AND user_id=%s FOR UPDATE", (note_id, user_id))
+    old = cursor.fetchone()
+    if not old:
+        raise NoteError("Note not found", 404)
+    if base_version is not None and old['version'] != base_version:
+        raise NoteError("Note was changed by another client", 409, old['version'])
+
+    if any(f in changes for f in NOTE_FIELDS):
+        old = decode_body(old)
+        if any(f in changes and changes[f] != (old[f] or '') for f in NOTE_FIELDS):
+            record_revision(cursor, note_id, old)
+    if 'content' in changes:            # a new body rewrites its storage and list-view columns
+        changes = dict(changes, **encode(changes['content']))
+    sets = [f"{f}=%s" for f in changes] + ["version=version+1", "updated_at=NOW()", "change_seq=%s"]
+    cursor.execute(f"UPDATE notes SET {', '.join(sets)} WHERE id=%s AND user_id=%s",
+                   list(changes.values()) + [seq, note_id, user_id])
+    version = old['version'] + 1
+
+    released = detach(cursor, note_id, list(delete_ids))
+    for blob_key, filename, size in uploads:
+        attach(cursor, note_id, blob_key, filename, size)
+    return version, released
+
+
+def delete_note(cursor, user_id, note_id):
+    """Delete a note, its attachment links and history, leaving a tombstone for sync; returns the released blobs."""
+    seq = next_seq(cursor, user_id)
+    cursor.execute("SELECT id FROM notes WHERE id=%s AND user_id=%s FOR UPDATE", (note_id, user_id))
+    if not cursor.fetchone():
+        raise NoteError("Note not found", 404)
+    released = detach(cursor, note_id)
+    cursor.execute("DELETE FROM notes WHERE id=%s AND user_id=%s", (note_id, user_id))
+    purge_history(cursor, note_id)
+    record_tombstone(cursor, user_id, note_id, seq)
+    return released
@@ -0,0 +1,292 @@
+# Bulk export / import of a user's notes
+#
+# Export is a generator: rows come off an unbuffered (server-side) cursor and
+# are written out one at a time, so memory stays flat however many notes the
+# account has. Formats:
+#   ndjson : one JSON object per note
+#   zip    : notes.ndjson plus attachments/<blob_key> for every attachment
+#
+# Import parses the same formats as a stream and inserts in batched
+# executemany() transactions. An attachment is only linked to a blob the same
+# ZIP carried or one the user's notes already reference, never to an arbitrary
+# key named in the NDJSON. From a ZIP only the attachments its notes.ndjson
+# references are stored, and the archive is capped in entry count, entry size
+# and the total it unpacks to.
+#
+#   python notes_transfer.py export <user_id> [ndjson|zip] > backup
+#   python notes_transfer.py import <user_id> <file>
+import io, json, os, sys, zipfile
+from datetime import datetime
+from attachment_store import attach
+from note_codec import decode_body, encode_values
+from sync_utils import next_seq
+
+EXPORT_FIELDS = ('title', 'content', 'create_at')
+IMPORT_BATCH = 1000
+IMPORT_MAX_ENTRIES = 10000                  # files in an import ZIP
+IMPORT_MAX_ENTRY_BYTES = 512 * 1024 * 1024  # uncompressed size of any one of them
+IMPORT_MAX_BYTES = 2 * 1024 * 1024 * 1024   # uncompressed size of all that is unpacked
+
+
+class TransferError(Exception):
+    """An import file that is refused as a whole."""
+
+
+# ---------- export ----------
+def iter_note_records(db, user_id):
+    """
+    Yield one dict per note with its attachments, streamed from a single
+    LEFT JOIN ordered by note id (rows of the same note arrive together).
+    """
+    cursor = db.cursor(dictionary=True, buffered=False)
+    cursor.execute("""
+        SELECT n.id, n.title, n.content, n.content_format, n.content_z, n.create_at,
+               a.blob_key, a.filename, a.size
+        FROM notes n
+        LEFT JOIN note_attachments a ON a.note_id = n.id
+        WHERE n.user_id=%s
+        ORDER BY n.id, a.id
+    """, (user_id,))
+    current = None
+    try:
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                if current is None or current['id'] != row['id']:
+                    if current is not None:
+                        yield current
+                    decode_body(row)
+                    current = {f: row[f] for f in ('id',) + EXPORT_FIELDS}
+                    current['create_at'] = row['create_at'].isoformat() if row['create_at'] else None
+                    current['attachments'] = []
+                if row['blob_key']:
+                    current['attachments'].append(
+                        {'blob_key': row['blob_key'], 'filename': row['filename'], 'size': row['size']})
+        if current is not None:
+            yield current
+    finally:
+        cursor.close()
+
+
+def _record_line(record):
+    out = {k: v for k, v in record.items() if k != 'id'}
+    return (json.dumps(out, ensure_ascii=False) + "\n").encode()
+
+
+def export_ndjson(db, user_id):
+    """Generator of NDJSON byte lines."""
+    for record in iter_note_records(db, user_id):
+        yield _record_line(record)
+
+
+class _Pipe(io.RawIOBase):
+    """Write-only sink that zipfile writes into and the generator drains."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_zip(db, user_id, store, chunk_size=64 * 1024):
+    """
+    Generator of ZIP bytes: notes.ndjson first, then each referenced blob once.
+    zipfile writes data descriptors for an unseekable sink, so nothing is buffered
+    beyond the current chunk.
+    """
+    pipe = _Pipe()
+    blobs = {}
+    with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        with zf.open('notes.ndjson', 'w', force_zip64=True) as out:
+            for record in iter_note_records(db, user_id):
+                out.write(_record_line(record))
+                for att in record['attachments']:
+                    blobs[att['blob_key']] = True     # keys only: bounded by distinct blobs
+                if len(pipe.chunks) > 16:
+                    yield pipe.drain()
+        yield pipe.drain()
+
+        for blob_key in blobs:
+            path = store.path(blob_key)
+            if not os.path.exists(path):
+                continue
+            # attachments are mostly already-compressed media: store them as-is
+            info = zipfile.ZipInfo(f'attachments/{blob_key}')
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=True) as out:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    out.write(chunk)
+                    yield pipe.drain()
+    yield pipe.drain()
+
+
+# ---------- import ----------
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value) if value else datetime.now()
+    except (TypeError, ValueError):
+        return datetime.now()
+
+
+def _owned_blob(cursor, user_id, blob_key):
+    cursor.execute("""
+        SELECT 1 FROM note_attachments a JOIN notes n ON n.id = a.note_id
+        WHERE a.blob_key=%s AND n.user_id=%s LIMIT 1
+    """, (blob_key, user_id))
+    return cursor.fetchone() is not None
+
+
+def import_records(db, user_id, lines, store=None, batch_size=IMPORT_BATCH, blob_keys=()):
+    """
+    Insert notes parsed from an iterable of NDJSON lines (bytes or str).
+    Notes without attachments go in executemany() batches; a note with
+    attachments is inserted on its own so its id can be linked. An attachment
+    is linked only when its blob is present in `store` and is either in
+    `blob_keys` (written from the same ZIP) or already on one of the user's
+    notes. Returns a summary.
+    """
+    cursor = db.cursor()
+    linkable = {key: True for key in blob_keys}
+    plain, summary = [], {'notes': 0, 'attachments': 0, 'skipped_lines': 0, 'missing_blobs': 0}
+    sql = ("INSERT INTO notes (title, content, content_z, content_format, excerpt, content_chars, search_terms, "
+           "user_id, create_at, updated_at, change_seq) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)")
+
+    def flush():
+        if plain:
+            # one counter bump reserves a sync sequence for every row of the batch
+            first = next_seq(cursor, user_id, len(plain)) - len(plain) + 1
+            cursor.executemany(sql, [row + (first + i,) for i, row in enumerate(plain)])
+            plain.clear()
+        db.commit()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+            row = (str(rec['title'])[:255], *encode_values(str(rec.get('content') or '')), user_id,
+                   _parse_time(rec.get('create_at')))
+        except (ValueError, KeyError, TypeError):
+            summary['skipped_lines'] += 1
+            continue
+        summary['notes'] += 1
+
+        atts = [a for a in rec.get('attachments') or [] if isinstance(a, dict) and a.get('blob_key')]
+        if not atts:
+            plain.append(row)
+            if len(plain) >= batch_size:
+                flush()
+            continue
+
+        cursor.execute(sql, row + (next_seq(cursor, user_id),))
+        note_id = cursor.lastrowid
+        for att in atts:
+            key = os.path.basename(str(att['blob_key']))
+            if key not in linkable:
+                linkable[key] = _owned_blob(cursor, user_id, key)
+            if store is not None and linkable[key] and os.path.exists(store.path(key)):
+                attach(cursor, note_id, key, att.get('filename') or key, os.path.getsize(store.path(key)))
+                summary['attachments'] += 1
+            else:
+                summary['missing_blobs'] += 1
+        if summary['notes'] % batch_size == 0:
+            flush()
+    flush()
+    cursor.close()
+    return summary
+
+
+def _referenced_keys(lines):
+    """Blob keys named by the attachments of NDJSON note lines."""
+    keys = set()
+    for line in lines:
+        try:
+            rec = json.loads(line)
+            atts = rec.get('attachments') or []
+        except (ValueError, AttributeError):
+            continue
+        keys.update(os.path.basename(str(a['blob_key'])) for a in atts if isinstance(a, dict) and a.get('blob_key'))
+    return keys
+
+
+def import_zip(db, user_id, fileobj, store, batch_size=IMPORT_BATCH, max_entries=IMPORT_MAX_ENTRIES,
+               max_entry_bytes=IMPORT_MAX_ENTRY_BYTES, max_bytes=IMPORT_MAX_BYTES):
+    """
+    Import an export ZIP: the attachments notes.ndjson references go into the
+    store first, then the notes; other entries are never unpacked. Raises
+    TransferError before writing anything if the archive has more than
+    `max_entries` files, one larger than `max_entry_bytes`, or would unpack to
+    more than `max_bytes` in all.
+    """
+    with zipfile.ZipFile(fileobj) as zf:
+        infos = [info for info in zf.infolist() if not info.is_dir()]
+        if len(infos) > max_entries:
+            raise TransferError(f"Too many files in the archive (limit {max_entries})")
+        # reads stop at the declared size, so checking the headers bounds the output
+        if any(info.file_size > max_entry_bytes for info in infos):
+            raise TransferError(f"A file in the archive is too large (limit {max_entry_bytes} bytes)")
+        try:
+            notes = zf.getinfo('notes.ndjson')
+        except KeyError:
+            raise TransferError("The archive has no notes.ndjson")
+        with zf.open(notes) as fh:
+            wanted = _referenced_keys(fh)
+        blobs = {}                  # one entry per referenced key (a name may repeat in a ZIP)
+        for info in infos:
+            name = os.path.basename(info.filename)
+            if info.filename == f'attachments/{name}' and name in wanted:
+                blobs[name] = info
+        if notes.file_size + sum(info.file_size for info in blobs.values()) > max_bytes:
+            raise TransferError(f"The archive unpacks to too much data (limit {max_bytes} bytes)")
+
+        written = set()
+        for name, info in blobs.items():
+            with zf.open(info) as src:
+                # the store re-hashes: an entry whose content doesn't match its
+                # name lands under its real key and its notes report it missing
+                written.add(store.put(src, name)[0])
+        with zf.open(notes) as fh:
+            return import_records(db, user_id, io.TextIOWrapper(fh, encoding='utf-8'), store, batch_size,
+                                  blob_keys=written)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ('export', 'import'):
+        print("usage: python notes_transfer.py export <user_id> [ndjson|zip] > file\n"
+              "       python notes_transfer.py import <user_id> <file>")
+        sys.exit(1)
+    from note import db_pool, attachment_store
+    user_id = int(args[1])
+    with db_pool.connection() as db:
+        if args[0] == 'export':
+            fmt = args[2] if len(args) > 2 else 'ndjson'
+            gen = export_zip(db, user_id, attachment_store) if fmt == 'zip' else export_ndjson(db, user_id)
+            for chunk in gen:
+                sys.stdout.buffer.write(chunk)
+        else:
+            path = args[2]
+            if zipfile.is_zipfile(path):
+                with open(path, 'rb') as fh:
+                    try:
+                        summary = import_zip(db, user_id, fh, attachment_store)
+                    except TransferError as e:
+                        print(f"❌ {e}", file=sys.stderr)
+                        sys.exit(1)
+            else:
+                with open(path, 'rb') as fh:
+                    summary = import_records(db, user_id, fh, attachment_store)
+            print(json.dumps(summary), file=sys.stderr)
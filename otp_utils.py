@@ -1,24 +1,222 @@
-# OTP helpers (in-memory, dev-only)
-import random, time
-OTPS = {}   # store: mobile -> {'otp':..., 'created_at':...}
+# OTP helpers with pluggable storage
+#
+#   memory : per-process dict, expired entries swept by a timing wheel (dev / single worker)
+#   sqlite : one SQLite file shared by every worker process on the host
+#
+# Pick with OTP_BACKEND=memory|sqlite (OTP_DB_PATH for the sqlite file) or call
+# set_backend(). Each mobile number gets a failure counter: after
+# MAX_ATTEMPTS wrong guesses the number is locked for LOCKOUT_SECONDS, even if
+# a fresh OTP is requested in between.
+import hmac, os, random, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import closing
+
+MAX_ATTEMPTS = 5
+LOCKOUT_SECONDS = 900
+
 
 def generate_otp():
-    return f"{random.randint(1000,9999)}"
+    return f"{random.SystemRandom().randint(1000,9999)}"
+
+
+class TimingWheel:
+    """
+    Expiry wheel with one-second slots. add() is O(1); advance() only visits
+    the slots for the seconds that have passed, so sweeping costs O(expired)
+    rather than a scan of every live entry.
+    """
+
+    def __init__(self, slots=3600):
+        self.slots = [set() for _ in range(slots)]
+        self.cursor = int(time.time())
+
+    def add(self, key, expires_at):
+        self.slots[int(expires_at) % len(self.slots)].add(key)
+
+    def advance(self, now):
+        """Yield keys from every slot between the last call and `now`."""
+        now = int(now)
+        # after a long idle gap one full turn covers every slot
+        start = max(self.cursor, now - len(self.slots) + 1)
+        for second in range(start, now + 1):
+            slot = self.slots[second % len(self.slots)]
+            if slot:
+                keys = list(slot)
+                slot.clear()
+                yield from keys
+        self.cursor = now + 1
+
+
+class MemoryOTPBackend:
+    """In-process store. Bounded: the oldest entries are evicted past max_entries."""
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._otps = OrderedDict()      # mobile -> (otp, expires_at, attempts)
+        self._failures = {}             # mobile -> (count, window_ends_at)
+        self._wheel = TimingWheel()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        for mobile in self._wheel.advance(now):
+            entry = self._otps.get(mobile)
+            if entry and entry[1] <= now:
+                del self._otps[mobile]
+            elif entry:
+                self._wheel.add(mobile, entry[1])   # re-armed for a later turn of the wheel
+            fail = self._failures.get(mobile)
+            if fail and fail[1] <= now:
+                del self._failures[mobile]
+            elif fail:
+                self._wheel.add(mobile, fail[1])
+
+    def save(self, mobile, otp, validity_seconds):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._otps.pop(mobile, None)
+            self._otps[mobile] = (otp, now + validity_seconds, 0)
+            self._wheel.add(mobile, now + validity_seconds)
+            while len(self._otps) > self.max_entries:
+                self._otps.popitem(last=False)
+
+    def verify(self, mobile, user_otp):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            count, window_end = self._failures.get(mobile, (0, 0))
+            if count >= MAX_ATTEMPTS and window_end > now:
+                return False
+            entry = self._otps.get(mobile)
+            if not entry or entry[1] <= now:
+                self._otps.pop(mobile, None)
+                return False
+            if hmac.compare_digest(entry[0], user_otp):
+                del self._otps[mobile]
+                self._failures.pop(mobile, None)
+                return True
+            if window_end <= now:
+                count = 0
+            self._failures[mobile] = (count + 1, now + LOCKOUT_SECONDS)
+            self._wheel.add(mobile, now + LOCKOUT_SECONDS)
+            if count + 1 >= MAX_ATTEMPTS:
+                del self._otps[mobile]
+            return False
+
+    def get(self, mobile):
+        entry = self._otps.get(mobile)
+        return entry[0] if entry and entry[1] > time.time() else None
+
+
+class SQLiteOTPBackend:
+    """
+    Store shared by all processes on one host. Expired rows are removed in
+    small batches through an index on expires_at; the table is capped at
+    max_entries rows.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS otps (
+        mobile     TEXT PRIMARY KEY,
+        otp        TEXT,
+        expires_at REAL NOT NULL,
+        failures   INTEGER NOT NULL DEFAULT 0,
+        locked_until REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_otps_expires ON otps (expires_at);
+    """
+
+    def __init__(self, path, max_entries=100_000, sweep_batch=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.sweep_batch = sweep_batch
+        with closing(self._db()) as db:
+            db.executescript(self.SCHEMA)
+
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _sweep(self, db, now):
+        # a row lives until both its OTP and any lockout have expired
+        db.execute("""
+            DELETE FROM otps WHERE rowid IN (
+                SELECT rowid FROM otps WHERE expires_at <= ? AND locked_until <= ? LIMIT ?)
+        """, (now, now, self.sweep_batch))
+
+    def save(self, mobile, otp, validity_seconds):
+        now = time.time()
+        with closing(self._db()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            self._sweep(db, now)
+            db.execute("""
+                INSERT INTO otps (mobile, otp, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(mobile) DO UPDATE SET otp=excluded.otp,
+                    expires_at=MAX(excluded.expires_at, otps.locked_until)
+            """, (mobile, otp, now + validity_seconds))
+            db.execute("""
+                DELETE FROM otps WHERE rowid IN (
+                    SELECT rowid FROM otps ORDER BY expires_at
+                    LIMIT MAX(0, (SELECT COUNT(*) FROM otps) - ?))
+            """, (self.max_entries,))
+            db.execute("COMMIT")
+
+    def verify(self, mobile, user_otp):
+        now = time.time()
+        with closing(self._db()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT otp, expires_at, failures, locked_until FROM otps WHERE mobile=?",
+                             (mobile,)).fetchone()
+            ok = False
+            if row:
+                otp, expires_at, failures, locked_until = row
+                if locked_until > now:
+                    pass
+                elif otp and expires_at > now and hmac.compare_digest(otp, user_otp):
+                    db.execute("DELETE FROM otps WHERE mobile=?", (mobile,))
+                    ok = True
+                elif otp and expires_at > now:
+                    failures += 1
+                    if failures >= MAX_ATTEMPTS:
+                        # burn the OTP and lock the number
+                        db.execute("UPDATE otps SET otp=NULL, failures=0, locked_until=?, expires_at=? WHERE mobile=?",
+                                   (now + LOCKOUT_SECONDS, now + LOCKOUT_SECONDS, mobile))
+                    else:
+                        db.execute("UPDATE otps SET failures=? WHERE mobile=?", (failures, mobile))
+            db.execute("COMMIT")
+            return ok
+
+    def get(self, mobile):
+        with closing(self._db()) as db:
+            row = db.execute("SELECT otp FROM otps WHERE mobile=? AND expires_at > ?",
+                             (mobile, time.time())).fetchone()
+        return row[0] if row else None
+
+
+def _default_backend():
+    if os.getenv("OTP_BACKEND", "memory") == "sqlite":
+        return SQLiteOTPBackend(os.getenv("OTP_DB_PATH", os.path.join(os.getcwd(), 'otp_store.db')))
+    return MemoryOTPBackend()
+
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _default_backend()
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
 
 def save_otp(mobile, otp, validity_seconds=300):
-    OTPS[mobile] = {'otp': otp, 'created_at': time.time(), 'validity': validity_seconds}
+    get_backend().save(mobile, otp, validity_seconds)
 
 def verify_otp(mobile, user_otp):
-    data = OTPS.get(mobile)
-    if not data:
-        return False
-    if time.time() - data['created_at'] > data.get('validity', 300):
-        del OTPS[mobile]
-        return False
-    if data['otp'] == user_otp:
-        del OTPS[mobile]
-        return True
-    return False
+    return get_backend().verify(mobile, user_otp)
 
 def get_stored_otp(mobile):
-    return OTPS.get(mobile, {}).get('otp')
+    return get_backend().get(mobile)
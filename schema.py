@@ -0,0 +1,363 @@
+# Versioned database schema (MySQL) and a query-plan check
+#
+# Migrations run in order and are recorded in schema_migrations, so
+# `python schema.py migrate` brings any database to the current version: an
+# empty one, tables created by hand, or one set up with the older per-module
+# commands. MySQL commits DDL as it goes, so every step looks at
+# information_schema first and is safe to re-run after a failure part-way.
+#
+# `check` parses the SQL out of the app's modules, runs EXPLAIN on each
+# SELECT / UPDATE / DELETE against the current database and fails if one has
+# to read a whole table because no index fits it.
+#
+#   python schema.py migrate    apply pending migrations
+#   python schema.py status     list migrations, applied or pending
+#   python schema.py check      EXPLAIN every query; exit 1 on a full table scan
+import ast, os, re, sys
+import attachment_store, note_codec, note_history, search_utils, sync_utils
+
+TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS noteusers (
+        id       INT AUTO_INCREMENT PRIMARY KEY,
+        email    VARCHAR(255) NOT NULL,
+        username VARCHAR(100) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        mobile   VARCHAR(20)  NOT NULL
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notes (
+        id          INT AUTO_INCREMENT PRIMARY KEY,
+        user_id     INT          NOT NULL,
+        title       VARCHAR(255) NOT NULL,
+        content     MEDIUMTEXT,
+        attachments TEXT         NULL,
+        create_at   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB
+    """,
+]
+
+
+class MigrationError(Exception):
+    """A migration can't be applied until the data is fixed by hand."""
+
+
+# ---------- information_schema helpers ----------
+def has_column(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def has_index(cursor, table, columns, unique=False):
+    """Whether some index starts with `columns` (exactly `columns` when unique)."""
+    cursor.execute("""
+        SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME=%s ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    for name, non_unique, column in cursor.fetchall():
+        indexes.setdefault(name, [not non_unique, []])[1].append(column.lower())
+    want = [c.lower() for c in columns]
+    for is_unique, cols in indexes.values():
+        if unique and is_unique and cols == want:
+            return True
+        if not unique and cols[:len(want)] == want:
+            return True
+    return False
+
+
+def add_column(cursor, table, column, definition):
+    if not has_column(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    if not has_index(cursor, table, columns, unique):
+        kind = "UNIQUE KEY" if unique else "INDEX"
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+
+
+# ---------- migrations ----------
+def _base_tables(db):
+    cursor = db.cursor()
+    for ddl in TABLES:
+        cursor.execute(ddl)
+    cursor.close()
+
+
+def _note_version(db):
+    cursor = db.cursor()
+    add_column(cursor, 'notes', 'version', "INT NOT NULL DEFAULT 1")
+    cursor.close()
+
+
+def _sync(db):
+    sync_utils.ensure_schema(db)
+    sync_utils.backfill(db)
+
+
+def _user_unique_keys(db):
+    cursor = db.cursor()
+    for column in ('email', 'username', 'mobile'):
+        if has_index(cursor, 'noteusers', [column], unique=True):
+            continue
+        cursor.execute(f"SELECT {column}, COUNT(*) FROM noteusers GROUP BY {column} HAVING COUNT(*) > 1 LIMIT 5")
+        dupes = cursor.fetchall()
+        if dupes:
+            listed = ', '.join(f"{value!r} x{count}" for value, count in dupes)
+            raise MigrationError(f"noteusers.{column} has duplicates ({listed}); fix them and re-run")
+        add_index(cursor, 'noteusers', f"uq_noteusers_{column}", [column], unique=True)
+    cursor.close()
+
+
+def _note_list_index(db):
+    cursor = db.cursor()
+    # every note listing filters on user_id and sorts by create_at (then id, which InnoDB appends)
+    add_index(cursor, 'notes', 'idx_notes_user_created', ['user_id', 'create_at'])
+    cursor.close()
+
+
+def _fulltext_v1(db):
+    search_utils.ensure_indexes(db, search_utils.FULLTEXT_INDEXES_V1)
+
+
+def _note_bodies(db):
+    note_codec.ensure_schema(db)
+    search_utils.ensure_indexes(db)     # FULLTEXT over content + search_terms
+
+
+MIGRATIONS = [
+    (1, "noteusers and notes tables", _base_tables),
+    (2, "notes.version for optimistic locking", _note_version),
+    (3, "attachment_blobs and note_attachments", attachment_store.ensure_schema),
+    (4, "sync sequences and note_tombstones", _sync),
+    (5, "FULLTEXT indexes for search", _fulltext_v1),
+    (6, "unique email / username / mobile", _user_unique_keys),
+    (7, "notes (user_id, create_at) index", _note_list_index),
+    (8, "compressed note bodies, excerpts and search terms", _note_bodies),
+    (9, "note_revisions", note_history.ensure_schema),
+]
+
+
+def _ensure_table(db):
+    cursor = db.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INT          NOT NULL PRIMARY KEY,
+            name       VARCHAR(200) NOT NULL,
+            applied_at DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+    cursor.close()
+
+
+def applied(db):
+    """{version: applied_at} of the migrations already run."""
+    _ensure_table(db)
+    cursor = db.cursor()
+    cursor.execute("SELECT version, applied_at FROM schema_migrations")
+    done = dict(cursor.fetchall())
+    cursor.close()
+    return done
+
+
+def migrate(db):
+    """Apply pending migrations in order. Returns the versions applied."""
+    done = applied(db)
+    ran = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        step(db)
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        db.commit()
+        cursor.close()
+        ran.append(version)
+    return ran
+
+
+# ---------- query-plan check ----------
+CHECKED_MODULES = ['note.py', 'note_ops.py', 'sync_utils.py', 'search_utils.py', 'attachment_store.py',
+                   'notes_transfer.py', 'upload_reconciler.py', 'note_codec.py',
+                   'note_history.py']
+
+# one-off maintenance that reads everything on purpose: (module, function)
+SCAN_OK = {
+    ('sync_utils.py', 'backfill'),
+    ('attachment_store.py', 'migrate_legacy'),
+    ('note_codec.py', 'status'),
+    ('note_history.py', 'history_stats'),
+}
+
+_CHECKED_VERBS = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def _render(node, env):
+    """Possible SQL texts of an expression ('%s' stands in for f-string fields), or []."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif parts and parts[-1].rstrip().upper().endswith('SET'):
+                parts.append('id=id')       # SET {column list}: any assignment gives the same plan
+            else:
+                parts.append('%s')          # IN ({marks}) and the like
+        return [''.join(parts)]
+    if isinstance(node, ast.Name):
+        return env.get(node.id, [])
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return [a + b for a in _render(node.left, env) for b in _render(node.right, env)]
+    return []
+
+
+class _QueryCollector(ast.NodeVisitor):
+    """Collects (function, line, sql) for every cursor.execute() in a module."""
+
+    def __init__(self):
+        self.queries = []
+        self._func = '<module>'
+        self._env = {}
+
+    def visit_FunctionDef(self, node):
+        outer = (self._func, self._env)
+        self._func, self._env = node.name, {}
+        self.generic_visit(node)
+        self._func, self._env = outer
+
+    def visit_Assign(self, node):
+        texts = _render(node.value, self._env)
+        for target in node.targets:
+            if isinstance(target, ast.Name) and texts:
+                # keep earlier variants too: if/else branches build different statements
+                self._env[target.id] = self._env.get(target.id, []) + texts
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name) and isinstance(node.op, ast.Add) and node.target.id in self._env:
+            extra = _render(node.value, self._env)
+            if extra:
+                variants = self._env[node.target.id]
+                variants[-1] += extra[0]
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute) and node.func.attr == 'execute' and node.args:
+            for sql in _render(node.args[0], self._env):
+                self.queries.append((self._func, node.lineno, sql))
+        self.generic_visit(node)
+
+
+def collect_queries(root='.'):
+    """(module, function, line, sql) for the SELECT/UPDATE/DELETE statements in CHECKED_MODULES."""
+    found = []
+    for module in CHECKED_MODULES:
+        with open(os.path.join(root, module)) as fh:
+            tree = ast.parse(fh.read(), module)
+        collector = _QueryCollector()
+        collector.visit(tree)
+        for func, line, sql in collector.queries:
+            sql = ' '.join(sql.split())
+            if sql.split(' ', 1)[0].upper() in _CHECKED_VERBS and 'information_schema' not in sql:
+                found.append((module, func, line, sql))
+    return found
+
+
+def _explainable(sql):
+    """The statement with literal LIMIT/OFFSET and the number of remaining placeholders."""
+    sql = re.sub(r"\bLIMIT %s OFFSET %s", "LIMIT 1 OFFSET 0", sql, flags=re.I)
+    sql = re.sub(r"\bLIMIT %s", "LIMIT 1", sql, flags=re.I)
+    return sql, sql.count('%s')
+
+
+def explain(db, sql, sqlite=False):
+    """(full_scans, index_scans) table names in the plan of `sql`."""
+    sql, count = _explainable(sql)
+    params = ['1'] * count          # a string compares fine with INT columns and keeps VARCHAR keys usable
+    cursor = db.cursor(dictionary=True)
+    full, index = [], []
+    try:
+        if sqlite:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            for row in cursor.fetchall():
+                m = re.match(r"SCAN (\w+)( USING (COVERING )?INDEX)?", row['detail'])
+                if m:
+                    (index if m.group(2) else full).append(m.group(1))
+        else:
+            cursor.execute("EXPLAIN " + sql, params)
+            for row in cursor.fetchall():
+                table = row.get('table') or ''
+                if table.startswith('<'):
+                    continue
+                # a scan the optimizer picked although an index applies (tiny table) isn't a missing index
+                if row.get('type') == 'ALL' and not row.get('possible_keys'):
+                    full.append(table)
+                elif row.get('type') in ('ALL', 'index'):
+                    index.append(table)
+    finally:
+        cursor.close()
+    return full, index
+
+
+def check(db, sqlite=False, root='.'):
+    """EXPLAIN every collected query. Returns (count, failures, warnings, skipped); the lists hold printable lines."""
+    queries = collect_queries(root)
+    failures, warnings, skipped = [], [], []
+    for module, func, line, sql in queries:
+        if (module, func) in SCAN_OK:
+            continue
+        where = f"{module}:{line} {func}()"
+        try:
+            full, index = explain(db, sql, sqlite)
+        except Exception as e:      # dynamic SQL the parser can't reconstruct (e.g. SET {columns})
+            skipped.append(f"{where}: {str(e).splitlines()[0][:80]}")
+            db.rollback()
+            continue
+        if full:
+            failures.append(f"{where}: full scan of {', '.join(full)}\n      {sql[:160]}")
+        elif index:
+            warnings.append(f"{where}: scans {', '.join(index)} (index present; small table?)")
+    db.rollback()       # EXPLAIN of UPDATE/DELETE changes nothing, but leave no transaction open
+    return len(queries), failures, warnings, skipped
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['migrate'], ['status'], ['check']):
+        print("usage: python schema.py migrate | status | check")
+        sys.exit(1)
+    from note import get_db_connection
+    sqlite = os.getenv("DB_BACKEND", "mysql") == "sqlite"
+    db = get_db_connection()
+    if sys.argv[1] == 'check':
+        count, failures, warnings, skipped = check(db, sqlite, os.path.dirname(os.path.abspath(__file__)))
+        for line in warnings:
+            print(f"⚠️ {line}")
+        for line in skipped:
+            print(f"…  not checked: {line}")
+        for line in failures:
+            print(f"❌ {line}")
+        db.close()
+        print(f"{'❌' if failures else '✅'} {count} queries, {len(skipped)} not checked, "
+              f"{len(failures)} full table scans")
+        sys.exit(1 if failures else 0)
+    if sqlite:
+        print("✅ SQLite stand-in: the schema is created at startup (sqlite_backend.SCHEMA)")
+    elif sys.argv[1] == 'status':
+        done = applied(db)
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:>3}  {'applied ' + str(done[version]) if version in done else 'pending':<28} {name}")
+    else:
+        try:
+            ran = migrate(db)
+        except MigrationError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Schema at version {MIGRATIONS[-1][0]} (applied: {', '.join(map(str, ran)) or 'none'})")
+    db.close()
@@ -0,0 +1,148 @@
+# Full-text note search backed by InnoDB FULLTEXT indexes
+#
+# InnoDB keeps FULLTEXT indexes up to date on every INSERT / UPDATE / DELETE,
+# so add_note, edit_note and delete_note feed the index incrementally inside
+# their own transactions. `python search_utils.py rebuild` creates the
+# indexes on an existing table and rebuilds them from the stored rows.
+import re, sys
+
+TITLE_BOOST = 3.0
+SEARCH_PAGE_SIZE = 20
+MIN_TERM_LEN = 3        # innodb_ft_min_token_size default; shorter terms fall back to LIKE
+
+# (index name, columns) — title/body alone for ranking, combined for matching. A
+# compressed body's words are in search_terms (note_codec), a plain one's in content.
+FULLTEXT_INDEXES = [
+    ('ft_notes_title_body', 'title, content, search_terms'),
+    ('ft_notes_title', 'title'),
+    ('ft_notes_body', 'content, search_terms'),
+]
+# the set before bodies could be compressed (schema migration 5; migration 8 swaps it)
+FULLTEXT_INDEXES_V1 = [
+    ('ft_notes_title_content', 'title, content'),
+    ('ft_notes_title', 'title'),
+    ('ft_notes_content', 'content'),
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(query):
+    """Lower-cased search terms, de-duplicated in order."""
+    seen = []
+    for term in _TOKEN_RE.findall(query.lower()):
+        if term not in seen:
+            seen.append(term)
+    return seen
+
+
+def build_boolean_query(terms):
+    """
+    Turn plain terms into a BOOLEAN MODE expression: every term is required
+    and prefix-matched ('+note* +meet*'). Operator characters never reach
+    MySQL because tokenize() only keeps word characters.
+    """
+    return ' '.join(f"+{t}*" for t in terms)
+
+
+def fulltext_search(cursor, user_id, query, page=1, per_page=SEARCH_PAGE_SIZE, excerpt_len=120):
+    """
+    Ranked search over a user's notes. Returns (rows, has_more).
+
+    Rows carry id, title, create_at, excerpt, truncated and score, ordered by
+    relevance (title matches weighted by TITLE_BOOST) and then recency.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return [], False
+    offset = (max(page, 1) - 1) * per_page
+    limit = per_page + 1
+
+    indexable = [t for t in terms if len(t) >= MIN_TERM_LEN]
+    if indexable:
+        expr = build_boolean_query(indexable)
+        sql = """
+            SELECT id, title, create_at,
+                   LEFT(excerpt, %s) AS excerpt,
+                   content_chars > %s AS truncated,
+                   MATCH(title) AGAINST(%s IN BOOLEAN MODE) * %s
+                     + MATCH(content, search_terms) AGAINST(%s IN BOOLEAN MODE) AS score
+            FROM notes
+            WHERE user_id=%s AND MATCH(title, content, search_terms) AGAINST(%s IN BOOLEAN MODE)
+        """
+        params = [excerpt_len, excerpt_len, expr, TITLE_BOOST, expr, user_id, expr]
+        # terms below the FULLTEXT token size still have to match somewhere
+        for t in terms:
+            if t not in indexable:
+                sql += " AND (title LIKE %s OR content LIKE %s OR search_terms LIKE %s)"
+                params += [f"%{t}%"] * 3
+        sql += " ORDER BY score DESC, create_at DESC, id DESC LIMIT %s OFFSET %s"
+        params += [limit, offset]
+    else:
+        # nothing indexable (e.g. 'ai', 'go'): old substring behaviour
+        sql = """
+            SELECT id, title, create_at,
+                   LEFT(excerpt, %s) AS excerpt,
+                   content_chars > %s AS truncated,
+                   0 AS score
+            FROM notes
+            WHERE user_id=%s
+        """
+        params = [excerpt_len, excerpt_len, user_id]
+        for t in terms:
+            sql += " AND (title LIKE %s OR content LIKE %s OR search_terms LIKE %s)"
+            params += [f"%{t}%"] * 3
+        sql += " ORDER BY create_at DESC, id DESC LIMIT %s OFFSET %s"
+        params += [limit, offset]
+
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    return rows[:per_page], len(rows) > per_page
+
+
+def ensure_indexes(db, indexes=None):
+    """
+    Create any missing FULLTEXT index of `indexes` (default: the current set)
+    and drop the older ones it replaces. Returns the names created.
+    """
+    indexes = FULLTEXT_INDEXES if indexes is None else indexes
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'notes'
+    """)
+    existing = {row[0] for row in cursor.fetchall()}
+    created = []
+    for name, columns in indexes:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE notes ADD FULLTEXT INDEX {name} ({columns})")
+            created.append(name)
+    wanted = {name for name, _ in indexes}
+    for name, _ in FULLTEXT_INDEXES_V1 + FULLTEXT_INDEXES:
+        if name in existing and name not in wanted:
+            cursor.execute(f"ALTER TABLE notes DROP INDEX {name}")
+            existing.discard(name)
+    cursor.close()
+    return created
+
+
+def rebuild(db):
+    """Create missing indexes, then rebuild them from the existing rows."""
+    created = ensure_indexes(db)
+    cursor = db.cursor()
+    # With innodb_optimize_fulltext_only=OFF this rebuilds the table and its indexes
+    cursor.execute("OPTIMIZE TABLE notes")
+    cursor.fetchall()
+    cursor.close()
+    return created
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        print("usage: python search_utils.py rebuild")
+        sys.exit(1)
+    from note import get_db_connection
+    db = get_db_connection()
+    names = rebuild(db)
+    db.close()
+    print(f"✅ Search index rebuilt (created: {', '.join(names) or 'none'})")
@@ -0,0 +1,215 @@
+# SQLite stand-in for MySQL (benchmarks, local development)
+#
+# Enabled with DB_BACKEND=sqlite (DB_SQLITE_PATH=flaskdb.sqlite3). connect()
+# returns an object shaped like a mysql.connector connection, and the MySQL
+# dialect used in note.py is rewritten on the fly:
+#   %s -> ?,  NOW(), LEFT() -> LEFT_STR(), CHAR_LENGTH(),  ON DUPLICATE KEY UPDATE -> ON CONFLICT
+#   (VALUES(col) -> excluded.col),
+#   FOR UPDATE dropped,  MATCH(...) AGAINST(? IN BOOLEAN MODE) -> a Python scorer
+# and unique-key violations raise mysql.connector's IntegrityError (ER_DUP_ENTRY).
+# It is meant for load testing the app without a MySQL server, not for production.
+import re, sqlite3
+from datetime import datetime
+from mysql.connector import errorcode, IntegrityError
+
+TIME_FMT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS noteusers (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    email    TEXT NOT NULL UNIQUE,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    mobile   TEXT NOT NULL UNIQUE,
+    change_seq INTEGER NOT NULL DEFAULT 0,
+    sync_floor INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id     INTEGER NOT NULL,
+    title       TEXT NOT NULL,
+    content     TEXT,
+    attachments TEXT,
+    create_at   DATETIME NOT NULL,
+    version     INTEGER NOT NULL DEFAULT 1,
+    updated_at  DATETIME,
+    change_seq  INTEGER NOT NULL DEFAULT 0,
+    content_z      BLOB,
+    content_format INTEGER NOT NULL DEFAULT 0,
+    excerpt        TEXT NOT NULL DEFAULT '',
+    content_chars  INTEGER NOT NULL DEFAULT 0,
+    search_terms   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notes_user_created ON notes (user_id, create_at);
+CREATE INDEX IF NOT EXISTS idx_notes_format_chars ON notes (content_format, content_chars);
+CREATE INDEX IF NOT EXISTS idx_notes_user_seq ON notes (user_id, change_seq);
+CREATE TABLE IF NOT EXISTS note_tombstones (
+    user_id    INTEGER NOT NULL,
+    note_id    INTEGER NOT NULL,
+    change_seq INTEGER NOT NULL,
+    deleted_at DATETIME NOT NULL,
+    PRIMARY KEY (user_id, note_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_user_seq ON note_tombstones (user_id, change_seq);
+CREATE INDEX IF NOT EXISTS idx_tombstones_deleted ON note_tombstones (deleted_at);
+CREATE TABLE IF NOT EXISTS attachment_blobs (
+    blob_key   TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    refcount   INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS note_attachments (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_id    INTEGER NOT NULL,
+    blob_key   TEXT NOT NULL,
+    filename   TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_note_attachments_note ON note_attachments (note_id);
+CREATE INDEX IF NOT EXISTS idx_note_attachments_blob ON note_attachments (blob_key);
+CREATE TABLE IF NOT EXISTS note_revisions (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_id  INTEGER NOT NULL,
+    revision INTEGER NOT NULL,
+    kind     INTEGER NOT NULL,
+    base_id  INTEGER,
+    title    TEXT NOT NULL,
+    data     BLOB NOT NULL,
+    chars    INTEGER NOT NULL,
+    saved_at DATETIME NOT NULL,
+    UNIQUE (note_id, revision)
+);
+CREATE INDEX IF NOT EXISTS idx_note_revisions_saved ON note_revisions (saved_at);
+"""
+
+sqlite3.register_adapter(datetime, lambda d: d.strftime(TIME_FMT))
+
+
+def _parse_time(raw):
+    text = raw.decode()
+    for fmt in (TIME_FMT, '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    return text
+
+
+sqlite3.register_converter('DATETIME', _parse_time)
+
+
+# ---------- MySQL functions ----------
+def _match_against(query, *columns):
+    """Rough BOOLEAN MODE scorer: every '+term*' must prefix-match a word."""
+    terms = [t.strip('+*').lower() for t in (query or '').split() if t.strip('+*')]
+    words = ' '.join(c or '' for c in columns).lower().split()
+    score = 0.0
+    for term in terms:
+        hits = sum(1 for w in words if w.startswith(term))
+        if not hits:
+            return 0.0
+        score += hits
+    return score
+
+
+_MATCH_RE = re.compile(r"MATCH\(([^)]*)\)\s*AGAINST\(\s*\?\s*IN BOOLEAN MODE\s*\)", re.I)
+
+
+def translate(sql):
+    """Rewrite the MySQL dialect used by the app into SQLite."""
+    sql = sql.replace('%s', '?')
+    sql = _MATCH_RE.sub(lambda m: f"MATCH_AGAINST(?, {m.group(1)})", sql)
+    sql = re.sub(r"ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET", sql, flags=re.I)
+    sql = re.sub(r"\bVALUES\((\w+)\)", r"excluded.\1", sql)     # VALUES(col) in the update list
+    sql = re.sub(r"\s+FOR UPDATE\b", "", sql, flags=re.I)
+    sql = re.sub(r"\bLEFT\(", "LEFT_STR(", sql)    # LEFT is reserved (LEFT JOIN) in SQLite
+    return sql
+
+
+# ---------- connector-shaped wrappers ----------
+class Cursor:
+    def __init__(self, conn, dictionary=False):
+        self._cur = conn.cursor()
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def execute(self, sql, params=()):
+        try:
+            self._cur.execute(translate(sql), tuple(params or ()))
+        except sqlite3.IntegrityError as e:
+            # surface unique violations the way mysql.connector does (errno 1062)
+            if 'UNIQUE' not in str(e):
+                raise
+            raise IntegrityError(msg=str(e), errno=errorcode.ER_DUP_ENTRY) from e
+
+    def executemany(self, sql, seq):
+        self._cur.executemany(translate(sql), [tuple(p) for p in seq])
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cur.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cur.fetchall()]
+
+    def __iter__(self):
+        return (self._row(r) for r in self._cur)
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.create_function('NOW', 0, lambda: datetime.now().strftime(TIME_FMT))
+        self._conn.create_function('LEFT_STR', 2, lambda s, n: s[:n] if s is not None else None)
+        self._conn.create_function('CHAR_LENGTH', 1, lambda s: len(s) if s is not None else None)
+        self._conn.create_function('MATCH_AGAINST', -1, _match_against)
+
+    def cursor(self, dictionary=False, buffered=None):
+        return Cursor(self._conn, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(path):
+    return Connection(path)
+
+
+def ensure_schema(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
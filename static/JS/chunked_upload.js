@@ -0,0 +1,130 @@
+// Resumable chunked uploads (see chunked_upload.py / the /uploads routes)
+//
+// const up = new ChunkedUpload('recording.webm');   // size unknown while recording
+// await up.start();
+// up.push(blob); up.push(blob2);                      // sent in order, in the background
+// const id = await up.finish();                       // checksum + complete -> upload_id
+
+class ChunkedUpload {
+  constructor(filename, size = null) {
+    this.filename = filename;
+    this.size = size;
+    this.parts = [];          // everything pushed so far (kept for resends)
+    this.pushed = 0;          // bytes pushed by the caller
+    this.sent = 0;            // bytes the server has acknowledged
+    this.maxChunk = 4 * 1024 * 1024;
+    this.sending = Promise.resolve();
+    this.onprogress = null;
+  }
+
+  async start() {
+    const res = await fetch('/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: this.filename, size: this.size }),
+    });
+    const info = await res.json();
+    if (!res.ok) throw new Error(info.error || 'Could not start upload');
+    this.id = info.upload_id;
+    this.maxChunk = Math.min(this.maxChunk, info.max_chunk);
+    return this;
+  }
+
+  push(blob) {
+    this.parts.push(blob);
+    this.pushed += blob.size;
+    this.sending = this.sending.then(() => this._drain());
+    return this.sending;
+  }
+
+  async _drain(final = false) {
+    while (this.sent < this.pushed) {
+      const all = new Blob(this.parts);
+      const end = Math.min(this.sent + this.maxChunk, this.pushed);
+      const total = final ? this.pushed : (this.size ?? '*');
+      await this._sendRange(all.slice(this.sent, end), this.sent, end - 1, total);
+      if (this.onprogress) this.onprogress(this.sent, this.size ?? this.pushed);
+    }
+  }
+
+  async _sendRange(chunk, start, end, total, attempt = 0) {
+    try {
+      const res = await fetch(`/uploads/${this.id}`, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${start}-${end}/${total}` },
+        body: chunk,
+      });
+      const info = await res.json();
+      if (res.ok) { this.sent = info.offset; return; }
+      if (res.status === 409 && info.offset !== undefined) { this.sent = info.offset; return; }
+      throw new Error(info.error || `Upload failed (${res.status})`);
+    } catch (err) {
+      if (attempt >= 5) throw err;
+      // back off, then ask the server where we really are and resume from there
+      await new Promise(r => setTimeout(r, 500 * 2 ** attempt));
+      const res = await fetch(`/uploads/${this.id}`);
+      if (res.ok) this.sent = (await res.json()).offset;
+      if (this.sent > start) return;
+      return this._sendRange(chunk, start, end, total, attempt + 1);
+    }
+  }
+
+  async finish() {
+    await this.sending;
+    await this._drain(true);
+    const digest = await crypto.subtle.digest('SHA-256', await new Blob(this.parts).arrayBuffer());
+    const sha256 = [...new Uint8Array(digest)].map(b => b.toString(16).padStart(2, '0')).join('');
+    const res = await fetch(`/uploads/${this.id}/complete`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sha256 }),
+    });
+    const info = await res.json();
+    if (!res.ok) throw new Error(info.error || 'Upload could not be completed');
+    return info.upload_id;
+  }
+}
+
+// Upload a File in chunks; resolves to its upload_id.
+async function uploadFileChunked(file, onprogress) {
+  const up = await new ChunkedUpload(file.name, file.size).start();
+  up.onprogress = onprogress;
+  up.push(file);
+  return up.finish();
+}
+
+// Add a hidden upload_ids field so add_note / edit_note attach the upload.
+function addUploadId(form, uploadId) {
+  const input = document.createElement('input');
+  input.type = 'hidden';
+  input.name = 'upload_ids';
+  input.value = uploadId;
+  form.appendChild(input);
+}
+
+// On submit, send files above `threshold` bytes through the chunked API and
+// post only the small ones with the form itself.
+function chunkLargeFilesOnSubmit(form, fileInput, threshold = 8 * 1024 * 1024) {
+  form.addEventListener('submit', async (e) => {
+    const large = [...fileInput.files].filter(f => f.size > threshold);
+    if (!large.length || form.dataset.chunked === 'done') return;
+    e.preventDefault();
+    const submitBtn = form.querySelector('[type="submit"]');
+    if (submitBtn) submitBtn.disabled = true;
+    try {
+      for (const file of large) {
+        addUploadId(form, await uploadFileChunked(file, (sent, total) => {
+          if (submitBtn) submitBtn.textContent = `Uploading ${file.name}… ${Math.floor(100 * sent / total)}%`;
+        }));
+      }
+      const small = new DataTransfer();
+      [...fileInput.files].filter(f => f.size <= threshold).forEach(f => small.items.add(f));
+      fileInput.files = small.files;
+      form.dataset.chunked = 'done';
+      form.submit();
+    } catch (err) {
+      alert(`Upload failed: ${err.message}`);
+      if (submitBtn) submitBtn.disabled = false;
+    }
+  });
+}
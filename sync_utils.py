@@ -0,0 +1,237 @@
+# Incremental sync: change sequence + tombstones
+#
+# Every write to a note takes the next number from its owner's counter
+# (noteusers.change_seq) and stamps it on the row (notes.change_seq), so
+# "what changed since N" is an index range scan on (user_id, change_seq).
+# Deletes leave a row in note_tombstones carrying their own sequence number.
+# Bumping the counter locks the owner's row until commit, so sequence order
+# is commit order and a client can never skip a change by syncing mid-write.
+#
+# Tombstones older than TOMBSTONE_TTL_DAYS are compacted in the background; the
+# highest compacted sequence is kept per user (noteusers.sync_floor) so a
+# client whose cursor predates it is told to resync from scratch.
+#
+#   python sync_utils.py migrate    add columns/table and backfill sequences
+#   python sync_utils.py compact    drop expired tombstones now
+import sys, threading, time
+from datetime import datetime, timedelta
+from attachment_store import static_path
+from note_codec import decode_body
+
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
+COLUMNS = [
+    ('notes', 'updated_at', "ALTER TABLE notes ADD COLUMN updated_at DATETIME NULL"),
+    ('notes', 'change_seq', "ALTER TABLE notes ADD COLUMN change_seq BIGINT NOT NULL DEFAULT 0, "
+                            "ADD INDEX idx_notes_user_seq (user_id, change_seq)"),
+    ('noteusers', 'change_seq', "ALTER TABLE noteusers ADD COLUMN change_seq BIGINT NOT NULL DEFAULT 0"),
+    ('noteusers', 'sync_floor', "ALTER TABLE noteusers ADD COLUMN sync_floor BIGINT NOT NULL DEFAULT 0"),
+]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS note_tombstones (
+        user_id    INT      NOT NULL,
+        note_id    INT      NOT NULL,
+        change_seq BIGINT   NOT NULL,
+        deleted_at DATETIME NOT NULL,
+        PRIMARY KEY (user_id, note_id),
+        KEY idx_tombstones_user_seq (user_id, change_seq),
+        KEY idx_tombstones_deleted (deleted_at)
+    ) ENGINE=InnoDB
+    """,
+]
+
+
+class CursorExpired(Exception):
+    """The client's cursor is older than the compacted tombstones: full resync needed."""
+
+
+# ---------- write side (inside the caller's transaction) ----------
+def next_seq(cursor, user_id, count=1):
+    """Reserve `count` sequence numbers for user_id; returns the last one."""
+    cursor.execute("UPDATE noteusers SET change_seq = change_seq + %s WHERE id=%s", (count, user_id))
+    cursor.execute("SELECT change_seq FROM noteusers WHERE id=%s", (user_id,))
+    row = cursor.fetchone()
+    return row['change_seq'] if isinstance(row, dict) else row[0]
+
+
+def touch_note(cursor, user_id, note_id):
+    """Mark a note changed without touching its fields (e.g. an attachment was added)."""
+    seq = next_seq(cursor, user_id)
+    cursor.execute("UPDATE notes SET change_seq=%s, updated_at=NOW() WHERE id=%s AND user_id=%s",
+                   (seq, note_id, user_id))
+    return seq
+
+
+def record_tombstone(cursor, user_id, note_id, seq):
+    cursor.execute("""
+        INSERT INTO note_tombstones (user_id, note_id, change_seq, deleted_at) VALUES (%s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE change_seq = VALUES(change_seq), deleted_at = VALUES(deleted_at)
+    """, (user_id, note_id, seq))
+
+
+# ---------- read side ----------
+def parse_cursor(value):
+    """'' / None -> 0 (everything); raises ValueError on garbage."""
+    seq = int(value or 0)
+    if seq < 0:
+        raise ValueError(value)
+    return seq
+
+
+def changes_since(cursor, user_id, since, limit=SYNC_PAGE_SIZE):
+    """
+    Notes written and notes deleted after sequence `since`, oldest change first,
+    at most `limit` of them. Returns {'notes', 'deleted', 'cursor', 'has_more'};
+    the next call passes 'cursor' back as `since`. Expects a dictionary cursor.
+    """
+    cursor.execute("SELECT sync_floor FROM noteusers WHERE id=%s", (user_id,))
+    user = cursor.fetchone()
+    if since and user and since < user['sync_floor']:
+        raise CursorExpired()
+
+    cursor.execute("""
+        SELECT id, title, content, content_format, content_z, version, create_at, updated_at, change_seq
+        FROM notes WHERE user_id=%s AND change_seq > %s
+        ORDER BY change_seq LIMIT %s
+    """, (user_id, since, limit + 1))
+    notes = cursor.fetchall()
+    cursor.execute("""
+        SELECT note_id, change_seq FROM note_tombstones
+        WHERE user_id=%s AND change_seq > %s
+        ORDER BY change_seq LIMIT %s
+    """, (user_id, since, limit + 1))
+    deleted = cursor.fetchall()
+
+    # merge the two streams by sequence and cut at `limit`
+    merged = sorted([('note', n['change_seq'], n) for n in notes] +
+                    [('deleted', d['change_seq'], d) for d in deleted], key=lambda c: c[1])
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    out_notes = [decode_body(c[2]) for c in merged if c[0] == 'note']
+    out_deleted = [c[2]['note_id'] for c in merged if c[0] == 'deleted']
+    new_cursor = merged[-1][1] if merged else since
+
+    if out_notes:
+        ids = [n['id'] for n in out_notes]
+        marks = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"""
+            SELECT note_id, id, blob_key, filename, size FROM note_attachments
+            WHERE note_id IN ({marks}) ORDER BY id
+        """, ids)
+        by_note = {}
+        for att in cursor.fetchall():
+            att['path'] = static_path(att['blob_key'])
+            by_note.setdefault(att.pop('note_id'), []).append(att)
+        for n in out_notes:
+            n['attachments'] = by_note.get(n['id'], [])
+    return {'notes': out_notes, 'deleted': out_deleted, 'cursor': str(new_cursor), 'has_more': has_more}
+
+
+# ---------- compaction ----------
+def compact_tombstones(db, ttl_days, batch=1000):
+    """Delete tombstones older than ttl_days, raising each owner's sync_floor. Returns rows removed."""
+    cutoff = datetime.now() - timedelta(days=ttl_days)
+    removed = 0
+    cursor = db.cursor(dictionary=True)
+    while True:
+        cursor.execute("""
+            SELECT user_id, note_id, change_seq FROM note_tombstones
+            WHERE deleted_at < %s ORDER BY deleted_at LIMIT %s
+        """, (cutoff, batch))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        floors = {}
+        for r in rows:
+            floors[r['user_id']] = max(floors.get(r['user_id'], 0), r['change_seq'])
+        for user_id, floor in floors.items():
+            cursor.execute("UPDATE noteusers SET sync_floor = %s WHERE id=%s AND sync_floor < %s",
+                           (floor, user_id, floor))
+        for r in rows:
+            cursor.execute("DELETE FROM note_tombstones WHERE user_id=%s AND note_id=%s AND change_seq=%s",
+                           (r['user_id'], r['note_id'], r['change_seq']))
+        db.commit()
+        removed += len(rows)
+        if len(rows) < batch:
+            break
+    cursor.close()
+    return removed
+
+
+class TombstoneCompactor:
+    """Daemon thread running compact_tombstones every `interval` seconds."""
+
+    def __init__(self, pool, ttl_days=30, interval=3600):
+        self.pool = pool
+        self.ttl_days = ttl_days
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # started on first use so forked workers each get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="tombstone-compactor", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.pool.connection() as db:
+                    compact_tombstones(db, self.ttl_days)
+            except Exception as e:
+                print(f"❌ Tombstone compaction error: {e}")
+
+
+# ---------- migration ----------
+def ensure_schema(db):
+    """Add the sync columns and table if missing. Returns the columns added."""
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('notes', 'noteusers')
+    """)
+    existing = {(t, c) for t, c in cursor.fetchall()}
+    added = []
+    for table, column, ddl in COLUMNS:
+        if (table, column) not in existing:
+            cursor.execute(ddl)
+            added.append(f"{table}.{column}")
+    for ddl in SCHEMA:
+        cursor.execute(ddl)
+    cursor.close()
+    return added
+
+
+def backfill(db):
+    """Give existing notes a sequence (their id) and start each counter past its notes."""
+    cursor = db.cursor()
+    cursor.execute("UPDATE notes SET change_seq = id, updated_at = COALESCE(updated_at, create_at) "
+                   "WHERE change_seq = 0")
+    cursor.execute("""
+        UPDATE noteusers u
+        SET change_seq = GREATEST(u.change_seq, (SELECT COALESCE(MAX(n.change_seq), 0) FROM notes n WHERE n.user_id = u.id))
+    """)
+    db.commit()
+    cursor.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['migrate'], ['compact']):
+        print("usage: python sync_utils.py migrate | compact")
+        sys.exit(1)
+    from note import get_db_connection, tombstone_compactor
+    db = get_db_connection()
+    if sys.argv[1] == 'migrate':
+        added = ensure_schema(db)
+        backfill(db)
+        print(f"✅ Sync columns ready (added: {', '.join(added) or 'none'})")
+    else:
+        print(f"✅ Removed {compact_tombstones(db, tombstone_compactor.ttl_days)} expired tombstones")
+    db.close()
@@ -0,0 +1,102 @@
+"""
+Local SMTP stand-in for development and tests.
+
+Accepts mail on localhost and prints (or just counts) it, so the mail queue
+can be exercised without a real relay:
+
+    python tools/smtp_sink.py --port 1025 [--delay 0.5] [--fail-rate 0.2] [--quiet]
+
+and run the app with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0.
+--delay simulates a slow relay, --fail-rate makes that share of messages
+fail with a temporary 451 error so retries can be observed.
+"""
+import argparse, random, socketserver, threading, time
+
+stats = {'messages': 0, 'rejected': 0}
+stats_lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        opts = self.server.opts
+        self.reply("220 smtp-sink ready")
+        rcpts = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors='replace').strip()
+            verb = cmd.split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                self.reply("250 smtp-sink")
+            elif verb == 'MAIL':
+                rcpts = []
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                rcpts.append(cmd.split(':', 1)[-1].strip())
+                self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    data.append(chunk)
+                if opts.delay:
+                    time.sleep(opts.delay)
+                if random.random() < opts.fail_rate:
+                    with stats_lock:
+                        stats['rejected'] += 1
+                    self.reply("451 Temporary failure (simulated)")
+                    continue
+                with stats_lock:
+                    stats['messages'] += 1
+                    count = stats['messages']
+                if not opts.quiet:
+                    subject = next((l.decode(errors='replace').strip() for l in data
+                                    if l.lower().startswith(b'subject:')), 'Subject: (none)')
+                    print(f"[{count}] to {', '.join(rcpts)} | {subject}")
+                self.reply("250 OK queued")
+            elif verb in ('RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(host='127.0.0.1', port=1025, delay=0.0, fail_rate=0.0, quiet=True):
+    """Start the sink in a background thread and return the server (for tests/benchmarks)."""
+    server = SMTPServer((host, port), SMTPHandler)
+    server.opts = argparse.Namespace(delay=delay, fail_rate=fail_rate, quiet=quiet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=1025)
+    ap.add_argument('--delay', type=float, default=0.0, help="seconds to stall each message")
+    ap.add_argument('--fail-rate', type=float, default=0.0, help="share of messages to reject with 451")
+    ap.add_argument('--quiet', action='store_true')
+    args = ap.parse_args()
+
+    server = SMTPServer((args.host, args.port), SMTPHandler)
+    server.opts = args
+    print(f"📬 SMTP sink listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{stats['messages']} accepted, {stats['rejected']} rejected")
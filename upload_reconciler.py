@@ -0,0 +1,268 @@
+# Reconciliation of the upload store with the database
+#
+# The blob files and attachment_blobs can drift apart: an upload stored before
+# its transaction failed, a crash between a commit and remove(), a completed
+# chunked upload that was never attached. The reconciler walks the store one
+# first-level shard (uploads/ab/) at a time, compares the files with the
+# attachment_blobs rows of the same key range, and
+#
+#   - moves files with no row (and older than `grace`) to uploads/.quarantine/,
+#     deleting them for good after `quarantine_days`
+#   - restores a quarantined file if a row for it shows up again
+#   - reports rows whose file is missing
+#   - removes stale temp files left in uploads/.tmp by interrupted uploads
+#
+# Each shard is a bounded amount of work (one directory listing, paged key
+# queries) and the walk is paced to `rate` files per second; progress is kept
+# in .quarantine/state.json so a restart resumes where it stopped. A lock file
+# keeps concurrent worker processes from running passes at the same time.
+#
+#   python upload_reconciler.py report    full pass, changes nothing
+#   python upload_reconciler.py run       full pass now, unpaced
+import json, os, sys, threading, time
+
+try:
+    import fcntl        # one pass at a time across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+PREFIXES = [f"{i:02x}" for i in range(256)]
+KEY_BATCH = 500
+MISSING_REPORTED = 100      # missing keys kept for stats()/logs
+LATEST_ONLY = {'missing', 'last_pass_seconds'}
+
+
+class UploadReconciler:
+    """
+    Background consistency pass over an AttachmentStore.
+
+      pool            : DB connection pool (attachment_blobs lives there)
+      interval        : seconds between passes
+      grace           : files younger than this are never touched (seconds)
+      quarantine_days : how long unreferenced files are kept before deletion
+      rate            : files examined per second (0 = unpaced)
+      protected       : callable returning blob keys to keep although unreferenced
+      on_quarantine   : callable given the keys moved aside (e.g. drop their previews)
+    """
+
+    def __init__(self, store, pool, interval=6 * 3600, grace=48 * 3600, quarantine_days=7, rate=500,
+                 protected=None, on_quarantine=None):
+        self.store = store
+        self.pool = pool
+        self.interval = interval
+        self.grace = grace
+        self.quarantine_days = quarantine_days
+        self.rate = rate
+        self.protected = protected or (lambda: ())
+        self.on_quarantine = on_quarantine
+        self.root = os.path.join(store.root, '.quarantine')
+        self._state_path = os.path.join(self.root, 'state.json')
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counts = {'passes': 0, 'files_scanned': 0, 'quarantined': 0, 'purged': 0, 'restored': 0,
+                       'missing': 0, 'tmp_removed': 0, 'last_pass_seconds': 0}
+        self.missing_keys = []
+
+    def start(self):
+        # started on first use so forked workers each get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="upload-reconciler", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_pass()
+            except Exception as e:
+                print(f"❌ Upload reconciliation error: {e}")
+
+    # ---------- state ----------
+    def _load_state(self):
+        try:
+            with open(self._state_path) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {'next': 0}
+
+    def _save_state(self, state):
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self._state_path)
+
+    def _quarantine_path(self, blob_key):
+        return os.path.join(self.root, blob_key[:2], blob_key)
+
+    # ---------- one pass ----------
+    def run_pass(self, dry_run=False, paced=True):
+        """
+        Walk every shard once (resuming an interrupted pass). Returns this
+        pass's counts, or None if another process is already running one.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        lock_fh = open(os.path.join(self.root, 'lock'), 'w')
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            state = {'next': 0} if dry_run else self._load_state()
+            totals = dict.fromkeys(('files_scanned', 'quarantined', 'purged', 'restored', 'missing',
+                                    'tmp_removed'), 0)
+            missing = []
+            start = time.time()
+            protected = set(self.protected())
+            with self.pool.connection() as db:
+                cursor = db.cursor(dictionary=True)
+                for i in range(state['next'], len(PREFIXES)):
+                    step_start = time.time()
+                    scanned = self._reconcile_prefix(cursor, PREFIXES[i], protected, totals, missing, dry_run)
+                    db.commit()         # don't hold a read view open across the whole pass
+                    if not dry_run:
+                        self._save_state({'next': i + 1})
+                    if paced and self.rate:
+                        time.sleep(max(0.0, scanned / self.rate - (time.time() - step_start)))
+                cursor.close()
+            self._purge_quarantine(totals, dry_run)
+            self._sweep_tmp(totals, dry_run)
+            if not dry_run:
+                self._save_state({'next': 0})
+
+            totals['last_pass_seconds'] = round(time.time() - start, 1)
+            with self._lock:
+                self.missing_keys = missing[:MISSING_REPORTED]
+                if not dry_run:
+                    for key, value in totals.items():
+                        # missing / duration describe the latest pass, the rest are running totals
+                        self.counts[key] = value if key in LATEST_ONLY else self.counts[key] + value
+                    self.counts['passes'] += 1
+            if missing and not dry_run:
+                print(f"⚠️ {len(missing)} attachment files are missing: {', '.join(missing[:20])}")
+            return totals
+        finally:
+            lock_fh.close()
+
+    def _reconcile_prefix(self, cursor, prefix, protected, totals, missing, dry_run):
+        # files on disk under uploads/<prefix>/*/ with their mtimes
+        on_disk = {}
+        top = os.path.join(self.store.root, prefix)
+        if os.path.isdir(top):
+            for sub in os.scandir(top):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.is_file():
+                        try:
+                            on_disk[entry.name] = entry.stat().st_mtime
+                        except FileNotFoundError:
+                            pass
+        totals['files_scanned'] += len(on_disk)
+
+        # rows of the same key range, paged
+        in_db = set()
+        last = ''
+        while True:
+            cursor.execute("""
+                SELECT blob_key FROM attachment_blobs WHERE blob_key LIKE %s AND blob_key > %s
+                ORDER BY blob_key LIMIT %s
+            """, (prefix + '%', last, KEY_BATCH))
+            rows = [r['blob_key'] for r in cursor.fetchall()]
+            in_db.update(rows)
+            if len(rows) < KEY_BATCH:
+                break
+            last = rows[-1]
+
+        cutoff = time.time() - self.grace
+        candidates = [k for k, mtime in on_disk.items()
+                      if k not in in_db and k not in protected and mtime < cutoff]
+        for i in range(0, len(candidates), KEY_BATCH):
+            self._quarantine(cursor, candidates[i:i + KEY_BATCH], cutoff, totals, dry_run)
+
+        for key in sorted(in_db - on_disk.keys()):
+            held = self._quarantine_path(key)
+            if os.path.exists(held):
+                if not dry_run:
+                    dest = self.store.path(key)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(held, dest)
+                totals['restored'] += 1
+            else:
+                totals['missing'] += 1
+                missing.append(key)
+        return len(on_disk)
+
+    def _quarantine(self, cursor, keys, cutoff, totals, dry_run):
+        # re-check: a request may have attached one of these since the range query
+        marks = ", ".join(["%s"] * len(keys))
+        cursor.execute(f"SELECT blob_key FROM attachment_blobs WHERE blob_key IN ({marks})", keys)
+        referenced = {r['blob_key'] for r in cursor.fetchall()}
+        moved = []
+        for key in keys:
+            if key in referenced:
+                continue
+            src = self.store.path(key)
+            try:
+                if os.path.getmtime(src) >= cutoff:     # re-uploaded meanwhile (put() refreshes mtime)
+                    continue
+                if not dry_run:
+                    dest = self._quarantine_path(key)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(src, dest)
+                    os.utime(dest)                      # mtime = time quarantined
+            except FileNotFoundError:
+                continue
+            moved.append(key)
+        totals['quarantined'] += len(moved)
+        if moved and not dry_run and self.on_quarantine:
+            self.on_quarantine(moved)
+
+    def _purge_quarantine(self, totals, dry_run):
+        cutoff = time.time() - self.quarantine_days * 86400
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        if not dry_run:
+                            os.remove(entry.path)
+                        totals['purged'] += 1
+                except FileNotFoundError:
+                    pass
+
+    def _sweep_tmp(self, totals, dry_run):
+        cutoff = time.time() - self.grace
+        for entry in os.scandir(self.store.tmp_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    if not dry_run:
+                        os.remove(entry.path)
+                    totals['tmp_removed'] += 1
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, progress=self._load_state().get('next', 0))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['report'], ['run']):
+        print("usage: python upload_reconciler.py report | run")
+        sys.exit(1)
+    from note import upload_reconciler
+    dry_run = sys.argv[1] == 'report'
+    totals = upload_reconciler.run_pass(dry_run=dry_run, paced=False)
+    if totals is None:
+        print("⚠️ Another process is running a reconciliation pass")
+        sys.exit(1)
+    verb = "Would quarantine" if dry_run else "Quarantined"
+    print(f"✅ Scanned {totals['files_scanned']} files in {totals['last_pass_seconds']}s: "
+          f"{verb} {totals['quarantined']}, purged {totals['purged']}, restored {totals['restored']}, "
+          f"missing {totals['missing']}, stale temp files {totals['tmp_removed']}")
+    for key in upload_reconciler.missing_keys:
+        print(f"   missing: {key}")